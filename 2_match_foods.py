@@ -1,6 +1,16 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from streaming import converse_streaming
+from rate_limiter import limiter
+from region_router import RegionRouter, regions_from_csvs
+from response_cache import ResponseCache, prompt_hash
+from compaction import compact, restore_response
+from prompt_cache import cache_stats, cache_usage
+from json_extract import extract_json, parse_stats
+from token_estimator import TokenEstimator, load_calibration, pricing_from_csvs
+from results_store import ResultsStore
+from checkpoint import Checkpoint
 import time
 
 # Read system prompt
@@ -17,11 +27,55 @@ models_df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/models/step1.csv')
 models_df = models_df[models_df['model'].notna()]
 models = models_df[['model', 'region', 'input price', 'input price (cache read)', 'output price']].to_dict('records')
 
+# Use converse_stream to record time-to-first-token and output tokens/sec
+use_stream = False
+
+# Route each request to the fastest healthy region the model is listed in,
+# failing over on regional throttling
+use_routing = False
+router = RegionRouter(regions_from_csvs('/home/ubuntu/projects/fatsecret/data/models/*.csv'))
+
+# Serve repeated inputs from the LRU + SQLite response cache, keyed by model,
+# prompt version and canonical input JSON
+use_response_cache = False
+response_cache = ResponseCache('/home/ubuntu/projects/fatsecret/cache/llm_responses.sqlite') if use_response_cache else None
+prompt_version = prompt_hash(system_prompt)
+
+# Send a compacted input (stripped descriptions, short result keys, compact JSON)
+# and restore the stripped fields onto the response
+use_compaction = False
+
+# Pre-flight estimates: predict tokens, cost and latency before each call and
+# reject requests over the model's input limit
+estimator = TokenEstimator(load_calibration('/home/ubuntu/projects/fatsecret/data/models/token_calibration.json'),
+                           pricing_from_csvs('/home/ubuntu/projects/fatsecret/data/models/*.csv'))
+
+# Record each request in the columnar results store as it completes (inputs and
+# responses stored once by content hash) instead of dumping indented JSON per run
+use_results_store = False
+results_store = ResultsStore('/home/ubuntu/projects/fatsecret/outputs3/results.sqlite') if use_results_store else None
+
+# Append each finished row to a JSONL checkpoint (fsynced periodically); a restarted
+# run skips the (model, cache mode, row) keys already in it
+use_checkpoint = False
+checkpoint = Checkpoint('/home/ubuntu/projects/fatsecret/outputs2/2_match_foods_3.checkpoint.jsonl') if use_checkpoint else None
+
 def invoke_batch(input_data, model_id, region, use_cache=False, pricing=None):
-    client = boto3.client("bedrock-runtime", region_name=region)
+    if use_response_cache:
+        start_time = time.time()
+        # Prompt cache and compaction passes are separate experiments, so they never share replies
+        cache_key = response_cache.key(model_id, prompt_version, input_data,
+                                       namespace=f"response/{'prompt_cache' if use_cache else 'no_cache'}/"
+                                                 f"{'compacted' if use_compaction else 'full'}")
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, invocation_time=time.time() - start_time, cost=0.0, response_cache_hit=True)
+    
     #try:
-    start_time = time.time()
-    user_message = json.dumps(input_data, indent=2)
+    if use_compaction:
+        user_message, compaction_state = compact(input_data, step=2, model_id=model_id)
+    else:
+        user_message, compaction_state = json.dumps(input_data, indent=2), None
     
     if use_cache:
         messages = [
@@ -34,7 +88,7 @@ def invoke_batch(input_data, model_id, region, use_cache=False, pricing=None):
                         {"role": "user", "content": [{"text": user_message}]},
                     {"role": "assistant","content": [{"text": " Here is the JSON response: ```json"}]}]
     
-    response = client.converse(
+    request = dict(
         modelId=model_id,
         messages=messages,
         inferenceConfig={
@@ -43,29 +97,59 @@ def invoke_batch(input_data, model_id, region, use_cache=False, pricing=None):
             "topP": 0.9,
         }
     )
+    estimate = estimator.estimate(model_id, request, foods=len(input_data.get('foods', [])))
+    if not estimate["fits"]:
+        raise ValueError(f"Request of ~{estimate['input_tokens']} input tokens exceeds the input limit of {model_id}")
+    
+    def send(call_region):
+        client = get_client(call_region, max_attempts=1)
+        return limiter.timed_call(
+            model_id, call_region,
+            lambda: converse_streaming(client, **request) if use_stream else client.converse(**request),
+            retries=1 if use_routing else 4
+        )
+    
+    if use_routing:
+        response, invocation_time, region = router.call(model_id, send, default_region=region)
+    else:
+        response, invocation_time = send(region)
     
-    invocation_time = time.time() - start_time
     response_text = response["output"]["message"]["content"][0]["text"]
     input_tokens = response["usage"]["inputTokens"]
     output_tokens = response["usage"]["outputTokens"]
+    streaming = response.get("streaming", {})
     
-    # Extract JSON from response text (remove markdown formatting)
-    json_start = response_text.find('{')
-    json_end = response_text.rfind('}') + 1
-    json_content = response_text[json_start:json_end]
-    response_json = json.loads(json_content)
-    # Calculate cost using pricing from CSV
-    input_price = float(pricing['input price (cache read)'].replace('$', '')) if use_cache else float(pricing['input price'].replace('$', ''))
+    # Extract JSON from response text (prefill, fences, trailing prose; repairs truncation)
+    response_json = extract_json(response_text, model_id)
+    if compaction_state:
+        restore_response(response_json, compaction_state)
+    # Calculate cost using pricing from CSV. inputTokens excludes the cached prefix:
+    # cache reads are billed at the cache read price, cache writes at the input price
+    cached = cache_usage(response)
+    input_price = float(pricing['input price'].replace('$', ''))
+    cache_read_price = float(pricing['input price (cache read)'].replace('$', ''))
     output_price = float(pricing['output price'].replace('$', ''))
-    cost = (input_tokens * input_price / 1000) + (output_tokens * output_price / 1000)
+    cost = ((input_tokens + cached["cache_write_tokens"]) * input_price / 1000) \
+        + (cached["cache_read_tokens"] * cache_read_price / 1000) + (output_tokens * output_price / 1000)
     
-    return {
+    result = {
         "actual": response_json,
+        "region": region,
         "invocation_time": invocation_time,
         "cost": cost,
         "input_tokens": input_tokens,
-        "output_tokens": output_tokens
+        "output_tokens": output_tokens,
+        "cache_read_tokens": cached["cache_read_tokens"],
+        "cache_write_tokens": cached["cache_write_tokens"],
+        "ttft": streaming.get("ttft"),
+        "output_tokens_per_second": streaming.get("output_tokens_per_second"),
+        "input_tokens_saved": compaction_state["tokens_saved"] if compaction_state else 0,
+        "response_cache_hit": False,
+        "estimate": estimate
     }
+    if use_response_cache:
+        response_cache.put(cache_key, result)
+    return result
     '''except Exception as e:
         return e'''
     '''{
@@ -85,9 +169,17 @@ for model_config in models:
         cache_suffix = "_cached" if use_cache else "_no_cache"
         print(f"\nRunning {model_id} {'with' if use_cache else 'without'} caching")
         all_results = []
+        if use_results_store:
+            run_id = results_store.start_run(f"2_match_foods/{model_name}{cache_suffix}", config={
+                "model": model_id, "region": region, "use_cache": use_cache, "use_stream": use_stream,
+                "use_routing": use_routing, "use_response_cache": use_response_cache, "use_compaction": use_compaction})
 
         for row_idx, test_case in enumerate(test_data):
             print(f"Processing row {row_idx + 1}/{len(test_data)}")
+            if use_checkpoint and (model_id, use_cache, row_idx) in checkpoint:
+                all_results.append(checkpoint.get((model_id, use_cache, row_idx)))
+                print(f"Row {row_idx + 1} already done, skipping")
+                continue
             
             input_data = json.loads(test_case['Prompt 2 - match foods Input'])
             result = invoke_batch(input_data, model_id, region, use_cache, model_config)
@@ -95,21 +187,51 @@ for model_config in models:
             row_summary = {
                 "row_index": row_idx,
                 "input_data": input_data,
+                "region": result["region"],
                 "invocation_time": result["invocation_time"],
                 "extracted_foods": result["actual"],
                 "cost": result["cost"],
                 "input_tokens": result["input_tokens"],
-                "output_tokens": result["output_tokens"]
+                "output_tokens": result["output_tokens"],
+                "cache_read_tokens": result.get("cache_read_tokens"),
+                "cache_write_tokens": result.get("cache_write_tokens"),
+                "ttft": result["ttft"],
+                "output_tokens_per_second": result["output_tokens_per_second"],
+                "input_tokens_saved": result.get("input_tokens_saved"),
+                "response_cache_hit": result["response_cache_hit"],
+                "estimate": result.get("estimate")
             }
             
+            if use_results_store:
+                results_store.record(run_id, 2, result, row_index=row_idx, input_data=input_data, model=model_id)
+            if use_checkpoint:
+                checkpoint.write((model_id, use_cache, row_idx), row_summary)
             all_results.append(row_summary)
             time_str = f"{result['invocation_time']:.2f}s" if result['invocation_time'] is not None else "ERROR"
             print(f"Row {row_idx + 1} completed in {time_str}")
-            
-            if row_idx < len(test_data) - 1:
-                time.sleep(1)
 
-        with open(f'/home/ubuntu/projects/fatsecret/outputs2/2_match_foods_{model_name}{cache_suffix}_3.json', 'w') as f:
-            json.dump(all_results, f, indent=2)
+        if use_results_store:
+            print(f"Recorded run {run_id} in {results_store.path}")
+        else:
+            with open(f'/home/ubuntu/projects/fatsecret/outputs2/2_match_foods_{model_name}{cache_suffix}_3.json', 'w') as f:
+                json.dump(all_results, f, indent=2)
 
         print(f"Completed {model_id}{cache_suffix}")
+        if use_compaction:
+            print(f"Estimated input tokens saved by compaction: {sum(r['input_tokens_saved'] or 0 for r in all_results)}")
+        print(f"Limiter: {limiter.stats()}")
+        print(f"JSON parsing: {parse_stats.stats()}")
+        if use_cache:
+            # Kept next to the results: the JSON rows and the results store hold no hit rates
+            prompt_cache_stats = cache_stats([r for r in all_results if not r['response_cache_hit']])
+            print(f"Prompt cache: {prompt_cache_stats}")
+            with open(f'/home/ubuntu/projects/fatsecret/outputs2/2_match_foods_{model_name}{cache_suffix}_3_stats.json', 'w') as f:
+                json.dump({"prompt_cache": prompt_cache_stats}, f, indent=2)
+        if use_routing:
+            print(f"Regions: {router.stats()}")
+        if use_response_cache:
+            print(f"Response cache: {response_cache.stats()}")
+
+if use_checkpoint:
+    checkpoint.compact()
+    checkpoint.close()
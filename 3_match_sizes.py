@@ -1,6 +1,7 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from rate_limiter import limiter
 import time
 from botocore.exceptions import ClientError
 
@@ -36,7 +37,7 @@ for test_case in test_data:
         print(f"Testing model: {model_id} in region: {region}")
         
         # Create client for this region
-        client = boto3.client("bedrock-runtime", region_name=region)
+        client = get_client(region, max_attempts=1)
         
         conversation = [
             {
@@ -47,24 +48,13 @@ for test_case in test_data:
         
         try:
             
-            # Retry mechanism
-            for attempt in range(3):
-                try:
-                    start_time = time.time()
-                    response = client.converse(
-                        modelId=model_id,
-                        messages=conversation,
-                        inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9},
-                        performanceConfig = { "latency" : performance }
-                    )
-                    end_time = time.time()
-                    break
-                except Exception as e:
-                    if attempt == 2:  # Last attempt
-                        raise e
-                    time.sleep(2 ** attempt)  # Exponential backoff
-            
-            invocation_time = end_time - start_time
+            # Throttled calls are retried through the adaptive limiter
+            response, invocation_time = limiter.timed_call(model_id, region, lambda: client.converse(
+                modelId=model_id,
+                messages=conversation,
+                inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9},
+                performanceConfig = { "latency" : performance }
+            ), retries=2)
             
             # Handle different response structures based on model type
             if "gpt" in model_id.lower():
@@ -112,9 +102,6 @@ for test_case in test_data:
         results.append(result)
         time_str = f"{result.get('invocation_time'):.2f}" if result.get('invocation_time') else "N/A"
         print(f"Completed test case for {model_id} (took {time_str}s)")
-        
-        # Sleep to prevent throttling
-        time.sleep(2)
 
 # Save results
 with open('outputs/round2/3_match_sizes_results.json', 'w') as f:
@@ -122,3 +109,4 @@ with open('outputs/round2/3_match_sizes_results.json', 'w') as f:
 
 print(f"Completed testing {len(models_df)} models with {len(test_data)} test cases each")
 print(f"Results saved to 3_match_sizes_results.json")
+print(f"Limiter: {limiter.stats()}")
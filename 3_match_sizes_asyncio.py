@@ -1,9 +1,11 @@
 import pandas as pd
 import json
-import boto3
 import asyncio
 import time
-from botocore.exceptions import ClientError
+from async_bedrock import AsyncBedrockClient
+from rate_limiter import limiter
+from food_cache import parse_ingredients
+from json_extract import parse_stats
 
 # Read system prompt
 with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
@@ -13,47 +15,35 @@ with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
 df = pd.read_csv('data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
 
-# Create semaphore for rate limiting
-semaphore = asyncio.Semaphore(3)
-
 async def invoke_food_async(food_item, user_message, client):
-    async with semaphore:
-        print(f"Processing: {food_item['query']}")
+    print(f"Processing: {food_item['query']}")
+    
+    try:
+        response, invocation_time = await limiter.atimed_call("us.meta.llama4-maverick-17b-instruct-v1:0", "us-west-2", lambda: client.converse(
+            modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
+            messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
+            inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+        ))
         
-        try:
-            # Run the synchronous boto3 call in executor
-            loop = asyncio.get_event_loop()
-            start_time = time.time()
-            
-            response = await loop.run_in_executor(
-                None,
-                lambda: client.converse(
-                    modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
-                    messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
-                    inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
-                )
-            )
-            
-            invocation_time = time.time() - start_time
-            response_text = response["output"]["message"]["content"][0]["text"]
-            input_tokens = response["usage"]["inputTokens"]
-            output_tokens = response["usage"]["outputTokens"]
-            cost = (input_tokens * 0.00024 / 1000) + (output_tokens * 0.00097 / 1000)
-            
-            return {
-                "food_query": food_item['query'],
-                "actual": response_text,
-                "invocation_time": invocation_time,
-                "cost": cost
-            }
-            
-        except Exception as e:
-            return {
-                "food_query": food_item['query'],
-                "actual": f"ERROR: {str(e)}",
-                "invocation_time": None,
-                "cost": None
-            }
+        response_text = response["output"]["message"]["content"][0]["text"]
+        input_tokens = response["usage"]["inputTokens"]
+        output_tokens = response["usage"]["outputTokens"]
+        cost = (input_tokens * 0.00024 / 1000) + (output_tokens * 0.00097 / 1000)
+        
+        return {
+            "food_query": food_item['query'],
+            "actual": response_text,
+            "invocation_time": invocation_time,
+            "cost": cost
+        }
+        
+    except Exception as e:
+        return {
+            "food_query": food_item['query'],
+            "actual": f"ERROR: {str(e)}",
+            "invocation_time": None,
+            "cost": None
+        }
 
 async def process_row(test_case, row_idx, client):
     print(f"Processing row {row_idx + 1}/{len(test_data)}")
@@ -82,6 +72,8 @@ async def process_row(test_case, row_idx, client):
     
     # Combine results
     combined_responses = " ".join([result["actual"] for result in row_results])
+    matched_ingredients = [ingredient for result in row_results if not result["actual"].startswith("ERROR")
+                           for ingredient in parse_ingredients(result["actual"], "us.meta.llama4-maverick-17b-instruct-v1:0")]
     total_cost = sum(result["cost"] for result in row_results if result["cost"])
     
     return {
@@ -90,21 +82,23 @@ async def process_row(test_case, row_idx, client):
         "food_count": len(input_data['foods']),
         "individual_results": row_results,
         "ingredients": combined_responses,
+        "matched_ingredients": matched_ingredients,
         "total_cost": total_cost
     }
 
 async def main():
-    client = boto3.client("bedrock-runtime", region_name="us-west-2")
-    
-    # Process all rows
-    tasks = [process_row(test_case, idx, client) for idx, test_case in enumerate(test_data)]
-    all_results = await asyncio.gather(*tasks)
+    async with AsyncBedrockClient("us-west-2") as client:
+        # Process all rows
+        tasks = [process_row(test_case, idx, client) for idx, test_case in enumerate(test_data)]
+        all_results = await asyncio.gather(*tasks)
     
     # Save results
     with open('outputs3/3_match_sizes_asyncio.json', 'w') as f:
         json.dump(all_results, f, indent=2)
     
     print(f"Completed all {len(test_data)} rows")
+    print(f"Limiter: {limiter.stats()}")
+    print(f"JSON parsing: {parse_stats.stats()}")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,6 +1,8 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from rate_limiter import limiter
+from json_extract import extract_json, parse_stats
 import time
 
 # Read system prompt
@@ -12,7 +14,7 @@ df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
 
 def invoke_batch(input_data):
-    client = boto3.client("bedrock-runtime", region_name="us-west-2")
+    client = get_client("us-west-2", max_attempts=1)
     try:
         
         # Extract common keys
@@ -21,20 +23,14 @@ def invoke_batch(input_data):
         model_input = {k: v for k, v in input_data.items() if k not in common_keys or k == "input"}
         
         user_message = json.dumps(model_input, indent=2)
-        start_time = time.time()
-        response = client.converse(
+        response, invocation_time = limiter.timed_call("us.meta.llama4-maverick-17b-instruct-v1:0", "us-west-2", lambda: client.converse(
             modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
             messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
             inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9},
             #performanceConfig = { "latency" : "optimized" }
-        )
-        invocation_time = time.time() - start_time
+        ))
         response_text = response["output"]["message"]["content"][0]["text"]
-        if response_text.strip().startswith('```'):
-            response_text = response_text.strip()
-            response_text = response_text[response_text.find('\n')+1:]  # Remove first line (```json)
-            response_text = response_text.rsplit('```', 1)[0]  # Remove closing ```
-        response_json = json.loads(response_text)
+        response_json = extract_json(response_text, "us.meta.llama4-maverick-17b-instruct-v1:0")
         
         # Merge common keys back into response
         response_json.update(common_keys)
@@ -80,11 +76,10 @@ for row_idx, test_case in enumerate(test_data):
     all_results.append(row_summary)
     time_str = f"{result['invocation_time']:.2f}s" if result['invocation_time'] is not None else "ERROR"
     print(f"Row {row_idx + 1} completed in {time_str} with {len(input_data['foods'])} foods")
-    
-    if row_idx < len(test_data) - 1:
-        time.sleep(3)
 
 with open('/home/ubuntu/projects/fatsecret/outputs/round3/3_match_sizes_batch_results.json', 'w') as f:
     json.dump(all_results, f, indent=2)
 
 print(f"Completed all {len(test_data)} rows")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
@@ -0,0 +1,171 @@
+import pandas as pd
+import json
+from bedrock_client import get_client
+from streaming import converse_streaming
+from rate_limiter import limiter
+from unit_conversion import expand_response
+from prompt_cache import cache_stats, cache_usage, prompt_content
+from json_extract import extract_json, parse_stats
+from token_estimator import TokenEstimator, combine_results, load_calibration, pricing_from_csvs
+from results_store import ResultsStore
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+# Read system prompt
+with open('/home/ubuntu/projects/fatsecret/prompts/prompt3_minimal.txt', 'r', encoding='utf-8') as f:
+    system_prompt = f.read().strip().strip('"')
+
+# Read test data
+df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/test_data_clean.csv')
+test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
+
+# Use converse_stream to record time-to-first-token and output tokens/sec
+use_stream = False
+
+# Send the static part of the prompt as a cacheable prefix (cachePoint before the
+# data) and record cacheRead/cacheWrite tokens
+use_prompt_cache = False
+
+# Record each request in the columnar results store as it completes instead of
+# dumping indented JSON at the end
+use_results_store = False
+results_store = ResultsStore('/home/ubuntu/projects/fatsecret/outputs3/results.sqlite') if use_results_store else None
+
+# Pre-flight estimates: predict tokens, cost and latency before each call, reject
+# requests over the model's input limit and split rows whose prompt would exceed
+# max_input_tokens or whose expected output would not fit in maxTokens
+estimator = TokenEstimator(load_calibration('/home/ubuntu/projects/fatsecret/data/models/token_calibration.json'),
+                           pricing_from_csvs('/home/ubuntu/projects/fatsecret/data/models/*.csv'))
+max_input_tokens = 8000
+
+def invoke_batch(input_data):
+    client = get_client("us-west-2", max_attempts=1)
+    try:
+        # The model only returns the decision fields; everything else is derived locally
+        model_input = {
+            'input': input_data['input'],
+            'foods': input_data['foods']
+        }
+
+        user_message = json.dumps(model_input, indent=2)
+
+        request = dict(
+            modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
+            messages=[{"role": "user", "content": prompt_content(system_prompt, user_message, use_prompt_cache)}],
+            inferenceConfig={"maxTokens": 1024, "temperature": 0.1, "topP": 0.9}
+        )
+        estimate = estimator.estimate(request["modelId"], request, foods=len(input_data['foods']))
+        if not estimate["fits"]:
+            raise ValueError(f"Request of ~{estimate['input_tokens']} input tokens exceeds the model's input limit")
+        response, invocation_time = limiter.timed_call(
+            request["modelId"], "us-west-2",
+            lambda: converse_streaming(client, **request) if use_stream else client.converse(**request)
+        )
+
+        response_text = response["output"]["message"]["content"][0]["text"].strip()
+
+        expand_start = time.time()
+        response_json = expand_response(extract_json(response_text, request["modelId"]), input_data)
+        expand_time = time.time() - expand_start
+
+        input_tokens = response["usage"]["inputTokens"]
+        output_tokens = response["usage"]["outputTokens"]
+        # Cached prefix tokens are billed at the input price (no cache-read price is listed for this model)
+        cached = cache_usage(response)
+        cost = ((input_tokens + cached["cache_read_tokens"] + cached["cache_write_tokens"]) * 0.00024 + output_tokens * 0.00097) / 1000
+
+        streaming = response.get("streaming", {})
+
+        return {
+            "actual": response_json,
+            "minimal": response_text,
+            "invocation_time": invocation_time,
+            "expand_time": expand_time,
+            "cost": cost,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cached["cache_read_tokens"],
+            "cache_write_tokens": cached["cache_write_tokens"],
+            "ttft": streaming.get("ttft"),
+            "output_tokens_per_second": streaming.get("output_tokens_per_second"),
+            "estimate": estimate
+        }
+    except Exception as e:
+        return {
+            "actual": f"ERROR: {str(e)}",
+            "minimal": None,
+            "invocation_time": None,
+            "expand_time": None,
+            "cost": None,
+            "input_tokens": None,
+            "output_tokens": None,
+            "cache_read_tokens": None,
+            "cache_write_tokens": None,
+            "ttft": None,
+            "output_tokens_per_second": None,
+            "estimate": None
+        }
+
+all_results = []
+if use_results_store:
+    run_id = results_store.start_run("3_match_sizes_batch_minimal", config={
+        "use_stream": use_stream, "use_prompt_cache": use_prompt_cache, "max_input_tokens": max_input_tokens})
+
+for row_idx, test_case in enumerate(test_data):
+    print(f"Processing row {row_idx + 1}/{len(test_data)}")
+
+    input_data = json.loads(test_case['Prompt 3 - match sizes Input'])
+    chunks = estimator.split_foods(
+        input_data, "us.meta.llama4-maverick-17b-instruct-v1:0",
+        render=lambda chunk: system_prompt.replace("{{foods}}", json.dumps({'input': chunk['input'], 'foods': chunk['foods']}, indent=2)),
+        max_input_tokens=max_input_tokens, max_output_tokens=1024
+    )
+    if len(chunks) > 1:
+        print(f"Splitting row {row_idx + 1} into {len(chunks)} requests")
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            chunk_results = list(executor.map(invoke_batch, chunks))
+        result = combine_results(chunk_results)
+    else:
+        chunk_results = [invoke_batch(input_data)]
+        result = chunk_results[0]
+    if use_results_store:
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            results_store.record(run_id, 3, chunk_result, row_index=row_idx, input_data=chunk,
+                                 model="us.meta.llama4-maverick-17b-instruct-v1:0", region="us-west-2")
+
+    row_summary = {
+        "row_index": row_idx,
+        "food_count": len(input_data['foods']),
+        "invocation_time": result["invocation_time"],
+        "expand_time": result["expand_time"],
+        "ingredients": result["actual"],
+        "minimal": result["minimal"],
+        "cost": result["cost"],
+        "input_tokens": result["input_tokens"],
+        "output_tokens": result["output_tokens"],
+        "cache_read_tokens": result.get("cache_read_tokens"),
+        "cache_write_tokens": result.get("cache_write_tokens"),
+        "ttft": result["ttft"],
+        "output_tokens_per_second": result["output_tokens_per_second"],
+        "estimate": result.get("estimate"),
+        "chunks": result.get("chunks", 1)
+    }
+
+    all_results.append(row_summary)
+    time_str = f"{result['invocation_time']:.2f}s" if result['invocation_time'] is not None else "ERROR"
+    print(f"Row {row_idx + 1} completed in {time_str} with {len(input_data['foods'])} foods, {result['output_tokens']} output tokens")
+
+if use_results_store:
+    print(f"Recorded run {run_id} in {results_store.path}")
+else:
+    with open('/home/ubuntu/projects/fatsecret/outputs/round4/3_match_sizes_batch_minimal.json', 'w') as f:
+        json.dump(all_results, f, indent=2)
+
+output_tokens = [r["output_tokens"] for r in all_results if r["output_tokens"]]
+print(f"Completed all {len(test_data)} rows")
+if output_tokens:
+    print(f"Mean output tokens per row: {sum(output_tokens) / len(output_tokens):.0f}")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
+if use_prompt_cache:
+    print(f"Prompt cache: {cache_stats(all_results)}")
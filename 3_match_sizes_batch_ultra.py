@@ -1,6 +1,16 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from streaming import converse_streaming
+from rate_limiter import limiter
+from response_cache import ResponseCache, prompt_hash
+from serving_rules import merge_into, row_response, split_foods
+from compaction import compact, restore_response
+from prompt_cache import cache_stats, cache_usage, prompt_content
+from json_extract import extract_json, parse_stats
+from token_estimator import TokenEstimator, combine_results, load_calibration, pricing_from_csvs
+from results_store import ResultsStore
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 # Read system prompt
@@ -11,109 +21,166 @@ with open('/home/ubuntu/projects/fatsecret/prompts/prompt3_ultra.txt', 'r', enco
 df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
 
+# Use converse_stream to record time-to-first-token, output tokens/sec and
+# hand each ingredient downstream as soon as it is complete
+use_stream = False
+
+# Send the static part of the prompt as a cacheable prefix (cachePoint before the
+# data) and record cacheRead/cacheWrite tokens
+use_prompt_cache = False
+
+# Record each request in the columnar results store as it completes instead of
+# dumping indented JSON at the end
+use_results_store = False
+results_store = ResultsStore('/home/ubuntu/projects/fatsecret/outputs3/results.sqlite') if use_results_store else None
+
+# Serve repeated rows from the LRU + SQLite response cache
+use_response_cache = False
+response_cache = ResponseCache('/home/ubuntu/projects/fatsecret/cache/llm_responses.sqlite') if use_response_cache else None
+prompt_version = prompt_hash(system_prompt)
+
+# Resolve foods with no quantity (default serving) or an explicit g/ml amount locally,
+# and only send the remaining foods of a row to the model
+use_serving_rules = False
+
+# Pre-flight estimates: predict tokens, cost and latency before each call, reject
+# requests over the model's input limit and split rows whose prompt would exceed
+# max_input_tokens or whose expected output would not fit in maxTokens
+estimator = TokenEstimator(load_calibration('/home/ubuntu/projects/fatsecret/data/models/token_calibration.json'),
+                           pricing_from_csvs('/home/ubuntu/projects/fatsecret/data/models/*.csv'))
+max_input_tokens = 8000
+
+def on_ingredient(ingredient):
+    print(f"  Ingredient ready: {ingredient.get('food_name')} ({ingredient.get('food_id')})")
+
 def invoke_batch(input_data):
-    client = boto3.client("bedrock-runtime", region_name="us-west-2")
-    try:
-        # Extract metadata
-        metadata_keys = ['input', 'language', 'language_description', 'region', 'region_description', 'include_servings']
-        metadata = {k: input_data[k] for k in metadata_keys if k in input_data}
-        
-        # Extract and store food metadata for restoration
-        food_metadata = []
-        optimized_foods = []
-        
-        for food in input_data['foods']:
-            # Store removable data per food
-            food_meta = {'query': food.get('query')}
-            
-            optimized_results = []
-            for result in food['results']:
-                # Store removable result data
-                result_meta = {
-                    'brand_name': result.get('brand_name', ''),
-                    'food_type': result.get('food_type', '')
-                }
-                food_meta.setdefault('results_meta', []).append(result_meta)
-                
-                # Keep only essential data for model
-                optimized_result = {
-                    'food_id': result['food_id'],
-                    'food_name': result['food_name'],
-                    'servings': result['servings']
-                }
-                optimized_results.append(optimized_result)
-            
-            food_metadata.append(food_meta)
-            optimized_foods.append({'results': optimized_results})
-        
-        # Create minimal model input
-        model_input = {
-            'input': input_data['input'],
-            'foods': optimized_foods
-        }
-        
-        user_message = json.dumps(model_input, indent=2)
+    if use_response_cache:
         start_time = time.time()
+        cache_key = response_cache.key("us.meta.llama4-maverick-17b-instruct-v1:0", prompt_version, input_data)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, invocation_time=time.time() - start_time, cost=0.0, response_cache_hit=True)
+    
+    full_input = input_data
+    rule_ingredients = []
+    if use_serving_rules:
+        rule_ingredients, remaining_foods = split_foods(input_data)
+        if not remaining_foods:
+            return {
+                "actual": row_response(full_input, rule_ingredients),
+                "invocation_time": 0.0,
+                "cost": 0.0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cache_read_tokens": 0,
+                "cache_write_tokens": 0,
+                "ttft": None,
+                "first_ingredient_time": None,
+                "output_tokens_per_second": None,
+                "input_tokens_saved": 0,
+                "response_cache_hit": False,
+                "rule_matched": len(rule_ingredients)
+            }
+        input_data = dict(input_data, foods=remaining_foods)
+    
+    client = get_client("us-west-2", max_attempts=1)
+    try:
+        # Strip metadata before the call, restore it afterwards
+        user_message, compaction_state = compact(input_data, step=3, model_id="us.meta.llama4-maverick-17b-instruct-v1:0")
         
-        response = client.converse(
+        request = dict(
             modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
-            messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
+            messages=[{"role": "user", "content": prompt_content(system_prompt, user_message, use_prompt_cache)}],
             inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
         )
+        estimate = estimator.estimate(request["modelId"], request, foods=len(input_data['foods']))
+        if not estimate["fits"]:
+            raise ValueError(f"Request of ~{estimate['input_tokens']} input tokens exceeds the model's input limit")
+        response, invocation_time = limiter.timed_call(
+            request["modelId"], "us-west-2",
+            lambda: converse_streaming(client, on_ingredient=on_ingredient, **request) if use_stream else client.converse(**request)
+        )
         
-        invocation_time = time.time() - start_time
         response_text = response["output"]["message"]["content"][0]["text"].strip()
         
-        # Clean JSON response
-        if response_text.startswith('```'):
-            response_text = response_text.split('\n', 1)[1].rsplit('```', 1)[0]
+        # Parse JSON response (fences, trailing prose; repairs truncation)
+        response_json = extract_json(response_text, request["modelId"])
         
-        response_json = json.loads(response_text)
-        
-        # Restore metadata to response
-        response_json.update(metadata)
-        
-        # Restore food metadata to ingredients
-        if 'ingredients' in response_json:
-            for i, ingredient in enumerate(response_json['ingredients']):
-                food_id = str(ingredient.get('food_id', ''))
-                
-                # Find matching food metadata by food_id
-                for food_idx, food_meta in enumerate(food_metadata):
-                    for result_idx, result_meta in enumerate(food_meta.get('results_meta', [])):
-                        # Match by checking if this food_id exists in original data
-                        original_food = input_data['foods'][food_idx]['results'][result_idx]
-                        if str(original_food['food_id']) == food_id:
-                            ingredient.update(result_meta)
-                            break
+        # Restore metadata to response and food metadata to ingredients
+        restore_response(response_json, compaction_state)
+        merge_into(response_json, full_input, rule_ingredients)
         
         input_tokens = response["usage"]["inputTokens"]
         output_tokens = response["usage"]["outputTokens"]
-        cost = (input_tokens * 0.00024 + output_tokens * 0.00097) / 1000
+        # Cached prefix tokens are billed at the input price (no cache-read price is listed for this model)
+        cached = cache_usage(response)
+        cost = ((input_tokens + cached["cache_read_tokens"] + cached["cache_write_tokens"]) * 0.00024 + output_tokens * 0.00097) / 1000
         
-        return {
+        streaming = response.get("streaming", {})
+        
+        result = {
             "actual": response_json,
             "invocation_time": invocation_time,
             "cost": cost,
             "input_tokens": input_tokens,
-            "output_tokens": output_tokens
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cached["cache_read_tokens"],
+            "cache_write_tokens": cached["cache_write_tokens"],
+            "ttft": streaming.get("ttft"),
+            "first_ingredient_time": streaming.get("first_ingredient_time"),
+            "output_tokens_per_second": streaming.get("output_tokens_per_second"),
+            "input_tokens_saved": compaction_state["tokens_saved"],
+            "response_cache_hit": False,
+            "rule_matched": len(rule_ingredients),
+            "estimate": estimate
         }
+        if use_response_cache:
+            response_cache.put(cache_key, result)
+        return result
     except Exception as e:
         return {
             "actual": f"ERROR: {str(e)}",
             "invocation_time": None,
             "cost": None,
             "input_tokens": None,
-            "output_tokens": None
+            "output_tokens": None,
+            "cache_read_tokens": None,
+            "cache_write_tokens": None,
+            "ttft": None,
+            "first_ingredient_time": None,
+            "output_tokens_per_second": None,
+            "input_tokens_saved": None,
+            "response_cache_hit": False,
+            "rule_matched": len(rule_ingredients)
         }
 
 all_results = []
+if use_results_store:
+    run_id = results_store.start_run("3_match_sizes_batch_ultra", config={
+        "use_stream": use_stream, "use_prompt_cache": use_prompt_cache, "use_response_cache": use_response_cache,
+        "use_serving_rules": use_serving_rules, "max_input_tokens": max_input_tokens})
 
 for row_idx, test_case in enumerate(test_data):
     print(f"Processing row {row_idx + 1}/{len(test_data)}")
     
     input_data = json.loads(test_case['Prompt 3 - match sizes Input'])
-    result = invoke_batch(input_data)
+    chunks = estimator.split_foods(
+        input_data, "us.meta.llama4-maverick-17b-instruct-v1:0",
+        render=lambda chunk: system_prompt.replace("{{foods}}", compact(chunk, step=3, model_id="us.meta.llama4-maverick-17b-instruct-v1:0")[0]),
+        max_input_tokens=max_input_tokens, max_output_tokens=2048
+    )
+    if len(chunks) > 1:
+        print(f"Splitting row {row_idx + 1} into {len(chunks)} requests")
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            chunk_results = list(executor.map(invoke_batch, chunks))
+        result = combine_results(chunk_results)
+    else:
+        chunk_results = [invoke_batch(input_data)]
+        result = chunk_results[0]
+    if use_results_store:
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            results_store.record(run_id, 3, chunk_result, row_index=row_idx, input_data=chunk,
+                                 model="us.meta.llama4-maverick-17b-instruct-v1:0", region="us-west-2")
     
     row_summary = {
         "row_index": row_idx,
@@ -122,17 +189,34 @@ for row_idx, test_case in enumerate(test_data):
         "ingredients": result["actual"],
         "cost": result["cost"],
         "input_tokens": result["input_tokens"],
-        "output_tokens": result["output_tokens"]
+        "output_tokens": result["output_tokens"],
+        "cache_read_tokens": result.get("cache_read_tokens"),
+        "cache_write_tokens": result.get("cache_write_tokens"),
+        "ttft": result["ttft"],
+        "first_ingredient_time": result["first_ingredient_time"],
+        "output_tokens_per_second": result["output_tokens_per_second"],
+        "estimate": result.get("estimate"),
+        "chunks": result.get("chunks", 1),
+        "input_tokens_saved": result.get("input_tokens_saved"),
+        "response_cache_hit": result["response_cache_hit"],
+        "rule_matched": result.get("rule_matched", 0)
     }
     
     all_results.append(row_summary)
     time_str = f"{result['invocation_time']:.2f}s" if result['invocation_time'] is not None else "ERROR"
     print(f"Row {row_idx + 1} completed in {time_str} with {len(input_data['foods'])} foods")
-    
-    if row_idx < len(test_data) - 1:
-        time.sleep(3)
 
-with open('/home/ubuntu/projects/fatsecret/outputs/round4/3_match_sizes_batch_ultra.json', 'w') as f:
-    json.dump(all_results, f, indent=2)
+if use_results_store:
+    print(f"Recorded run {run_id} in {results_store.path}")
+else:
+    with open('/home/ubuntu/projects/fatsecret/outputs/round4/3_match_sizes_batch_ultra.json', 'w') as f:
+        json.dump(all_results, f, indent=2)
 
 print(f"Completed all {len(test_data)} rows")
+print(f"Estimated input tokens saved by compaction: {sum(r['input_tokens_saved'] or 0 for r in all_results)}")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
+if use_prompt_cache:
+    print(f"Prompt cache: {cache_stats(all_results)}")
+if use_response_cache:
+    print(f"Response cache: {response_cache.stats()}")
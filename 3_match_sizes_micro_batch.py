@@ -0,0 +1,158 @@
+import pandas as pd
+import json
+from bedrock_client import get_client
+from rate_limiter import limiter
+from hedging import percentile
+from micro_batcher import batch_payload, plan_batches, render_payload, split_response
+from prompt_cache import cache_stats, cache_usage, prompt_content
+from json_extract import extract_json, parse_stats
+from serving_rules import row_response
+from token_estimator import TokenEstimator, load_calibration, pricing_from_csvs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+# Read system prompt
+with open('/home/ubuntu/projects/fatsecret/prompts/prompt3_new.txt', 'r', encoding='utf-8') as f:
+    system_prompt = f.read().strip().strip('"')
+
+# Read test data
+df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/test_data_clean.csv')
+test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
+model_id = "us.meta.llama4-maverick-17b-instruct-v1:0"
+region = "us-west-2"
+
+estimator = TokenEstimator(load_calibration('/home/ubuntu/projects/fatsecret/data/models/token_calibration.json'),
+                           pricing_from_csvs('/home/ubuntu/projects/fatsecret/data/models/*.csv'))
+
+# Pack foods across rows into requests of at most token_budget estimated input
+# tokens and latency_target estimated seconds (None for no latency goal)
+token_budget = 6000
+latency_target = None
+max_workers = 10
+
+# Send the static part of the prompt as a cacheable prefix (cachePoint before the
+# data) and record cacheRead/cacheWrite tokens
+use_prompt_cache = False
+
+def invoke_batch(user_message, food_count):
+    client = get_client(region, max_pool_connections=max_workers, max_attempts=1)
+    request = dict(
+        modelId=model_id,
+        messages=[{"role": "user", "content": prompt_content(system_prompt, user_message, use_prompt_cache)}],
+        inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+    )
+    estimate = estimator.estimate(model_id, request, foods=food_count)
+    try:
+        response, invocation_time = limiter.timed_call(model_id, region, lambda: client.converse(**request))
+
+        response_text = response["output"]["message"]["content"][0]["text"].strip()
+
+        input_tokens = response["usage"]["inputTokens"]
+        output_tokens = response["usage"]["outputTokens"]
+        # Cached prefix tokens are billed at the input price (no cache-read price is listed for this model)
+        cached = cache_usage(response)
+        return {
+            "actual": extract_json(response_text, model_id),
+            "invocation_time": invocation_time,
+            "cost": ((input_tokens + cached["cache_read_tokens"] + cached["cache_write_tokens"]) * 0.00024 + output_tokens * 0.00097) / 1000,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cached["cache_read_tokens"],
+            "cache_write_tokens": cached["cache_write_tokens"],
+            "estimate": estimate
+        }
+    except Exception as e:
+        return {
+            "actual": f"ERROR: {str(e)}",
+            "invocation_time": None,
+            "cost": None,
+            "input_tokens": None,
+            "output_tokens": None,
+            "cache_read_tokens": None,
+            "cache_write_tokens": None,
+            "estimate": estimate
+        }
+
+rows = [json.loads(test_case['Prompt 3 - match sizes Input']) for test_case in test_data]
+batches = plan_batches(
+    rows, estimator, model_id,
+    render=lambda user_message: system_prompt.replace("{{foods}}", user_message),
+    token_budget=token_budget, latency_target=latency_target
+)
+print(f"Packed {sum(len(row['foods']) for row in rows)} foods from {len(rows)} rows into {len(batches)} requests")
+
+start_time = time.time()
+row_ingredients = {row_idx: [] for row_idx in range(len(rows))}
+row_finished = {}
+row_errors = {}
+batch_results = []
+
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    futures = {
+        executor.submit(invoke_batch, render_payload(batch_payload(rows, batch)), len(batch)): batch
+        for batch in batches
+    }
+    for future in as_completed(futures):
+        batch = futures[future]
+        result = future.result()
+        finished = time.time() - start_time
+        if isinstance(result["actual"], dict):
+            by_row, unassigned = split_response(result["actual"], rows, batch)
+            for row_idx, ingredients in by_row.items():
+                row_ingredients[row_idx].extend(ingredients)
+        else:
+            unassigned = []
+            for row_idx, _ in batch:
+                row_errors[row_idx] = result["actual"]
+        for row_idx, _ in batch:
+            row_finished[row_idx] = max(row_finished.get(row_idx, 0.0), finished)
+        batch_results.append({
+            "foods": [[row_idx, food_idx] for row_idx, food_idx in batch],
+            "rows": sorted({row_idx for row_idx, _ in batch}),
+            "finished": finished,
+            "invocation_time": result["invocation_time"],
+            "cost": result["cost"],
+            "input_tokens": result["input_tokens"],
+            "output_tokens": result["output_tokens"],
+            "cache_read_tokens": result["cache_read_tokens"],
+            "cache_write_tokens": result["cache_write_tokens"],
+            "estimate": result["estimate"],
+            "unassigned": unassigned,
+            "error": None if isinstance(result["actual"], dict) else result["actual"]
+        })
+        print(f"Request with {len(batch)} foods from rows {sorted({r + 1 for r, _ in batch})} completed in {finished:.2f}s")
+
+total_time = time.time() - start_time
+
+all_results = []
+for row_idx, input_data in enumerate(rows):
+    row_batches = [b for b in batch_results if row_idx in b["rows"]]
+    all_results.append({
+        "row_index": row_idx,
+        "food_count": len(input_data['foods']),
+        "requests": len(row_batches),
+        "total_time": row_finished.get(row_idx),
+        "ingredients": row_errors.get(row_idx) or row_response(input_data, row_ingredients[row_idx]),
+        # A request's cost is shared between its rows in proportion to their foods
+        "cost": sum(b["cost"] * sum(1 for r, _ in b["foods"] if r == row_idx) / len(b["foods"])
+                    for b in row_batches if b["cost"])
+    })
+
+with open('/home/ubuntu/projects/fatsecret/outputs/round4/3_match_sizes_micro_batch.json', 'w') as f:
+    json.dump({
+        "token_budget": token_budget,
+        "latency_target": latency_target,
+        "total_time": total_time,
+        "rows": all_results,
+        "requests": batch_results
+    }, f, indent=2)
+
+row_latencies = [row["total_time"] for row in all_results if row["total_time"] is not None]
+print(f"Completed all {len(rows)} rows in {total_time:.2f}s with {len(batches)} requests")
+if row_latencies:
+    print(f"Row latency p50 {percentile(row_latencies, 50):.2f}s, p99 {percentile(row_latencies, 99):.2f}s")
+print(f"Total cost: ${sum(b['cost'] for b in batch_results if b['cost']):.6f}")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
+if use_prompt_cache:
+    print(f"Prompt cache: {cache_stats(batch_results)}")
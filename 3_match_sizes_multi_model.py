@@ -1,9 +1,11 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Semaphore
+from rate_limiter import limiter
+from food_cache import parse_ingredients
+from json_extract import parse_stats
 import itertools
 
 # Read system prompt
@@ -13,7 +15,7 @@ with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
 # Read test data
 df = pd.read_csv('data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
-client = boto3.client("bedrock-runtime", region_name="us-west-2")
+client = get_client("us-west-2", max_pool_connections=10, max_attempts=1)
 
 # Available models to cycle through
 models = [
@@ -28,20 +30,15 @@ models = [
 # Create a cycle iterator for models
 model_cycle = itertools.cycle(models)
 
-# Rate limiting semaphore
-# rate_limiter = Semaphore(10)
-
 def invoke_food(food_item, user_message, model_id):
-    #with rate_limiter:
     print(f"{food_item['query']} - {model_id}")
     try:
-        start_time = time.time()
-        response = client.converse(
+        # Each model gets its own bucket and concurrency window in the limiter
+        response, invocation_time = limiter.timed_call(model_id, "us-west-2", lambda: client.converse(
             modelId=model_id,
             messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}",user_message)}]}],
             inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
-        )
-        invocation_time = time.time() - start_time
+        ))
         
         response_text = response["output"]["message"]["content"][0]["text"]
         input_tokens = response["usage"]["inputTokens"]
@@ -99,6 +96,8 @@ for row_idx, test_case in enumerate(test_data):
     
     # Combine results for this row
     combined_responses = " ".join([result["actual"] for result in row_results])
+    matched_ingredients = [ingredient for result in row_results if not result["actual"].startswith("ERROR")
+                           for ingredient in parse_ingredients(result["actual"], result["model_id"])]
     total_cost = sum(result["cost"] for result in row_results if result["cost"])
     
     row_summary = {
@@ -107,6 +106,7 @@ for row_idx, test_case in enumerate(test_data):
         "food_count": len(input_data['foods']),
         "individual_results": row_results,
         "ingredients": combined_responses,
+        "matched_ingredients": matched_ingredients,
         "total_cost": total_cost
     }
     
@@ -117,3 +117,5 @@ with open('outputs3/3_match_sizes_multi_model.json', 'w') as f:
     json.dump(all_results, f, indent=2)
 
 print(f"Completed all {len(test_data)} rows")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
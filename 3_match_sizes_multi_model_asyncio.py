@@ -1,10 +1,12 @@
 import pandas as pd
 import json
-import boto3
 import asyncio
 import time
 import itertools
-from concurrent.futures import ThreadPoolExecutor
+from async_bedrock import AsyncBedrockClient
+from rate_limiter import limiter
+from food_cache import parse_ingredients
+from json_extract import parse_stats
 
 # Read system prompt
 with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
@@ -13,7 +15,6 @@ with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
 # Read test data
 df = pd.read_csv('data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
-client = boto3.client("bedrock-runtime", region_name="us-west-2")
 
 # Available models to cycle through
 models = [
@@ -26,48 +27,38 @@ models = [
 ]
 
 model_cycle = itertools.cycle(models)
-semaphore = asyncio.Semaphore(10)
 
-async def invoke_food_async(food_item, user_message, model_id, executor):
-    async with semaphore:
-        print(f"{food_item['query']} - {model_id}")
-        try:
-            start_time = time.time()
-            
-            # Run the synchronous boto3 call in thread pool
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                executor,
-                lambda: client.converse(
-                    modelId=model_id,
-                    messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
-                    inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
-                )
-            )
-            
-            invocation_time = time.time() - start_time
-            response_text = response["output"]["message"]["content"][0]["text"]
-            input_tokens = response["usage"]["inputTokens"]
-            output_tokens = response["usage"]["outputTokens"]
-            cost = (input_tokens * 0.00024 / 1000) + (output_tokens * 0.00097 / 1000)
-            
-            return {
-                "food_query": food_item['query'],
-                "model_id": model_id,
-                "actual": response_text,
-                "invocation_time": invocation_time,
-                "cost": cost
-            }
-        except Exception as e:
-            return {
-                "food_query": food_item['query'],
-                "model_id": model_id,
-                "actual": f"ERROR: {str(e)}",
-                "invocation_time": None,
-                "cost": None
-            }
+async def invoke_food_async(food_item, user_message, model_id, client):
+    print(f"{food_item['query']} - {model_id}")
+    try:
+        response, invocation_time = await limiter.atimed_call(model_id, "us-west-2", lambda: client.converse(
+            modelId=model_id,
+            messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}", user_message)}]}],
+            inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+        ))
+        
+        response_text = response["output"]["message"]["content"][0]["text"]
+        input_tokens = response["usage"]["inputTokens"]
+        output_tokens = response["usage"]["outputTokens"]
+        cost = (input_tokens * 0.00024 / 1000) + (output_tokens * 0.00097 / 1000)
+        
+        return {
+            "food_query": food_item['query'],
+            "model_id": model_id,
+            "actual": response_text,
+            "invocation_time": invocation_time,
+            "cost": cost
+        }
+    except Exception as e:
+        return {
+            "food_query": food_item['query'],
+            "model_id": model_id,
+            "actual": f"ERROR: {str(e)}",
+            "invocation_time": None,
+            "cost": None
+        }
 
-async def process_row(row_idx, test_case, executor):
+async def process_row(row_idx, test_case, client):
     print(f"Processing row {row_idx + 1}/{len(test_data)}")
     
     input_data = json.loads(test_case['Prompt 3 - match sizes Input'])
@@ -86,7 +77,7 @@ async def process_row(row_idx, test_case, executor):
         }
         user_message = json.dumps(single_food_input, indent=2)
         model_id = next(model_cycle)
-        tasks.append(invoke_food_async(food_item, user_message, model_id, executor))
+        tasks.append(invoke_food_async(food_item, user_message, model_id, client))
     
     # Process all foods in this row concurrently
     row_start_time = time.time()
@@ -95,6 +86,8 @@ async def process_row(row_idx, test_case, executor):
     
     # Combine results for this row
     combined_responses = " ".join([result["actual"] for result in row_results])
+    matched_ingredients = [ingredient for result in row_results if not result["actual"].startswith("ERROR")
+                           for ingredient in parse_ingredients(result["actual"], result["model_id"])]
     total_cost = sum(result["cost"] for result in row_results if result["cost"])
     
     return {
@@ -103,15 +96,16 @@ async def process_row(row_idx, test_case, executor):
         "food_count": len(input_data['foods']),
         "individual_results": row_results,
         "ingredients": combined_responses,
+        "matched_ingredients": matched_ingredients,
         "total_cost": total_cost
     }
 
 async def main():
     all_results = []
     
-    with ThreadPoolExecutor(max_workers=10) as executor:
+    async with AsyncBedrockClient("us-west-2") as client:
         for row_idx, test_case in enumerate(test_data):
-            result = await process_row(row_idx, test_case, executor)
+            result = await process_row(row_idx, test_case, client)
             all_results.append(result)
             print(f"Row {row_idx + 1} completed in {result['total_time']:.2f}s with {result['food_count']} foods")
     
@@ -119,6 +113,8 @@ async def main():
         json.dump(all_results, f, indent=2)
     
     print(f"Completed all {len(test_data)} rows")
+    print(f"Limiter: {limiter.stats()}")
+    print(f"JSON parsing: {parse_stats.stats()}")
 
 if __name__ == "__main__":
     asyncio.run(main())
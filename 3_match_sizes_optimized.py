@@ -1,11 +1,11 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Initialize client once
-client = boto3.client("bedrock-runtime", region_name="us-west-2")
+client = get_client("us-west-2", max_pool_connections=5)
 
 # Read and cache system prompt
 with open('/home/ubuntu/projects/fatsecret/prompts/prompt3.txt', 'r', encoding='utf-8') as f:
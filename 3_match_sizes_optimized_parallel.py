@@ -1,9 +1,17 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Semaphore
+from rate_limiter import limiter
+from hedging import Hedger, percentile
+from region_router import RegionRouter, regions_from_csvs
+from response_cache import ResponseCache, prompt_hash
+from food_cache import food_cache_input, merge_ingredients, parse_ingredients
+from json_extract import parse_stats
+from serving_rules import match_food
+from token_estimator import TokenEstimator, pricing_from_csvs
+from prompt_cache import cache_stats, cache_usage, prompt_content
 
 # Read system prompt
 with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
@@ -12,43 +20,131 @@ with open('prompts/prompt3_old.txt', 'r', encoding='utf-8') as f:
 # Read test data
 df = pd.read_csv('data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
-client = boto3.client("bedrock-runtime", region_name="us-west-2")
-
-# Rate limiting semaphore
-rate_limiter = Semaphore(10)  # Max 3 concurrent requests
-
-def invoke_food(food_item, user_message):
-    with rate_limiter:
-        print(food_item)
-        try:
-            start_time = time.time()
-            response = client.converse(
-                modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
-                messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}",user_message)}]}],
-                inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+model_id = "us.meta.llama4-maverick-17b-instruct-v1:0"
+region = "us-west-2"
+
+# Hedging: if a food call is slower than the p95 of recent calls, send a duplicate
+# to hedge_target (model, region), or to the same model/region when it is None
+use_hedging = False
+hedge_target = None
+hedger = Hedger(percentile=95)
+
+# Routing: send each food call to the fastest healthy region for the model
+use_routing = False
+router = RegionRouter(regions_from_csvs())
+
+# Serve repeated foods from the LRU + SQLite response cache
+use_response_cache = False
+prompt_version = prompt_hash(system_prompt)
+
+# Per-food cache: only call the model for (food, servings, quantity phrase) combinations
+# not seen before, and assemble rows from cached and fresh ingredients
+use_food_cache = False
+response_cache = ResponseCache() if use_response_cache or use_food_cache else None
+
+# Resolve foods with no quantity (default serving) or an explicit g/ml amount locally,
+# and only send the remaining foods of a row to the model
+use_serving_rules = False
+
+# Send the static part of the prompt as a cacheable prefix (cachePoint before the
+# data) and record cacheRead/cacheWrite tokens
+use_prompt_cache = False
+
+# Pre-flight estimates: predict tokens, cost and latency of each food call and
+# reject requests over the model's input limit
+estimator = TokenEstimator()
+pricing = pricing_from_csvs()
+
+def food_cost(response, call_model_id=model_id):
+    # Priced for the model that served the call; cached prefix tokens are billed at
+    # the input price (the model CSVs list no cache-read price)
+    input_price, output_price = pricing.get(call_model_id, (0.0, 0.0))
+    cached = cache_usage(response)
+    input_tokens = response["usage"]["inputTokens"] + cached["cache_read_tokens"] + cached["cache_write_tokens"]
+    return (input_tokens * input_price / 1000) + (response["usage"]["outputTokens"] * output_price / 1000)
+
+def converse(call_model_id, call_region, user_message):
+    client = get_client(call_region, max_pool_connections=10, max_attempts=1)
+    return client.converse(
+        modelId=call_model_id,
+        messages=[{"role": "user", "content": prompt_content(system_prompt, user_message, use_prompt_cache)}],
+        inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+    )
+
+def invoke_food(food_item, user_message, food_key=None):
+    print(food_item)
+    if use_response_cache:
+        start_time = time.time()
+        cache_key = response_cache.key(model_id, prompt_version, json.loads(user_message))
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, invocation_time=time.time() - start_time, cost=0.0, response_cache_hit=True)
+    try:
+        estimate = estimator.estimate(model_id, text=system_prompt.replace("{{foods}}", user_message), foods=1)
+        if not estimate["fits"]:
+            raise ValueError(f"Request of ~{estimate['input_tokens']} input tokens exceeds the model's input limit")
+        food_model_id, food_region = model_id, region
+        if use_routing:
+            response, invocation_time, food_region = router.call(
+                model_id,
+                lambda call_region: limiter.timed_call(model_id, call_region, lambda: converse(model_id, call_region, user_message), retries=1),
+                default_region=region
+            )
+            hedged, winner = False, "primary"
+        elif use_hedging:
+            hedge_model_id, hedge_region = hedge_target or (model_id, region)
+            response, invocation_time, hedged, winner = hedger.call(
+                (model_id, region),
+                lambda: converse(model_id, region, user_message),
+                lambda: converse(hedge_model_id, hedge_region, user_message),
+                hedge_target=(hedge_model_id, hedge_region),
+                cost_of=lambda response, target: food_cost(response, target[0])
             )
-            invocation_time = time.time() - start_time
-            
-            response_text = response["output"]["message"]["content"][0]["text"]
-            input_tokens = response["usage"]["inputTokens"]
-            output_tokens = response["usage"]["outputTokens"]
-            cost = (input_tokens * 0.00024 / 1000) + (output_tokens * 0.00097 / 1000)
-            
-            #time.sleep(0.1)  # Small delay to prevent rate limiting
-            
-            return {
-                "food_query": food_item['query'],
-                "actual": response_text,
-                "invocation_time": invocation_time,
-                "cost": cost
-            }
-        except Exception as e:
-            return {
-                "food_query": food_item['query'],
-                "actual": f"ERROR: {str(e)}",
-                "invocation_time": None,
-                "cost": None
-            }
+            if winner == "hedge":
+                food_model_id, food_region = hedge_model_id, hedge_region
+        else:
+            response, invocation_time = limiter.timed_call(model_id, region, lambda: converse(model_id, region, user_message))
+            hedged, winner = False, "primary"
+        
+        response_text = response["output"]["message"]["content"][0]["text"]
+        cost = food_cost(response, food_model_id)
+        cached = cache_usage(response)
+        
+        result = {
+            "food_query": food_item['query'],
+            "region": food_region,
+            "actual": response_text,
+            "invocation_time": invocation_time,
+            "cost": cost,
+            "input_tokens": response["usage"]["inputTokens"],
+            "output_tokens": response["usage"]["outputTokens"],
+            "cache_read_tokens": cached["cache_read_tokens"],
+            "cache_write_tokens": cached["cache_write_tokens"],
+            "hedged": hedged,
+            "winner": winner,
+            "response_cache_hit": False,
+            "food_cache_hit": False,
+            "rule_matched": False,
+            "estimate": estimate
+        }
+        if use_response_cache:
+            response_cache.put(cache_key, result)
+        if parse_ingredients(response_text, model_id) and food_key:
+            response_cache.put(food_key, result)
+        return result
+    except Exception as e:
+        return {
+            "food_query": food_item['query'],
+            "region": None,
+            "actual": f"ERROR: {str(e)}",
+            "invocation_time": None,
+            "cost": None,
+            "hedged": None,
+            "winner": None,
+            "response_cache_hit": False,
+            "food_cache_hit": False,
+            "rule_matched": False
+        }
 
 all_results = []
 
@@ -58,6 +154,8 @@ for row_idx, test_case in enumerate(test_data):
     input_data = json.loads(test_case['Prompt 3 - match sizes Input'])
     
     # Prepare tasks for this row
+    row_start_time = time.time()
+    row_results = []
     tasks = []
     for food_item in input_data['foods']:
         single_food_input = {
@@ -70,11 +168,32 @@ for row_idx, test_case in enumerate(test_data):
             "foods": [food_item]
         }
         user_message = json.dumps(single_food_input, indent=2)
-        tasks.append((food_item, user_message))
+        if use_serving_rules:
+            ingredient = match_food(input_data, food_item)
+            if ingredient is not None:
+                row_results.append({
+                    "food_query": food_item['query'],
+                    "region": None,
+                    "actual": json.dumps({"ingredients": [ingredient]}, ensure_ascii=False),
+                    "invocation_time": 0.0,
+                    "cost": 0.0,
+                    "hedged": False,
+                    "winner": "rules",
+                    "response_cache_hit": False,
+                    "food_cache_hit": False,
+                    "rule_matched": True
+                })
+                continue
+        food_key = None
+        if use_food_cache:
+            food_key = response_cache.key(model_id, prompt_version, food_cache_input(input_data, food_item), namespace="food")
+            cached = response_cache.get(food_key)
+            if cached is not None:
+                row_results.append(dict(cached, food_query=food_item['query'], invocation_time=0.0, cost=0.0, food_cache_hit=True))
+                continue
+        tasks.append((food_item, user_message, food_key))
     
     # Process with limited concurrency
-    row_start_time = time.time()
-    row_results = []
     with ThreadPoolExecutor(max_workers=10) as executor:
         futures = [executor.submit(invoke_food, *task) for task in tasks]
         for future in as_completed(futures):
@@ -92,6 +211,11 @@ for row_idx, test_case in enumerate(test_data):
         "food_count": len(input_data['foods']),
         "individual_results": row_results,
         "ingredients": combined_responses,
+        "matched_ingredients": merge_ingredients([result["actual"] for result in row_results]),
+        "food_cache_hits": sum(1 for result in row_results if result.get("food_cache_hit")),
+        "rule_matched": sum(1 for result in row_results if result.get("rule_matched")),
+        "estimated_cost": sum(result["estimate"]["cost"] for result in row_results
+                              if result.get("estimate") and not result.get("food_cache_hit") and not result.get("response_cache_hit")),
         "total_cost": total_cost
     }
     
@@ -101,4 +225,23 @@ for row_idx, test_case in enumerate(test_data):
 with open('outputs3/3_match_sizes_optimized_parallel.json', 'w') as f:
     json.dump(all_results, f, indent=2)
 
+food_latencies = [r["invocation_time"] for row in all_results for r in row["individual_results"] if r["invocation_time"]]
+row_latencies = [row["total_time"] for row in all_results]
 print(f"Completed all {len(test_data)} rows")
+if food_latencies:
+    print(f"Food latency p50 {percentile(food_latencies, 50):.2f}s, p99 {percentile(food_latencies, 99):.2f}s")
+    print(f"Row latency p50 {percentile(row_latencies, 50):.2f}s, p99 {percentile(row_latencies, 99):.2f}s")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
+if use_hedging:
+    print(f"Hedging: {hedger.stats()}")
+if use_routing:
+    print(f"Regions: {router.stats()}")
+if use_prompt_cache:
+    prompt_cache_stats = cache_stats([r for row in all_results for r in row['individual_results']
+                                      if not r.get('food_cache_hit') and not r.get('response_cache_hit')])
+    print(f"Prompt cache: {prompt_cache_stats}")
+    with open('outputs3/3_match_sizes_optimized_parallel_stats.json', 'w') as f:
+        json.dump({"prompt_cache": prompt_cache_stats}, f, indent=2)
+if use_response_cache or use_food_cache:
+    print(f"Response cache: {response_cache.stats()}")
@@ -1,6 +1,9 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from rate_limiter import limiter
+from food_cache import parse_ingredients
+from json_extract import parse_stats
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -13,15 +16,13 @@ df = pd.read_csv('/home/ubuntu/projects/fatsecret/data/test_data_clean.csv')
 test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']].to_dict('records')
 
 def invoke_food(food_item, user_message):
-    client = boto3.client("bedrock-runtime", region_name="us-west-2")
+    client = get_client("us-west-2", max_pool_connections=10, max_attempts=1)
     try:
-        start_time = time.time()
-        response = client.converse(
+        response, invocation_time = limiter.timed_call("us.meta.llama4-maverick-17b-instruct-v1:0", "us-west-2", lambda: client.converse(
             modelId="us.meta.llama4-maverick-17b-instruct-v1:0",
             messages=[{"role": "user", "content": [{"text": system_prompt.replace("{{foods}}",user_message)}]}],
             inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
-        )
-        invocation_time = time.time() - start_time
+        ))
         
         response_text = response["output"]["message"]["content"][0]["text"]
         input_tokens = response["usage"]["inputTokens"]
@@ -76,6 +77,8 @@ for row_idx, test_case in enumerate(test_data):
     
     # Combine results for this row
     combined_responses = " ".join([result["actual"] for result in row_results])
+    matched_ingredients = [ingredient for result in row_results if not result["actual"].startswith("ERROR")
+                           for ingredient in parse_ingredients(result["actual"], "us.meta.llama4-maverick-17b-instruct-v1:0")]
     total_cost = sum(result["cost"] for result in row_results if result["cost"])
     
     row_summary = {
@@ -84,17 +87,16 @@ for row_idx, test_case in enumerate(test_data):
         "food_count": len(input_data['foods']),
         "individual_results": row_results,
         "ingredients": combined_responses,
+        "matched_ingredients": matched_ingredients,
         "total_cost": total_cost
     }
     
     all_results.append(row_summary)
     print(f"Row {row_idx + 1} completed in {row_total_time:.2f}s with {len(input_data['foods'])} foods")
-    
-    # Sleep before next row
-    if row_idx < len(test_data) - 1:
-        time.sleep(3)
 
 with open('/home/ubuntu/projects/fatsecret/outputs/round3/3_match_sizes_parallel.json', 'w') as f:
     json.dump(all_results, f, indent=2)
 
 print(f"Completed all {len(test_data)} rows")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
@@ -1,6 +1,13 @@
 import pandas as pd
 import json
-import boto3
+from bedrock_client import get_client
+from rate_limiter import limiter
+from hedging import Hedger, percentile
+from response_cache import ResponseCache, prompt_hash
+from food_cache import food_cache_input, parse_ingredients
+from json_extract import parse_stats
+from prompt_cache import cache_stats, cache_usage, prompt_content
+from checkpoint import Checkpoint
 import time
 from botocore.exceptions import ClientError
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -17,7 +24,29 @@ test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']
 # Read models configuration
 models_df = pd.read_csv('data/models/step3_2.csv')
 
-def invoke_model(model_row, user_message, food_query, expected_output):
+# Hedging: if a call is slower than the p95 of recent calls for its model, send a
+# duplicate to hedge_regions[region] (or the same region) and keep the first reply
+use_hedging = False
+hedge_regions = {}
+hedger = Hedger(percentile=95)
+
+# Per-food cache: reuse a model's answer for a (food, servings, quantity phrase)
+# combination it has already matched
+use_food_cache = False
+food_cache = ResponseCache() if use_food_cache else None
+prompt_version = prompt_hash(prompt)
+
+# Send the static part of the prompt as a cacheable prefix (cachePoint before the
+# data) and record cacheRead/cacheWrite tokens
+use_prompt_cache = False
+
+# Append each finished request to a JSONL checkpoint as it completes; a restarted
+# run skips (model, row, food) keys already in it, and the results are put back in
+# task order at the end
+use_checkpoint = False
+checkpoint = Checkpoint('outputs/round2/3_match_sizes_single_food_parallel.checkpoint.jsonl') if use_checkpoint else None
+
+def invoke_model(model_row, user_message, food_query, expected_output, food_key_input=None):
     if "(latency_optimized)" in model_row['model']:
         model_id = model_row['model'].replace("(latency_optimized)", "").strip()
         performance = "optimized"
@@ -31,36 +60,52 @@ def invoke_model(model_row, user_message, food_query, expected_output):
     
     print(f"Testing model: {model_id} with food query: {food_query}")
     
-    # Create client for this region
-    client = boto3.client("bedrock-runtime", region_name=region)
+    if use_food_cache:
+        # Keyed on the full model name so standard and latency-optimized rows are timed separately
+        food_key = food_cache.key(model_row['model'].strip(), prompt_version, food_key_input, namespace="food")
+        cached = food_cache.get(food_key)
+        if cached is not None:
+            print(f"Food cache hit for {model_id} with food {food_query}")
+            return dict(cached, food_query=food_query, input=user_message, expected=expected_output,
+                        invocation_time=0.0, cost=0.0, food_cache_hit=True)
     
     print(prompt.replace("{{foods}}",user_message))
     conversation = [
         {
             "role": "user",
-            "content": [{"text": prompt.replace("{{foods}}",user_message)}],
+            "content": prompt_content(prompt, user_message, use_prompt_cache),
         }
     ]
     
+    def converse(call_region):
+        client = get_client(call_region, max_pool_connections=10, max_attempts=1)
+        return client.converse(
+            modelId=model_id,
+            messages=conversation,
+            inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9},
+            performanceConfig={"latency": performance}
+        )
+    
+    def food_cost(response):
+        # Cached prefix tokens are billed at the input price (the step 3 CSVs list no cache-read price)
+        cached = cache_usage(response)
+        input_tokens = response["usage"]["inputTokens"] + cached["cache_read_tokens"] + cached["cache_write_tokens"]
+        return (input_tokens * input_price / 1000) + (response["usage"]["outputTokens"] * output_price / 1000)
+    
     try:
-        # Retry mechanism
-        for attempt in range(3):
-            try:
-                start_time = time.time()
-                response = client.converse(
-                    modelId=model_id,
-                    messages=conversation,
-                    inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9},
-                    performanceConfig={"latency": performance}
-                )
-                end_time = time.time()
-                break
-            except Exception as e:
-                if attempt == 2:  # Last attempt
-                    raise e
-                time.sleep(2 ** attempt)  # Exponential backoff
-        
-        invocation_time = end_time - start_time
+        # Throttled calls are retried through the adaptive limiter
+        if use_hedging:
+            hedge_region = hedge_regions.get(region, region)
+            response, invocation_time, hedged, winner = hedger.call(
+                (model_id, region),
+                lambda: converse(region),
+                lambda: converse(hedge_region),
+                hedge_target=(model_id, hedge_region),
+                cost_of=lambda response, target: food_cost(response), retries=2
+            )
+        else:
+            response, invocation_time = limiter.timed_call(model_id, region, lambda: converse(region), retries=2)
+            hedged, winner = False, "primary"
         
         # Handle different response structures based on model type
         if "gpt" in model_id.lower():
@@ -75,7 +120,8 @@ def invoke_model(model_row, user_message, food_query, expected_output):
         # Calculate cost
         input_tokens = response["usage"]["inputTokens"]
         output_tokens = response["usage"]["outputTokens"]
-        cost = (input_tokens * input_price / 1000) + (output_tokens * output_price / 1000)
+        cost = food_cost(response)
+        cached = cache_usage(response)
         
         result = {
             "model": model_row['model'].strip(),
@@ -87,9 +133,16 @@ def invoke_model(model_row, user_message, food_query, expected_output):
             "invocation_time": invocation_time,
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
+            "cache_read_tokens": cached["cache_read_tokens"],
+            "cache_write_tokens": cached["cache_write_tokens"],
             "cost": cost,
+            "hedged": hedged,
+            "winner": winner,
+            "food_cache_hit": False,
             "success": True
         }
+        if parse_ingredients(response_text, model_id) and use_food_cache:
+            food_cache.put(food_key, result)
         
     except (ClientError, Exception) as e:
         result = {
@@ -102,7 +155,12 @@ def invoke_model(model_row, user_message, food_query, expected_output):
             "invocation_time": None,
             "input_tokens": None,
             "output_tokens": None,
+            "cache_read_tokens": None,
+            "cache_write_tokens": None,
             "cost": None,
+            "hedged": None,
+            "winner": None,
+            "food_cache_hit": False,
             "success": False
         }
     
@@ -113,12 +171,13 @@ def invoke_model(model_row, user_message, food_query, expected_output):
 
 # Prepare all tasks
 tasks = []
-for test_case in test_data:
+task_keys = []
+for row_idx, test_case in enumerate(test_data):
     input_data = json.loads(test_case['Prompt 3 - match sizes Input'])
     expected_output = test_case['Prompt 3 - match sizes Output']
     
     # Process each food item individually
-    for food_item in input_data['foods']:
+    for food_idx, food_item in enumerate(input_data['foods']):
         # Create new input with single food item
         single_food_input = {
             "input": input_data["input"],
@@ -133,16 +192,28 @@ for test_case in test_data:
         user_message = json.dumps(single_food_input, indent=2)
         
         for _, model_row in models_df.iterrows():
-            tasks.append((model_row, user_message, food_item['query'], expected_output))
+            tasks.append((model_row, user_message, food_item['query'], expected_output,
+                          food_cache_input(input_data, food_item)))
+            task_keys.append((model_row['model'], row_idx, food_idx))
 
 # Execute tasks in parallel
 results = []
 with ThreadPoolExecutor(max_workers=10) as executor:
-    future_to_task = {executor.submit(invoke_model, *task): task for task in tasks}
+    future_to_task = {executor.submit(invoke_model, *task): key for task, key in zip(tasks, task_keys)
+                      if not (use_checkpoint and key in checkpoint)}
+    if use_checkpoint:
+        print(f"Resuming: {len(tasks) - len(future_to_task)} of {len(tasks)} tasks already done")
     
     for future in as_completed(future_to_task):
         result = future.result()
         results.append(result)
+        if use_checkpoint:
+            checkpoint.write(future_to_task[future], result)
+
+if use_checkpoint:
+    results = checkpoint.ordered(task_keys)
+    checkpoint.compact(task_keys)
+    checkpoint.close()
 
 # Save results
 with open('outputs/round2/3_match_sizes_single_food_parallel_results.json', 'w') as f:
@@ -150,3 +221,17 @@ with open('outputs/round2/3_match_sizes_single_food_parallel_results.json', 'w')
 
 print(f"Completed testing {len(models_df)} models with individual food items in parallel")
 print(f"Results saved to 3_match_sizes_single_food_parallel_results.json")
+print(f"Limiter: {limiter.stats()}")
+print(f"JSON parsing: {parse_stats.stats()}")
+
+for model_name in sorted({r["model"] for r in results}):
+    latencies = [r["invocation_time"] for r in results if r["model"] == model_name and r["invocation_time"]]
+    if latencies:
+        print(f"{model_name}: p50 {percentile(latencies, 50):.2f}s, p99 {percentile(latencies, 99):.2f}s")
+if use_hedging:
+    print(f"Hedging: {hedger.stats()}")
+if use_food_cache:
+    print(f"Food cache: {food_cache.stats()}")
+if use_prompt_cache:
+    for model_name in sorted({r["model"] for r in results}):
+        print(f"{model_name} prompt cache: {cache_stats([r for r in results if r['model'] == model_name and not r.get('food_cache_hit')])}")
@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from statistics import mean, stdev
+from benchmark_harness import format_summary, load_benchmarks
+from results_store import ResultsStore
 
 def load_experiment_data(folder_path):
     experiments = {}
@@ -37,6 +39,33 @@ def load_experiment_data(folder_path):
     
     return experiments
 
+def load_benchmark_data(store_path):
+    """Same shape as load_experiment_data, one run per repetition of each stored benchmark"""
+    experiments = {}
+    for benchmark in load_benchmarks(store_path):
+        requests = pd.DataFrame(benchmark['requests'])
+        for repetition, run in requests.groupby('repetition'):
+            experiments.setdefault(benchmark['name'], {})[int(repetition)] = {
+                'total_cost': run['cost'].fillna(0).mean(),
+                'total_latency': run['latency'].fillna(0).mean(),
+                'total_input_tokens': run['input_tokens'].fillna(0).mean(),
+                'total_output_tokens': run['output_tokens'].fillna(0).mean(),
+                'num_requests': len(run)
+            }
+    return experiments
+
+def load_results_store_data(results_path):
+    """Same shape as load_experiment_data, one run per stored run of each runner; averaged in SQLite"""
+    experiments = {}
+    per_run = ResultsStore(results_path).query(
+        "SELECT runs.name, runs.started, AVG(COALESCE(cost, 0)) AS total_cost, AVG(COALESCE(latency, 0)) AS total_latency, "
+        "AVG(COALESCE(input_tokens, 0)) AS total_input_tokens, AVG(COALESCE(output_tokens, 0)) AS total_output_tokens, "
+        "COUNT(*) AS num_requests FROM requests JOIN runs ON runs.id = requests.run_id "
+        "WHERE requests.step = 3 AND runs.id NOT IN (SELECT run_id FROM benchmarks) GROUP BY runs.id ORDER BY runs.started")
+    for name, runs in per_run.groupby('name', sort=False):
+        experiments[name] = {i + 1: run.drop(['name', 'started']).to_dict() for i, (_, run) in enumerate(runs.iterrows())}
+    return experiments
+
 def create_comparison_plots(experiments):
     # Set scientific plotting style
     plt.style.use('seaborn-v0_8-whitegrid')
@@ -197,8 +226,26 @@ def print_summary_stats(experiments):
         print(f"  {row['experiment']}: {row['avg_output_tokens']:.0f} (±{row['std_output_tokens']:.0f})")
 
 # Main execution
-folder_path = '/home/ubuntu/projects/fatsecret/outputs3/round4'
-experiments = load_experiment_data(folder_path)
+# Read repetitions from the benchmark harness store instead of the _1/_2/_3 files;
+# name the benchmarks old/new/ultra to get them in the plots
+use_benchmark_store = False
+store_path = '/home/ubuntu/projects/fatsecret/outputs3/results.sqlite'
+# Or read the step 3 runs recorded by the runners' use_results_store
+use_results_store = False
+results_path = '/home/ubuntu/projects/fatsecret/outputs3/results.sqlite'
+
+if use_benchmark_store:
+    experiments = load_benchmark_data(store_path)
+    print("=== LATENCY PERCENTILES (95% bootstrap CI) ===\n")
+    for benchmark in load_benchmarks(store_path):
+        print(f"{benchmark['name']} ({benchmark['started']}):")
+        print(format_summary(benchmark['summary']))
+    print()
+elif use_results_store:
+    experiments = load_results_store_data(results_path)
+else:
+    folder_path = '/home/ubuntu/projects/fatsecret/outputs3/round4'
+    experiments = load_experiment_data(folder_path)
 
 print_summary_stats(experiments)
 create_comparison_plots(experiments)
@@ -0,0 +1,84 @@
+import json
+import os
+from urllib.parse import quote
+
+import aiohttp
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError
+from yarl import URL
+
+
+class AsyncBedrockClient:
+    """Awaitable drop-in for bedrock-runtime converse over a pooled aiohttp session.
+
+    Requests are SigV4-signed with botocore and sent directly, so concurrency is
+    bounded by max_connections instead of a thread pool. Pass endpoint_url (or set
+    BEDROCK_ENDPOINT_URL) to point the client at a local stand-in server.
+    """
+
+    def __init__(self, region="us-west-2", endpoint_url=None, max_connections=100, timeout=60):
+        self.region = region
+        endpoint_url = endpoint_url or os.environ.get("BEDROCK_ENDPOINT_URL")
+        self.endpoint_url = (endpoint_url or f"https://bedrock-runtime.{region}.amazonaws.com").rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._credentials = boto3.session.Session().get_credentials()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _signed_headers(self, url, body):
+        request = AWSRequest(method="POST", url=url, data=body, headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+        # Frozen credentials pick up refreshed temporary credentials on every call
+        SigV4Auth(self._credentials.get_frozen_credentials(), "bedrock", self.region).add_auth(request)
+        return dict(request.headers.items())
+
+    async def _post(self, operation, model_id, path, params):
+        url = f"{self.endpoint_url}/model/{quote(model_id, safe='')}/{path}"
+        body = json.dumps(params).encode('utf-8')
+        headers = self._signed_headers(url, body)
+
+        # encoded=True keeps the %3A in model ids exactly as it was signed
+        response = await self._get_session().post(URL(url, encoded=True), data=body, headers=headers)
+        if response.status >= 400:
+            try:
+                payload = await response.json(content_type=None)
+            except ValueError:
+                payload = {}
+            finally:
+                response.release()
+            error_code = response.headers.get("x-amzn-ErrorType", "").split(':')[0] or str(response.status)
+            raise ClientError({
+                "Error": {"Code": error_code, "Message": payload.get("message", payload.get("Message", ""))},
+                "ResponseMetadata": {"HTTPStatusCode": response.status, "HTTPHeaders": dict(response.headers)}
+            }, operation)
+        return response
+
+    async def converse(self, modelId, **kwargs):
+        response = await self._post("Converse", modelId, "converse", kwargs)
+        async with response:
+            result = await response.json(content_type=None)
+        result["ResponseMetadata"] = {"HTTPStatusCode": response.status, "HTTPHeaders": dict(response.headers)}
+        return result
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
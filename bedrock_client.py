@@ -0,0 +1,59 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+from cassette import CassetteClient, open_cassette
+
+# One long-lived bedrock-runtime client per (region, config). boto3 clients are
+# thread-safe, so the same instance is shared by ThreadPoolExecutor workers. The
+# asyncio runners use async_bedrock.AsyncBedrockClient instead.
+_clients = {}
+_lock = threading.Lock()
+
+DEFAULT_POOL_SIZE = 10
+
+# Point every runner at another endpoint, e.g. the local bedrock_stub_server
+ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL")
+
+# Record converse calls to, or replay them from, a JSONL cassette:
+#   BEDROCK_CASSETTE=outputs3/round4.cassette.jsonl BEDROCK_CASSETTE_MODE=record|replay
+#   BEDROCK_CASSETTE_LATENCY=recorded|zero
+CASSETTE_PATH = os.environ.get("BEDROCK_CASSETTE")
+CASSETTE_MODE = os.environ.get("BEDROCK_CASSETTE_MODE", "replay")
+CASSETTE_LATENCY = os.environ.get("BEDROCK_CASSETTE_LATENCY", "recorded")
+
+
+def get_client(region="us-west-2", max_pool_connections=DEFAULT_POOL_SIZE, read_timeout=60, max_attempts=None):
+    """Return a pooled bedrock-runtime client for region, sized for the runner's concurrency.
+
+    max_attempts=1 turns off botocore's own retries so throttling reaches the
+    caller (and rate_limiter) instead of being retried blindly.
+    """
+    key = (region, max_pool_connections, read_timeout, max_attempts)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config = Config(
+                max_pool_connections=max_pool_connections,
+                read_timeout=read_timeout,
+                tcp_keepalive=True,
+                retries={"max_attempts": max_attempts} if max_attempts else None,
+            )
+            # Sessions are not thread-safe, so each client gets its own
+            client = boto3.session.Session().client("bedrock-runtime", region_name=region, config=config,
+                                                    endpoint_url=ENDPOINT_URL)
+            if CASSETTE_PATH:
+                client = CassetteClient(client, open_cassette(CASSETTE_PATH), CASSETTE_MODE, CASSETTE_LATENCY)
+            _clients[key] = client
+    return client
+
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
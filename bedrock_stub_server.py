@@ -0,0 +1,317 @@
+import argparse
+import glob
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# Local stand-in for the bedrock-runtime converse / converse-stream wire protocol.
+# Responses are replayed from the recorded outputs in outputs1/, outputs2/ and
+# outputs3/ (or templated from the request when no recording matches), with a
+# configurable latency distribution, token counts and throttling.
+#
+#   python bedrock_stub_server.py --port 8080 --latency-median 1.5 --throttle-rate 0.05
+#   BEDROCK_ENDPOINT_URL=http://localhost:8080 AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x python 2_match_foods.py
+
+
+def cached_prefix(body):
+    """Text before the first cachePoint of the request, or None when it has none"""
+    texts = [block.get("text", "") for block in body.get("system", [])]
+    for block in body.get("system", []):
+        if "cachePoint" in block:
+            return "\n".join(texts[:body["system"].index(block)])
+    for message in body.get("messages", []):
+        for block in message.get("content", []):
+            if "cachePoint" in block:
+                return "\n".join(texts)
+            texts.append(block.get("text", ""))
+    return None
+
+
+def load_recordings():
+    """Recorded model outputs keyed by step: chat_input/input text for steps 1/2, food_id for step 3"""
+    recordings = {1: {}, 2: {}, 3: {}}
+    for path in glob.glob('outputs1/*.json'):
+        with open(path, 'r') as f:
+            for row in json.load(f):
+                if 'chat_input' in row['input_data']:
+                    recordings[1][row['input_data']['chat_input']] = row['extracted_foods']
+    for path in glob.glob('outputs2/*.json'):
+        with open(path, 'r') as f:
+            for row in json.load(f):
+                if 'input' in row['input_data']:
+                    recordings[2][row['input_data']['input']] = row['extracted_foods']
+    for path in glob.glob('outputs3/**/*.json', recursive=True):
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        # match_sizes.py writes {"config", "runs": [{"rows": [...]}]}
+        if isinstance(rows, dict):
+            rows = [row for run in rows.get('runs', []) for row in run.get('rows', [])]
+        for row in rows:
+            ingredients = row.get('ingredients') if isinstance(row, dict) else None
+            if isinstance(ingredients, dict):
+                for ingredient in ingredients.get('ingredients', []) or []:
+                    recordings[3][str(ingredient.get('food_id'))] = ingredient
+    return recordings
+
+
+def request_text(body):
+    texts = [block.get("text", "") for block in body.get("system", [])]
+    for message in body.get("messages", []):
+        if message.get("role") == "user":
+            texts.extend(block.get("text", "") for block in message.get("content", []))
+    return "\n".join(texts)
+
+
+def request_payload(text):
+    """The last top-level JSON object in the prompt that carries the user's input (or micro-batched rows)"""
+    decoder = json.JSONDecoder()
+    payload = None
+    end = 0
+    for match in re.finditer(r'\{', text):
+        if match.start() < end:
+            continue
+        try:
+            candidate, candidate_end = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if isinstance(candidate, dict) and ("chat_input" in candidate or "input" in candidate or "rows" in candidate):
+            payload, end = candidate, candidate_end
+    return payload
+
+
+def default_serving(result):
+    servings = result.get('servings', {}).get('serving', [])
+    if isinstance(servings, dict):
+        servings = [servings]
+    for serving in servings:
+        if str(serving.get('is_default')) == "1":
+            return serving
+    return servings[0] if servings else None
+
+
+def templated_ingredient(result):
+    serving = default_serving(result) or {}
+    grams = re.search(r'\(([\d.]+)\s*(\S+)\)\s*$', serving.get('serving', ''))
+    amount = float(grams.group(1)) if grams else 100.0
+    metric = "ml" if grams and grams.group(2) in ("ml", "мл") else "g"
+    description = re.sub(r'^[\d./\s]+', '', serving.get('serving_description', '')) or "serving"
+    return {
+        "food_id": int(result['food_id']),
+        "food_name": result.get('food_name', ''),
+        "match_accuracy": 80,
+        "eaten": {
+            "singular_description": description,
+            "plural_description": description,
+            "units": 1.0,
+            "metric_description": metric,
+            "per_unit_metric_amount": amount,
+            "total_metric_amount": amount,
+            "imperial_description": "fl oz" if metric == "ml" else "oz",
+            "per_unit_imperial_amount": round(amount / (29.5735 if metric == "ml" else 28.3495), 3),
+            "total_imperial_amount": round(amount / (29.5735 if metric == "ml" else 28.3495), 3),
+        },
+        "suggested_serving": {
+            "serving_id": serving.get('serving_id', ''),
+            "serving": serving.get('serving', ''),
+            "is_default": int(serving.get('is_default', 1)),
+            "serving_description": serving.get('serving_description', ''),
+            "number_of_units": 1.0,
+        },
+    }
+
+
+def build_response(recordings, text):
+    payload = request_payload(text) or {}
+    metadata = {k: payload[k] for k in ['language', 'region', 'language_description', 'region_description'] if k in payload}
+
+    if "chat_input" in payload:
+        recorded = recordings[1].get(payload["chat_input"])
+        return recorded or dict(foods=[], input=payload["chat_input"], **metadata)
+
+    foods = payload.get("foods", [])
+    if "rows" in payload:
+        foods = [food for row in payload["rows"] for food in row.get("foods", [])]
+    if '"servings"' not in text:
+        recorded = recordings[2].get(payload.get("input"))
+        if recorded:
+            return recorded
+        food_ids = [str(food['results'][0]['food_id']) for food in foods if food.get('results')]
+        return dict(input=payload.get("input", ""), food_ids=",".join(food_ids),
+                    queries=[food.get('query', '') for food in foods], **metadata)
+
+    ingredients = []
+    for food in foods:
+        results = food.get('results', [])
+        recorded = next((recordings[3][str(r['food_id'])] for r in results if str(r['food_id']) in recordings[3]), None)
+        if recorded is not None:
+            ingredients.append(recorded)
+        elif results:
+            ingredients.append(templated_ingredient(results[0]))
+    return {"ingredients": ingredients}
+
+
+def encode_event(event_type, payload):
+    """Encode one application/vnd.amazon.eventstream message"""
+    headers = b""
+    for name, value in ((":event-type", event_type), (":content-type", "application/json"), (":message-type", "event")):
+        name_bytes, value_bytes = name.encode(), value.encode()
+        headers += struct.pack('>B', len(name_bytes)) + name_bytes + struct.pack('>BH', 7, len(value_bytes)) + value_bytes
+    body = json.dumps(payload).encode('utf-8')
+    prelude = struct.pack('>II', 12 + len(headers) + len(body) + 4, len(headers))
+    message = prelude + struct.pack('>I', zlib.crc32(prelude)) + headers + body
+    return message + struct.pack('>I', zlib.crc32(message))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.config["verbose"]:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_type(self, status, error_type, message):
+        self.send_json(status, {"message": message}, {"x-amzn-ErrorType": f"{error_type}:http://internal.amazon.com/coral/com.amazon.bedrock/"})
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        match = re.match(r'^/model/([^/]+)/(converse|converse-stream)$', self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        if not match:
+            return self.send_error_type(404, "ResourceNotFoundException", f"Unknown path {self.path}")
+        model_id, operation = unquote(match.group(1)), match.group(2)
+
+        server = self.server
+        config = server.config
+        with server.lock:
+            server.in_flight += 1
+            in_flight = server.in_flight
+            server.requests += 1
+        try:
+            if random.random() < config["throttle_rate"] or (config["max_concurrency"] and in_flight > config["max_concurrency"]):
+                with server.lock:
+                    server.throttled += 1
+                return self.send_error_type(429, "ThrottlingException", "Too many requests, please wait before trying again.")
+
+            body = json.loads(raw_body or b"{}")
+            text = request_text(body)
+            response_text = json.dumps(build_response(server.recordings, text), ensure_ascii=False, indent=2)
+            input_tokens = config["input_tokens"] or max(1, len(text) // 4)
+            output_tokens = config["output_tokens"] or max(1, len(response_text) // 4)
+
+            ttft = random.lognormvariate(0, config["latency_sigma"]) * config["latency_median"]
+            generation = output_tokens * config["ms_per_output_token"] / 1000
+            usage = {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens}
+
+            # Prompt caching: the prefix before a cachePoint is written on first sight and
+            # read afterwards; cached tokens are reported apart from inputTokens and cut
+            # time to first token in proportion
+            prefix = cached_prefix(body)
+            if prefix is not None and config["prompt_cache"]:
+                cached_tokens = min(input_tokens - 1, len(prefix) // 4)
+                with server.lock:
+                    hit = prefix in server.prefixes
+                    server.prefixes.add(prefix)
+                usage["inputTokens"] = input_tokens - cached_tokens
+                usage["cacheReadInputTokens" if hit else "cacheWriteInputTokens"] = cached_tokens
+                if hit:
+                    ttft *= 0.3 + 0.7 * usage["inputTokens"] / input_tokens
+            metrics = {"latencyMs": int((ttft + generation) * 1000)}
+
+            if operation == "converse":
+                time.sleep(ttft + generation)
+                return self.send_json(200, {
+                    "output": {"message": {"role": "assistant", "content": [{"text": response_text}]}},
+                    "stopReason": "end_turn",
+                    "usage": usage,
+                    "metrics": metrics,
+                })
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(ttft)
+            self.write_chunk(encode_event("messageStart", {"role": "assistant"}))
+            chunks = [response_text[i:i + 16] for i in range(0, len(response_text), 16)]
+            for chunk in chunks:
+                time.sleep(generation / len(chunks))
+                self.write_chunk(encode_event("contentBlockDelta", {"contentBlockIndex": 0, "delta": {"text": chunk}}))
+            self.write_chunk(encode_event("contentBlockStop", {"contentBlockIndex": 0}))
+            self.write_chunk(encode_event("messageStop", {"stopReason": "end_turn"}))
+            self.write_chunk(encode_event("metadata", {"usage": usage, "metrics": metrics}))
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def make_server(host="127.0.0.1", port=8080, latency_median=1.0, latency_sigma=0.35, ms_per_output_token=8.0,
+                throttle_rate=0.0, max_concurrency=None, input_tokens=None, output_tokens=None, prompt_cache=True, verbose=False):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = {
+        "latency_median": latency_median,
+        "latency_sigma": latency_sigma,
+        "ms_per_output_token": ms_per_output_token,
+        "throttle_rate": throttle_rate,
+        "max_concurrency": max_concurrency,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "prompt_cache": prompt_cache,
+        "verbose": verbose,
+    }
+    server.recordings = load_recordings()
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.requests = 0
+    server.throttled = 0
+    server.prefixes = set()
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a stub server on a background thread and return (server, endpoint_url)"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local bedrock-runtime converse stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-median", type=float, default=1.0, help="median seconds to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.35, help="lognormal sigma of time to first token")
+    parser.add_argument("--ms-per-output-token", type=float, default=8.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with ThrottlingException")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="throttle requests beyond this many in flight")
+    parser.add_argument("--input-tokens", type=int, default=None, help="fixed inputTokens instead of an estimate")
+    parser.add_argument("--output-tokens", type=int, default=None, help="fixed outputTokens instead of an estimate")
+    parser.add_argument("--no-prompt-cache", dest="prompt_cache", action="store_false", help="ignore cachePoint blocks")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(**vars(args))
+    print(f"Serving bedrock-runtime stand-in on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,83 @@
+import time
+import json
+import boto3
+from statistics import mean, median
+
+from bedrock_client import get_client, clear_clients
+
+# Compares the old per-call boto3.client() construction against the pooled
+# client from bedrock_client. Set LIVE = True to also time real converse calls
+# (needs AWS credentials); otherwise only the client setup cost is measured.
+REGION = "us-west-2"
+MODEL_ID = "us.amazon.nova-micro-v1:0"
+REPETITIONS = 20
+LIVE = False
+
+
+def time_construction():
+    fresh = []
+    for _ in range(REPETITIONS):
+        start_time = time.perf_counter()
+        boto3.client("bedrock-runtime", region_name=REGION)
+        fresh.append(time.perf_counter() - start_time)
+
+    clear_clients()
+    pooled = []
+    for _ in range(REPETITIONS):
+        start_time = time.perf_counter()
+        get_client(REGION)
+        pooled.append(time.perf_counter() - start_time)
+
+    return fresh, pooled
+
+
+def call(client):
+    start_time = time.perf_counter()
+    client.converse(
+        modelId=MODEL_ID,
+        messages=[{"role": "user", "content": [{"text": "Reply with the word ok."}]}],
+        inferenceConfig={"maxTokens": 5, "temperature": 0.0}
+    )
+    return time.perf_counter() - start_time
+
+
+def time_requests():
+    fresh = []
+    for _ in range(REPETITIONS):
+        start_time = time.perf_counter()
+        call(boto3.client("bedrock-runtime", region_name=REGION))
+        fresh.append(time.perf_counter() - start_time)
+
+    clear_clients()
+    client = get_client(REGION)
+    call(client)  # warm the connection pool once, as a long-lived runner would
+    pooled = []
+    for _ in range(REPETITIONS):
+        start_time = time.perf_counter()
+        call(get_client(REGION))
+        pooled.append(time.perf_counter() - start_time)
+
+    return fresh, pooled
+
+
+def summarize(label, fresh, pooled):
+    summary = {
+        "fresh_mean_ms": mean(fresh) * 1000,
+        "fresh_median_ms": median(fresh) * 1000,
+        "pooled_mean_ms": mean(pooled) * 1000,
+        "pooled_median_ms": median(pooled) * 1000,
+        "saved_per_request_ms": (mean(fresh) - mean(pooled)) * 1000,
+    }
+    print(f"\n{label}")
+    for key, value in summary.items():
+        print(f"  {key}: {value:.3f}")
+    return summary
+
+
+if __name__ == "__main__":
+    results = {"client_setup": summarize("Client setup", *time_construction())}
+    if LIVE:
+        results["converse_request"] = summarize("Converse request (setup + call)", *time_requests())
+
+    with open('outputs3/benchmark_client_reuse.json', 'w') as f:
+        json.dump(results, f, indent=2)
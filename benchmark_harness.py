@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bedrock_client import get_client
+from rate_limiter import limiter
+from results_store import STORE_PATH, ResultsStore
+from token_estimator import pricing_from_csvs
+
+# Statistical benchmark harness. A target is a callable that runs one full pass
+# (every test row) and returns one record per request. The harness runs it
+# `warmup` times without recording, then `repetitions` times, and records each
+# benchmark as a run in the results store (outputs3/results.sqlite): every
+# request with its repetition, the config, and a summary of p50/p90/p99 latency,
+# rows/s, output tokens/s and cost per row, each with a bootstrap confidence
+# interval. Rows are distinct row_index values, so targets that send one request
+# per food still report rows.
+#
+#   python benchmark_harness.py --target match_sizes --strategy threads --variant new -n 5
+#   python benchmark_harness.py --target step1 --models us.amazon.nova-micro-v1:0 -n 10 --warmup 2
+#
+# Request records: {"row_index", "food", "latency", "cost", "input_tokens", "output_tokens", "error"}
+
+STEP_COLUMNS = {1: 'Prompt 1 - Extract foods Input', 2: 'Prompt 2 - match foods Input'}
+STEP_PROMPTS = {1: 'prompts/prompt1.txt', 2: 'prompts/prompt2.txt'}
+PREFILL = {"role": "assistant", "content": [{"text": " Here is the JSON response: ```json"}]}
+
+
+def bootstrap_ci(values, stat=np.mean, samples=1000, confidence=0.95, seed=0):
+    """(low, high) bootstrap percentile interval of stat over values, or None for fewer than 2 values"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return None
+    rng = np.random.default_rng(seed)
+    estimates = [stat(rng.choice(values, size=len(values), replace=True)) for _ in range(samples)]
+    tail = (1 - confidence) / 2 * 100
+    return float(np.percentile(estimates, tail)), float(np.percentile(estimates, 100 - tail))
+
+
+def _with_ci(values, stat):
+    return {"value": float(stat(values)) if len(values) else None, "ci": bootstrap_ci(values, stat)}
+
+
+def summarize(requests, wall_times):
+    """Latency percentiles, throughput and cost per row over all recorded repetitions"""
+    ok = [r for r in requests if not r.get("error") and r.get("latency") is not None]
+    latencies = np.array([r["latency"] for r in ok], dtype=float)
+    rows, row_costs, tokens = {}, {}, {}
+    for r in requests:
+        rows.setdefault(r["repetition"], set()).add(r["row_index"])
+    for r in ok:
+        key = (r["repetition"], r["row_index"])
+        row_costs[key] = row_costs.get(key, 0.0) + (r["cost"] or 0.0)
+        tokens[r["repetition"]] = tokens.get(r["repetition"], 0) + (r.get("output_tokens") or 0)
+    costs = np.array(list(row_costs.values()), dtype=float)
+    rows_per_second = [len(rows.get(i, ())) / wall for i, wall in enumerate(wall_times) if wall]
+    tokens_per_second = [tokens.get(i, 0) / wall for i, wall in enumerate(wall_times) if wall]
+    return {
+        "requests": len(requests),
+        "errors": len(requests) - len(ok),
+        "repetitions": len(wall_times),
+        "latency_p50": _with_ci(latencies, lambda v: np.percentile(v, 50)),
+        "latency_p90": _with_ci(latencies, lambda v: np.percentile(v, 90)),
+        "latency_p99": _with_ci(latencies, lambda v: np.percentile(v, 99)),
+        "latency_mean": _with_ci(latencies, np.mean),
+        "rows_per_second": _with_ci(np.array(rows_per_second), np.mean),
+        "output_tokens_per_second": _with_ci(np.array(tokens_per_second), np.mean),
+        "cost_per_row": _with_ci(costs, np.mean),
+    }
+
+
+def run_benchmark(name, run_once, repetitions=5, warmup=1, config=None, store_path=STORE_PATH, step=None):
+    """Run a target warmup + repetitions times, record the benchmark in the results store and return it"""
+    for i in range(warmup):
+        print(f"[{name}] warmup {i + 1}/{warmup}")
+        run_once()
+
+    store = ResultsStore(store_path)
+    run_id = store.start_run(name, config=config)
+    requests, wall_times = [], []
+    for repetition in range(repetitions):
+        start_time = time.time()
+        records = run_once()
+        wall_times.append(time.time() - start_time)
+        for record in records:
+            requests.append(dict(record, repetition=repetition))
+            result = dict(record, invocation_time=record.get("latency"),
+                          actual=f"ERROR: {record['error']}" if record.get("error") else None)
+            store.record(run_id, step, result, row_index=record.get("row_index"), food=record.get("food"),
+                         model=record.get("model"), repetition=repetition)
+        print(f"[{name}] repetition {repetition + 1}/{repetitions}: {len(records)} requests in {wall_times[-1]:.2f}s")
+
+    benchmark = {
+        "id": run_id,
+        "name": name,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config or {},
+        "warmup": warmup,
+        "wall_times": wall_times,
+        "summary": summarize(requests, wall_times),
+        "requests": requests,
+    }
+    store.record_benchmark(run_id, warmup, wall_times, benchmark["summary"])
+    store.close()
+    return benchmark
+
+
+def load_benchmarks(store_path=STORE_PATH, name=None):
+    """Every stored benchmark (optionally only those called name), oldest first"""
+    if not os.path.exists(store_path):
+        return []
+    store = ResultsStore(store_path)
+    try:
+        return store.benchmarks(name)
+    finally:
+        store.close()
+
+
+def requests_frame(store_path=STORE_PATH):
+    """One DataFrame row per recorded request, tagged with its benchmark id and name"""
+    return pd.DataFrame([dict(request, benchmark_id=b["id"], name=b["name"])
+                         for b in load_benchmarks(store_path) for request in b["requests"]])
+
+
+def _request_record(row_idx, result):
+    return {
+        "row_index": row_idx,
+        "food": result.get("food_query"),
+        "model": result["model"],
+        "latency": result["invocation_time"],
+        "cost": result["cost"],
+        "input_tokens": result["input_tokens"],
+        "output_tokens": result["output_tokens"],
+        "cache_read_tokens": result["cache_read_tokens"],
+        "model_calls": result.get("chunks", 1) if result["input_tokens"] else 0,
+        "error": None if isinstance(result["actual"], dict) else str(result["actual"]),
+    }
+
+
+def match_sizes_target(strategy, variant, models, region="us-west-2", root=".", rows=None, **engine_options):
+    """run_once() for a match_sizes.py strategy/variant; one record per request (per food or
+    chunk for the strategies that split rows, otherwise per row)"""
+    from match_sizes import Engine, RUNNERS, load_models, load_rows
+
+    engine = Engine(variant, root=root, **engine_options)
+    models = load_models(os.path.join(root, models) if models.endswith('.csv') else models, region, engine.estimator.pricing)
+    test_rows = load_rows(os.path.join(root, 'data/test_data_clean.csv'), rows)
+
+    def run_once():
+        records = []
+        for row in RUNNERS[strategy](engine, test_rows, models):
+            if row["individual_results"]:
+                records.extend(_request_record(row["row_index"], result) for result in row["individual_results"])
+                continue
+            records.append({
+                "row_index": row["row_index"],
+                "food": None,
+                "model": ",".join(m["model"] for m in models),
+                "latency": row["total_time"],
+                "cost": row["cost"],
+                "input_tokens": row["input_tokens"],
+                "output_tokens": row["output_tokens"],
+                "cache_read_tokens": row["cache_read_tokens"],
+                "model_calls": row["model_calls"],
+                "error": row["errors"][0] if row["errors"] else None,
+            })
+        return records
+    return run_once
+
+
+def step_target(step, model_id, region="us-west-2", root=".", rows=None, workers=10):
+    """run_once() for step 1 or 2: every row as one request on a thread pool"""
+    with open(os.path.join(root, STEP_PROMPTS[step]), 'r', encoding='utf-8') as f:
+        system_prompt = f.read().strip().strip('"')
+    df = pd.read_csv(os.path.join(root, 'data/test_data_clean.csv'), usecols=[STEP_COLUMNS[step]], nrows=rows)
+    inputs = [json.loads(value) for value in df[STEP_COLUMNS[step]]]
+    input_price, output_price = pricing_from_csvs(os.path.join(root, 'data/models/*.csv')).get(model_id, (0.0, 0.0))
+    client = get_client(region, max_pool_connections=workers, max_attempts=1)
+
+    def invoke(row_idx):
+        request = dict(
+            modelId=model_id,
+            messages=[{"role": "user", "content": [{"text": system_prompt}]},
+                      {"role": "user", "content": [{"text": json.dumps(inputs[row_idx], indent=2)}]},
+                      PREFILL],
+            inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+        )
+        record = {"row_index": row_idx, "model": model_id, "latency": None, "cost": None,
+                  "input_tokens": None, "output_tokens": None, "error": None}
+        try:
+            response, invocation_time = limiter.timed_call(model_id, region, lambda: client.converse(**request))
+            usage = response["usage"]
+            record.update(latency=invocation_time, input_tokens=usage["inputTokens"], output_tokens=usage["outputTokens"],
+                          cost=(usage["inputTokens"] * input_price + usage["outputTokens"] * output_price) / 1000)
+        except Exception as e:
+            record["error"] = str(e)
+        return record
+
+    def run_once():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(invoke, range(len(inputs))))
+    return run_once
+
+
+def format_summary(summary):
+    def fmt(metric, unit="", digits=2):
+        value, ci = metric["value"], metric["ci"]
+        if value is None:
+            return "n/a"
+        text = f"{value:.{digits}f}{unit}"
+        return text + (f" [{ci[0]:.{digits}f}, {ci[1]:.{digits}f}]" if ci else "")
+    return "\n".join([
+        f"  requests {summary['requests']} ({summary['errors']} errors) over {summary['repetitions']} repetitions",
+        f"  latency p50 {fmt(summary['latency_p50'], 's')}, p90 {fmt(summary['latency_p90'], 's')}, p99 {fmt(summary['latency_p99'], 's')}",
+        f"  throughput {fmt(summary['rows_per_second'], ' rows/s')}, {fmt(summary['output_tokens_per_second'], ' tokens/s', 0)}",
+        f"  cost per row ${fmt(summary['cost_per_row'], digits=6)}",
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a pipeline step or step 3 strategy")
+    parser.add_argument("--target", choices=["match_sizes", "step1", "step2"], default="match_sizes")
+    parser.add_argument("--name", default=None, help="defaults to the target and its options")
+    parser.add_argument("-n", "--repetitions", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--strategy", default="threads")
+    parser.add_argument("--variant", default="new")
+    parser.add_argument("--models", default=None, help="model id(s) or a step 3 model CSV")
+    parser.add_argument("--region", default="us-west-2")
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--store", default=STORE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.target == "match_sizes":
+        models = args.models or "us.meta.llama4-maverick-17b-instruct-v1:0"
+        step = 3
+        run_once = match_sizes_target(args.strategy, args.variant, models, region=args.region, root=args.root, rows=args.rows,
+                                      max_workers=args.workers)
+        name = args.name or f"match_sizes/{args.strategy}/{args.variant}/{models}"
+    else:
+        step = int(args.target[-1])
+        models = args.models or "us.amazon.nova-micro-v1:0"
+        run_once = step_target(step, models, args.region, root=args.root, rows=args.rows, workers=args.workers)
+        name = args.name or f"{args.target}/{models}"
+
+    benchmark = run_benchmark(name, run_once, args.repetitions, args.warmup, config=vars(args),
+                              store_path=os.path.join(args.root, args.store), step=step)
+    print(f"{name}:")
+    print(format_summary(benchmark["summary"]))
+    print(f"Limiter: {limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import copy
+import json
+import time
+from statistics import median
+
+from compaction import compact, restore_response
+
+# Compares batch_ultra's original restoration (scan every food and result for each
+# returned ingredient) against the food_id index built by compaction.compact().
+# Payloads are synthetic step 3 inputs: FOOD_COUNT queries with a growing number
+# of candidates each; the response holds one ingredient per query.
+FOOD_COUNT = 20
+CANDIDATES_PER_FOOD = [5, 25, 100, 250, 500]
+REPETITIONS = 5
+
+
+def make_payload(food_count, candidates):
+    foods = []
+    for food_idx in range(food_count):
+        results = []
+        for result_idx in range(candidates):
+            # Every query also offers food 1000, so duplicates across queries are exercised
+            food_id = "1000" if result_idx == 0 else str(food_idx * candidates + result_idx + 2000)
+            results.append({
+                "food_id": food_id,
+                "food_name": f"Food {food_id}",
+                "brand_name": f"Brand {food_idx}",
+                "food_type": "Brand",
+                "servings": {"serving": {"serving_id": food_id, "serving_description": "100 g",
+                                         "is_default": "1", "serving": "100 g (100.000 g)"}},
+            })
+        foods.append({"query": str(food_idx), "results": results})
+    input_data = {"input": "benchmark", "language": "en", "region": "us", "language_description": "English",
+                  "region_description": "United States", "include_servings": "defaultAndGrams", "foods": foods}
+    response = {"ingredients": [{"food_id": int(food["results"][-1]["food_id"])} for food in foods]
+                + [{"food_id": 1000} for _ in foods]}
+    return input_data, response
+
+
+def scan_restore(response_json, input_data):
+    """batch_ultra's original restoration loop"""
+    food_metadata = []
+    for food in input_data['foods']:
+        food_meta = {'query': food.get('query')}
+        for result in food['results']:
+            food_meta.setdefault('results_meta', []).append({
+                'brand_name': result.get('brand_name', ''),
+                'food_type': result.get('food_type', '')
+            })
+        food_metadata.append(food_meta)
+
+    for ingredient in response_json['ingredients']:
+        food_id = str(ingredient.get('food_id', ''))
+        for food_idx, food_meta in enumerate(food_metadata):
+            for result_idx, result_meta in enumerate(food_meta.get('results_meta', [])):
+                original_food = input_data['foods'][food_idx]['results'][result_idx]
+                if str(original_food['food_id']) == food_id:
+                    ingredient.update(result_meta)
+                    break
+    return response_json
+
+
+def time_once(fn):
+    start_time = time.perf_counter()
+    fn()
+    return time.perf_counter() - start_time
+
+
+def benchmark(candidates):
+    input_data, response = make_payload(FOOD_COUNT, candidates)
+    _, state = compact(input_data, step=3)
+
+    scan = [time_once(lambda: scan_restore(copy.deepcopy(response), input_data)) for _ in range(REPETITIONS)]
+    indexed = [time_once(lambda: restore_response(copy.deepcopy(response), state)) for _ in range(REPETITIONS)]
+
+    # The n-th duplicate ingredient gets the n-th query's brand; the scan gives every one the first
+    brands = [i.get("brand_name") for i in restore_response(copy.deepcopy(response), state)["ingredients"] if i["food_id"] == 1000]
+    return {
+        "candidates": FOOD_COUNT * candidates,
+        "scan_median_ms": median(scan) * 1000,
+        "indexed_median_ms": median(indexed) * 1000,
+        "speedup": median(scan) / median(indexed) if median(indexed) else None,
+        "duplicates_restored_per_query": brands == [f"Brand {i}" for i in range(FOOD_COUNT)],
+    }
+
+
+if __name__ == "__main__":
+    results = []
+    for candidates in CANDIDATES_PER_FOOD:
+        summary = benchmark(candidates)
+        results.append(summary)
+        print(f"{summary['candidates']:>6} candidates: scan {summary['scan_median_ms']:.3f} ms, "
+              f"indexed {summary['indexed_median_ms']:.3f} ms ({summary['speedup']:.1f}x)")
+
+    with open('outputs3/benchmark_restoration.json', 'w') as f:
+        json.dump(results, f, indent=2)
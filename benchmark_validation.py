@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+import bedrock_client
+from benchmark_harness import STORE_PATH, format_summary, run_benchmark
+from bedrock_client import get_client
+from json_extract import extract_json
+from match_sizes import single_food_input
+from rate_limiter import limiter
+from response_schema import SchemaError, parse_food_match, validate_food_match
+from token_estimator import pricing_from_csvs
+
+# Structured output cost: raw converse + response_schema validation against the
+# LangChain path (ChatBedrock(...).with_structured_output(FoodMatchResponse), as
+# in 3_matched_size_batch_new.py before it moved to converse). Both paths send
+# the same single-food prompts for the same rows, one call at a time, through
+# the benchmark harness (warmup, repetitions, latency CIs). Per call it records
+# wall latency and the calling thread's CPU time; per path, the median import
+# time in a fresh interpreter. The offline section times schema validation
+# alone on the recorded step 3 outputs.
+#
+#   python benchmark_validation.py --rows 5 -n 3
+#   python benchmark_validation.py --paths converse --rows 2   # without langchain_aws installed
+
+MODEL_ID = "us.meta.llama4-maverick-17b-instruct-v1:0"
+REGION = "us-west-2"
+INFERENCE = {"maxTokens": 2048, "temperature": 0.1, "topP": 0.9}
+
+IMPORTS = {
+    "converse": "import boto3, json_extract, response_schema",
+    "langchain": "import langchain_aws, pydantic",
+}
+
+
+def import_time(statement, repeats=5):
+    """Median seconds a fresh interpreter takes to run statement, or None if it fails"""
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if out.returncode:
+            return None
+        times.append(float(out.stdout))
+    return statistics.median(times)
+
+
+def pydantic_models():
+    """FoodMatchResponse and its nested models, as declared for the LangChain path"""
+    from pydantic import BaseModel, Field
+    from typing import List, Optional
+
+    class EatenInfo(BaseModel):
+        singular_description: str = Field(description="Singular form of serving")
+        plural_description: str = Field(description="Plural form of serving")
+        units: float = Field(description="Number of units")
+        metric_description: str = Field(description="ml or g")
+        per_unit_metric_amount: float = Field(description="Metric amount per unit")
+        total_metric_amount: float = Field(description="Total metric amount")
+        imperial_description: str = Field(description="oz or fl oz")
+        per_unit_imperial_amount: float = Field(description="Imperial amount per unit")
+        total_imperial_amount: float = Field(description="Total imperial amount")
+
+    class SuggestedServing(BaseModel):
+        serving_id: str = Field(description="ID of matched serving")
+        serving: str = Field(description="Serving description name")
+        is_default: int = Field(description="Default serving flag")
+        serving_description: str = Field(description="Serving description")
+        number_of_units: float = Field(description="Number of units for serving")
+
+    class Ingredient(BaseModel):
+        food_id: int = Field(description="Selected food ID")
+        food_name: str = Field(description="Selected food name")
+        food_type: str = Field(description="Selected food type")
+        brand_name: Optional[str] = Field(description="Brand name or empty")
+        match_accuracy: int = Field(description="Match accuracy 1-100")
+        eaten: EatenInfo
+        suggested_serving: SuggestedServing
+
+    class FoodMatchResponse(BaseModel):
+        query: List[str] = Field(description="List of original food queries")
+        ingredients: List[Ingredient]
+
+    return FoodMatchResponse
+
+
+def converse_call():
+    """call(prompt, query) -> (validated dict, input tokens, output tokens) over raw converse"""
+    client = get_client(REGION, max_attempts=1)
+
+    def call(prompt, query):
+        response = client.converse(modelId=MODEL_ID, messages=[{"role": "user", "content": [{"text": prompt}]}],
+                                   inferenceConfig=INFERENCE)
+        parsed = parse_food_match(response["output"]["message"]["content"][0]["text"], MODEL_ID,
+                                  defaults={"query": [str(query)]})
+        return parsed, response["usage"]["inputTokens"], response["usage"]["outputTokens"]
+    return call
+
+
+def langchain_call():
+    """call(prompt, query) -> (validated dict, input tokens, output tokens) through with_structured_output"""
+    from langchain_aws import ChatBedrock
+
+    model = ChatBedrock(
+        model_id=MODEL_ID, region_name=REGION, endpoint_url=bedrock_client.ENDPOINT_URL,
+        model_kwargs={"max_tokens": INFERENCE["maxTokens"], "temperature": INFERENCE["temperature"], "top_p": INFERENCE["topP"]}
+    ).with_structured_output(pydantic_models(), include_raw=True)
+
+    def call(prompt, query):
+        output = model.invoke(prompt)
+        if output["parsing_error"] is not None or output["parsed"] is None:
+            raise SchemaError([f"Structured output failed: {output['parsing_error']}"])
+        usage = getattr(output["raw"], "usage_metadata", None) or {}
+        return output["parsed"].model_dump(), usage.get("input_tokens"), usage.get("output_tokens")
+    return call
+
+
+CALLS = {"converse": converse_call, "langchain": langchain_call}
+
+
+def prompts_for(rows, system_prompt):
+    """[(row_index, food query, prompt)] with one single-food prompt per food, as the runner sends them"""
+    return [(row_idx, food_item['query'],
+             system_prompt.replace("{{foods}}", json.dumps(single_food_input(row, food_item), indent=2)))
+            for row_idx, row in enumerate(rows) for food_item in row['foods']]
+
+
+def path_target(path, prompts, pricing):
+    """run_once() for a path: every prompt in turn, one record per call with latency, CPU time and cost"""
+    call = CALLS[path]()
+    input_price, output_price = pricing.get(MODEL_ID, (0.0, 0.0))
+
+    def run_once():
+        records = []
+        for row_idx, query, prompt in prompts:
+            record = {"row_index": row_idx, "food": query, "model": MODEL_ID, "latency": None, "cpu_time": None,
+                      "cost": None, "input_tokens": None, "output_tokens": None, "error": None}
+            start_time, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                _, record["input_tokens"], record["output_tokens"] = limiter.call(MODEL_ID, REGION, lambda: call(prompt, query))
+            except Exception as e:
+                record["error"] = str(e)
+            if record["input_tokens"] is not None and record["output_tokens"] is not None:
+                record["cost"] = (record["input_tokens"] * input_price + record["output_tokens"] * output_price) / 1000
+            record["latency"] = time.perf_counter() - start_time
+            record["cpu_time"] = time.thread_time() - start_cpu
+            records.append(record)
+        return records
+    return run_once
+
+
+def validation_overhead(outputs, repeats=200):
+    """Mean microseconds to validate one recorded step 3 output, per validator available"""
+    parsed = [extract_json(output) for output in outputs]
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for data in parsed:
+            validate_food_match(data)
+    timings["response_schema"] = (time.perf_counter() - start) / (repeats * len(parsed)) * 1e6
+    try:
+        food_match_response = pydantic_models()
+    except ImportError:
+        return timings
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for data in parsed:
+            food_match_response.model_validate(data)
+    timings["pydantic"] = (time.perf_counter() - start) / (repeats * len(parsed)) * 1e6
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark converse + schema validation against LangChain structured output")
+    parser.add_argument("--paths", default="converse,langchain")
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--prompt", default="prompts/prompt3_new.txt")
+    parser.add_argument("--rows", type=int, default=3)
+    parser.add_argument("-n", "--repetitions", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--store", default=STORE_PATH)
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.root, args.prompt), 'r', encoding='utf-8') as f:
+        system_prompt = f.read().strip().strip('"')
+    df = pd.read_csv(os.path.join(args.root, 'data/test_data_clean.csv'),
+                     usecols=['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output'], nrows=args.rows)
+    prompts = prompts_for([json.loads(value) for value in df['Prompt 3 - match sizes Input']], system_prompt)
+    pricing = pricing_from_csvs(os.path.join(args.root, 'data/models/*.csv'))
+
+    comparison = []
+    for path in args.paths.split(','):
+        seconds = import_time(IMPORTS[path])
+        if seconds is None:
+            print(f"{path}: dependencies not installed, skipping")
+            continue
+        benchmark = run_benchmark(f"validation/{path}", path_target(path, prompts, pricing), args.repetitions, args.warmup,
+                                  config=dict(vars(args), path=path), store_path=os.path.join(args.root, args.store), step=3)
+        ok = [r for r in benchmark["requests"] if not r["error"]]
+        print(f"{path}:")
+        print(format_summary(benchmark["summary"]))
+        comparison.append({
+            "path": path,
+            "import_s": seconds,
+            "latency_p50_s": benchmark["summary"]["latency_p50"]["value"],
+            "latency_p99_s": benchmark["summary"]["latency_p99"]["value"],
+            "cpu_ms_per_call": statistics.mean(r["cpu_time"] for r in ok) * 1000 if ok else None,
+            "errors": benchmark["summary"]["errors"],
+        })
+
+    print("\n=== STRUCTURED OUTPUT PATHS ===")
+    print(pd.DataFrame(comparison).to_string(index=False))
+    overhead = validation_overhead(df['Prompt 3 - match sizes Output'].tolist())
+    print("Validation only (us per response): " + ", ".join(f"{name} {us:.1f}" for name, us in overhead.items()))
+    print(f"Limiter: {limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
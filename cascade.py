@@ -0,0 +1,194 @@
+import threading
+
+from hedging import percentile
+from response_schema import INGREDIENT, compile_schema
+from unit_conversion import GRAMS_PER_OZ, ML_PER_FL_OZ
+
+# Cost- and quality-aware model cascade for step 3. Each request goes to the
+# first (cheapest) tier; its reply is accepted only if it passes
+#
+#   schema        every ingredient matches the Ingredient/EatenInfo/SuggestedServing schema
+#   coverage      every food with search results has an ingredient picked from them
+#   accuracy      every ingredient has match_accuracy >= min_accuracy
+#   metric        g/ml (г/мл) amounts are positive, below MAX_METRIC_AMOUNT, and
+#                 units * per_unit, total and the imperial figures agree
+#
+# otherwise the same request is sent to the next tier. The last tier's reply is
+# kept even when it fails the checks (they still count in its stats). A result
+# carries the cost, tokens and time of every attempt, so row costs are blended
+# over the tiers that were tried. Foods resolved by the serving rules never reach
+# a tier, and response cache hits are counted per tier apart from the paid
+# attempts, so neither inflates hit rates or hides escalations.
+#
+#   cascade = Cascade(engine, tiers, min_accuracy=80)   # tiers cheapest first
+#   result = cascade.invoke(single_food_input(row, food_item))
+#   print(format_report(cascade.stats(rows=len(rows))))
+#
+#   python match_sizes.py --strategy cascade --min-accuracy 80 \
+#       --models openai.gpt-oss-20b-1:0,us.meta.llama4-scout-17b-instruct-v1:0,us.meta.llama4-maverick-17b-instruct-v1:0
+
+MIN_ACCURACY = 80
+MAX_METRIC_AMOUNT = 5000.0
+TOLERANCE = 0.05
+ATTEMPT_KEYS = ["model", "cost", "invocation_time", "input_tokens", "output_tokens"]
+
+_ingredients = compile_schema([INGREDIENT])
+
+
+def _close(a, b, tolerance=TOLERANCE):
+    return abs(a - b) <= tolerance * max(abs(a), abs(b), 1.0)
+
+
+METRIC_DESCRIPTIONS = {"g": "g", "г": "g", "ml": "ml", "мл": "ml"}
+
+
+def metric_problems(eaten, path):
+    problems = []
+    metric = METRIC_DESCRIPTIONS.get(eaten["metric_description"].strip().lower())
+    if metric is None:
+        problems.append(f"{path}: metric_description {eaten['metric_description']!r}")
+        return problems
+    total = eaten["total_metric_amount"]
+    if not 0 < total <= MAX_METRIC_AMOUNT:
+        problems.append(f"{path}: total_metric_amount {total}")
+        return problems
+    if not _close(eaten["units"] * eaten["per_unit_metric_amount"], total):
+        problems.append(f"{path}: units * per_unit_metric_amount != total_metric_amount ({total})")
+    per_oz = ML_PER_FL_OZ if metric == "ml" else GRAMS_PER_OZ
+    if not _close(eaten["total_imperial_amount"] * per_oz, total):
+        problems.append(f"{path}: total_imperial_amount {eaten['total_imperial_amount']} for {total} {eaten['metric_description']}")
+    return problems
+
+
+def check_response(actual, input_data, min_accuracy=MIN_ACCURACY):
+    """{check: [problems]} for the checks a restored step 3 reply fails; empty when it is accepted"""
+    if not isinstance(actual, dict):
+        return {"error": [str(actual)[:200]]}
+    errors = []
+    ingredients = _ingredients(actual.get("ingredients"), "$.ingredients", errors)
+    if errors:
+        return {"schema": errors}
+
+    failed = {}
+    picked = {str(ingredient["food_id"]) for ingredient in ingredients}
+    for food in input_data.get('foods', []):
+        candidates = {str(result.get('food_id')).strip() for result in food.get('results', [])}
+        if candidates and not candidates & picked:
+            failed.setdefault("coverage", []).append(f"no ingredient for {food.get('query')!r}")
+    for i, ingredient in enumerate(ingredients):
+        if ingredient["match_accuracy"] < min_accuracy:
+            failed.setdefault("accuracy", []).append(f"$.ingredients[{i}].match_accuracy {ingredient['match_accuracy']}")
+        problems = metric_problems(ingredient["eaten"], f"$.ingredients[{i}].eaten")
+        if problems:
+            failed.setdefault("metric", []).extend(problems)
+    return failed
+
+
+class Cascade:
+    """Sends step 3 requests through an Engine to tiers of models, escalating rejected replies. Safe to share between threads."""
+
+    def __init__(self, engine, tiers, min_accuracy=MIN_ACCURACY):
+        self.engine = engine
+        self.tiers = tiers
+        self.min_accuracy = min_accuracy
+        self._lock = threading.Lock()
+        self._tiers = [{"attempts": 0, "accepted": 0, "cache_hits": 0, "failed_checks": {}, "cost": 0.0, "latencies": []}
+                       for _ in tiers]
+        self._requests = []
+
+    def invoke(self, input_data):
+        """The accepted (or last tier's) result, with cost/tokens/time summed over attempts and the tier that answered"""
+        attempts = []
+        for tier, model in enumerate(self.tiers):
+            result = self.engine.invoke(input_data, model)
+            if result["invocation_time"] == 0.0 and result.get("rule_matched"):
+                # Every food matched by the serving rules: no model was asked
+                with self._lock:
+                    self._requests.append({"tier": None, "outcome": "serving_rules", "cost": 0.0, "latency": None})
+                return dict(result, tier=None, attempts=[])
+            failed = check_response(result["actual"], input_data, self.min_accuracy)
+            attempts.append(dict({key: result[key] for key in ATTEMPT_KEYS}, failed_checks=failed))
+            self._record(tier, result, failed)
+            if not failed:
+                break
+
+        def total(key):
+            values = [attempt[key] for attempt in attempts if attempt[key] is not None]
+            return sum(values) if values else None
+
+        result = dict(result, **{key: total(key) for key in ATTEMPT_KEYS[1:]}, tier=tier, attempts=attempts)
+        with self._lock:
+            self._requests.append({"tier": tier, "outcome": "response_cache" if result.get("response_cache_hit") else "model",
+                                   "cost": result["cost"], "latency": result["invocation_time"]})
+        return result
+
+    def _record(self, tier, result, failed):
+        with self._lock:
+            entry = self._tiers[tier]
+            if result.get("response_cache_hit"):
+                entry["cache_hits"] += 1
+                return
+            entry["attempts"] += 1
+            entry["cost"] += result["cost"] or 0
+            if result["invocation_time"]:
+                entry["latencies"].append(result["invocation_time"])
+            if failed:
+                for check in failed:
+                    entry["failed_checks"][check] = entry["failed_checks"].get(check, 0) + 1
+            else:
+                entry["accepted"] += 1
+
+    def stats(self, rows=None):
+        """Per tier attempts, hit rate, cache hits, failed checks, cost and latency percentiles; totals and blended cost per row"""
+        with self._lock:
+            tiers = []
+            for model, entry in zip(self.tiers, self._tiers):
+                latencies = entry["latencies"]
+                tiers.append({
+                    "model": model["model"],
+                    "attempts": entry["attempts"],
+                    "accepted": entry["accepted"],
+                    "cache_hits": entry["cache_hits"],
+                    "hit_rate": entry["accepted"] / entry["attempts"] if entry["attempts"] else None,
+                    "failed_checks": dict(entry["failed_checks"]),
+                    "cost": entry["cost"],
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p90": percentile(latencies, 90),
+                    "latency_p99": percentile(latencies, 99),
+                })
+            requests = list(self._requests)
+        cost = sum(r["cost"] or 0 for r in requests)
+        latencies = [r["latency"] for r in requests if r["latency"]]
+        tiered = [r for r in requests if r["tier"] is not None]
+        return {
+            "tiers": tiers,
+            "requests": len(requests),
+            "outcomes": {outcome: sum(1 for r in requests if r["outcome"] == outcome)
+                         for outcome in ("model", "response_cache", "serving_rules")},
+            "answered_by_tier": [sum(1 for r in tiered if r["tier"] == tier) for tier in range(len(self.tiers))],
+            "escalation_rate": sum(1 for r in tiered if r["tier"] > 0) / len(tiered) if tiered else None,
+            "cost": cost,
+            "cost_per_request": cost / len(requests) if requests else None,
+            "cost_per_row": cost / rows if rows else None,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+        }
+
+
+def format_report(stats):
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    outcomes = stats["outcomes"]
+    lines = [f"Cascade: {stats['requests']} requests ({outcomes['model']} model, {outcomes['response_cache']} response cache, "
+             f"{outcomes['serving_rules']} serving rules), {stats['escalation_rate'] or 0:.0%} escalated, "
+             f"cost ${stats['cost']:.6f}" + (f" (${stats['cost_per_row']:.6f}/row)" if stats['cost_per_row'] is not None else "") +
+             f", latency p50 {seconds(stats['latency_p50'])} p90 {seconds(stats['latency_p90'])} p99 {seconds(stats['latency_p99'])}"]
+    for tier, (entry, answered) in enumerate(zip(stats["tiers"], stats["answered_by_tier"])):
+        hit_rate = f"{entry['hit_rate']:.0%}" if entry['hit_rate'] is not None else "-"
+        lines.append(f"  tier {tier} {entry['model']}: {entry['attempts']} attempts, {hit_rate} accepted, {entry['cache_hits']} cache hits, "
+                     f"answered {answered}, cost ${entry['cost']:.6f}, latency p50 {seconds(entry['latency_p50'])} "
+                     f"p90 {seconds(entry['latency_p90'])} p99 {seconds(entry['latency_p99'])}"
+                     + (f", failed {entry['failed_checks']}" if entry['failed_checks'] else ""))
+    return "\n".join(lines)
@@ -0,0 +1,101 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def request_key(modelId, messages, inferenceConfig=None, system=None, performanceConfig=None, **_):
+    """Canonical hash of the parts of a converse request that determine the response"""
+    canonical = {"modelId": modelId, "messages": messages, "inferenceConfig": inferenceConfig or {}}
+    if system:
+        canonical["system"] = system
+    # Only when set, so recordings of standard calls keep their keys
+    if performanceConfig:
+        canonical["performanceConfig"] = performanceConfig
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    """Append-only JSONL store of converse request/response pairs keyed by request_key"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, model_id, response, latency):
+        response = {k: v for k, v in response.items() if k != "ResponseMetadata"}
+        entry = {"key": key, "modelId": model_id, "latency": latency, "recorded_at": time.time(), "response": response}
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class CassetteClient:
+    """Wraps a bedrock-runtime client to record converse calls to, or replay them from, a cassette.
+
+    mode="record" calls through and stores every response; mode="replay" serves
+    stored responses and raises CassetteMiss for unknown requests. latency="recorded"
+    sleeps for the originally measured call time, latency="zero" returns at once.
+    Anything other than converse is passed through to the wrapped client.
+    """
+
+    def __init__(self, client, cassette, mode="replay", latency="recorded"):
+        self.client = client
+        self.cassette = cassette
+        self.mode = mode
+        self.latency = latency
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def converse(self, **request):
+        key = request_key(**request)
+        if self.mode == "replay":
+            entry = self.cassette.get(key)
+            if entry is None:
+                with self._lock:
+                    self.misses += 1
+                raise CassetteMiss(f"No recording for {request.get('modelId')} request {key[:12]}")
+            with self._lock:
+                self.hits += 1
+            if self.latency == "recorded":
+                time.sleep(entry["latency"])
+            return copy.deepcopy(entry["response"])
+
+        start_time = time.time()
+        response = self.client.converse(**request)
+        self.cassette.put(key, request.get("modelId"), response, time.time() - start_time)
+        return response
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def open_cassette(path):
+    """Shared Cassette per path, so every client in the process appends to the same store"""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
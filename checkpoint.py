@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+
+# Crash-safe progress log for long runs. Every finished request is appended to a
+# JSONL file as {"key": [...], "record": {...}} and flushed; the file is fsynced
+# every fsync_every records or fsync_interval seconds. A restarted run loads the
+# log, skips keys it already holds (e.g. (model, cache mode, row, food)) and
+# appends the rest. A torn last line from a crash is dropped on load. Writers may
+# finish out of order (as_completed loops); ordered()/compact() put the records
+# back in row order at the end.
+#
+#   checkpoint = Checkpoint('outputs2/2_match_foods.checkpoint.jsonl')
+#   if (model_id, use_cache, row_idx) not in checkpoint:
+#       checkpoint.write((model_id, use_cache, row_idx), row_summary)
+#   all_results = checkpoint.ordered()
+#   checkpoint.compact()
+
+
+def _sort_key(key):
+    # Numbers before strings so rows sort 0, 1, 2, ..., 10 rather than as text
+    return tuple((0, part, "") if isinstance(part, (int, float)) and not isinstance(part, bool) else (1, 0, str(part))
+                 for part in key)
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished records keyed by tuples. Safe to share between threads."""
+
+    def __init__(self, path, fsync_every=10, fsync_interval=5.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self.records = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._load()
+        self.resumed = len(self.records)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self.records[tuple(entry["key"])] = entry["record"]
+                good_end += len(line)
+        # Cut a partially written tail so new records start on a clean line
+        if good_end < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_end)
+
+    def __contains__(self, key):
+        return tuple(key) in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key, default=None):
+        return self.records.get(tuple(key), default)
+
+    def write(self, key, record):
+        key = tuple(key)
+        line = json.dumps({"key": list(key), "record": record}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.records[key] = record
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.time() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def sync(self):
+        with self._lock:
+            self._file.flush()
+            self._sync()
+
+    def ordered(self, keys=None):
+        """Records in the order of keys (skipping unfinished ones), or sorted by key"""
+        with self._lock:
+            if keys is None:
+                keys = sorted(self.records, key=_sort_key)
+            return [self.records[tuple(key)] for key in keys if tuple(key) in self.records]
+
+    def compact(self, keys=None):
+        """Rewrite the log with one line per key, in the order of keys (then any others sorted), atomically"""
+        with self._lock:
+            order = [tuple(key) for key in keys or [] if tuple(key) in self.records]
+            listed = set(order)
+            order += sorted((key for key in self.records if key not in listed), key=_sort_key)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for key in order:
+                    f.write(json.dumps({"key": list(key), "record": self.records[key]}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._unsynced = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            self._sync()
+            self._file.close()
@@ -0,0 +1,223 @@
+import copy
+import json
+
+from token_estimator import DEFAULT_CALIBRATION, estimate_text, family_of, load_calibration
+
+# Reversible prompt compaction. Each step has a declarative policy saying which
+# fields can be left out of the model input, which keys are shortened, whether
+# serving lists are deduplicated and how tightly the JSON is written. compact()
+# returns the user message plus the state needed to put everything back, and
+# only uses the compacted form when expand() reproduces the input exactly.
+#
+#   strip          top-level keys restored from the input after the call
+#   echo           top-level keys still sent, but also copied onto the response
+#   strip_food     keys removed from each foods[] entry
+#   strip_result   keys removed from each foods[].results[] entry, restored onto
+#                  the response ingredient with the same food_id through a
+#                  food_id index built while stripping
+#   rename         result keys shortened for the model, explained in a key legend
+#   dedupe_servings  flatten servings.serving to a list, drop serving_description
+#                  when it repeats the start of "serving" and is_default when "0".
+#                  Opt-in: prompt3_ultra.txt matches on both fields and echoes
+#                  them in suggested_serving, so step 3 sends them by default
+#   separators     json.dumps separators; None keeps indent=2
+#
+# Savings are estimated with the calibrated token_estimator rates for the
+# model's family, so escaped Cyrillic is not counted at 4 characters a token.
+
+METADATA_KEYS = ['language', 'region', 'language_description', 'region_description', 'include_servings']
+
+POLICIES = {
+    1: {
+        "strip": ['language_description', 'region_description'],
+        "separators": (',', ':'),
+    },
+    2: {
+        "strip": ['language_description', 'region_description'],
+        "rename": {"food_id": "id", "food_name": "name", "brand_name": "brand", "food_type": "type"},
+        "separators": (',', ':'),
+    },
+    3: {
+        "strip": METADATA_KEYS,
+        "echo": ['input'],
+        "strip_food": ['query'],
+        "strip_result": ['brand_name', 'food_type'],
+        "separators": (',', ':'),
+    },
+}
+
+
+_calibration = None
+
+
+def estimate_tokens(text, model_id=None, calibration=None):
+    """Calibrated input token estimate for text, with the defaults for unknown model families"""
+    global _calibration
+    if calibration is None:
+        if _calibration is None:
+            _calibration = load_calibration()
+        calibration = _calibration
+    return estimate_text(text, calibration.get(family_of(model_id or ""), DEFAULT_CALIBRATION))
+
+
+def _serving_prefix(serving):
+    return serving.get('serving', '').split(' (')[0]
+
+
+def _compact_servings(servings):
+    shape = "dict" if isinstance(servings.get('serving'), dict) else "list"
+    entries = servings['serving'] if shape == "list" else [servings['serving']]
+    compacted, flags = [], []
+    for serving in entries:
+        serving = dict(serving)
+        flag = {}
+        if 'serving_description' in serving and serving['serving_description'] == _serving_prefix(serving):
+            del serving['serving_description']
+            flag["description"] = True
+        if serving.get('is_default') == "0":
+            del serving['is_default']
+            flag["not_default"] = True
+        compacted.append(serving)
+        flags.append(flag)
+    return compacted, {"shape": shape, "flags": flags}
+
+
+def _expand_servings(compacted, servings_state):
+    entries = []
+    for serving, flag in zip(compacted, servings_state["flags"]):
+        serving = dict(serving)
+        if flag.get("description"):
+            serving['serving_description'] = _serving_prefix(serving)
+        if flag.get("not_default"):
+            serving['is_default'] = "0"
+        entries.append(serving)
+    return {"serving": entries[0] if servings_state["shape"] == "dict" else entries}
+
+
+def _compact_data(input_data, policy):
+    rename = policy.get("rename", {})
+    data = {k: v for k, v in input_data.items() if k not in policy.get("strip", [])}
+    state = {
+        "stripped": {k: input_data[k] for k in policy.get("strip", []) if k in input_data},
+        "echo": {k: input_data[k] for k in policy.get("echo", []) if k in input_data},
+        "order": list(input_data),
+        "foods": [],
+        "index": {},
+    }
+    if 'foods' not in input_data or not isinstance(input_data['foods'], list) or not input_data['foods'] \
+            or not isinstance(input_data['foods'][0], dict):
+        return data, state
+
+    foods = []
+    for food in input_data['foods']:
+        food_state = {
+            "stripped": {k: food[k] for k in policy.get("strip_food", []) if k in food},
+            "order": list(food),
+            "results": [],
+        }
+        compact_food = {k: v for k, v in food.items() if k not in policy.get("strip_food", []) and k != 'results'}
+        results = []
+        indexed = set()
+        for result in food.get('results', []):
+            result_state = {
+                "stripped": {k: result[k] for k in policy.get("strip_result", []) if k in result},
+                "order": list(result),
+            }
+            # One entry per query a food_id appears under, in query order
+            food_id = str(result.get('food_id'))
+            if food_id not in indexed:
+                indexed.add(food_id)
+                state["index"].setdefault(food_id, []).append(result_state["stripped"])
+            compact_result = {}
+            for key, value in result.items():
+                if key in policy.get("strip_result", []):
+                    continue
+                if key == 'servings' and policy.get("dedupe_servings") and isinstance(value, dict) and 'serving' in value:
+                    value, result_state["servings"] = _compact_servings(value)
+                compact_result[rename.get(key, key)] = value
+            results.append(compact_result)
+            food_state["results"].append(result_state)
+        if 'results' in food:
+            compact_food['results'] = results
+        foods.append(compact_food)
+        state["foods"].append(food_state)
+    data['foods'] = foods
+    return data, state
+
+
+def expand(data, state, policy):
+    """Rebuild the original input from its compacted form"""
+    reverse = {short: key for key, short in policy.get("rename", {}).items()}
+    merged = dict(data, **state["stripped"])
+    if state["foods"]:
+        foods = []
+        for food, food_state in zip(data['foods'], state["foods"]):
+            food = dict(food, **food_state["stripped"])
+            if 'results' in food:
+                results = []
+                for result, result_state in zip(food['results'], food_state["results"]):
+                    result = {reverse.get(k, k): v for k, v in result.items()}
+                    result.update(result_state["stripped"])
+                    if "servings" in result_state:
+                        result['servings'] = _expand_servings(result['servings'], result_state["servings"])
+                    results.append({k: result[k] for k in result_state["order"] if k in result})
+                food['results'] = results
+            foods.append({k: food[k] for k in food_state["order"] if k in food})
+        merged['foods'] = foods
+    return {k: merged[k] for k in state["order"] if k in merged}
+
+
+def render(data, policy):
+    separators = policy.get("separators")
+    if separators:
+        text = json.dumps(data, ensure_ascii=False, separators=separators)
+    else:
+        text = json.dumps(data, indent=2)
+    rename = policy.get("rename")
+    if rename:
+        legend = ", ".join(f"{short}={key}" for key, short in rename.items())
+        text = f"Keys: {legend}\n{text}"
+    return text
+
+
+def compact(input_data, step, policy=None, model_id=None, calibration=None):
+    """(user_message, state) for input_data under the step's policy.
+
+    state carries what was removed, the policy used and estimated input tokens
+    before/after for model_id. If the compacted form does not expand back to
+    input_data the full input is sent unchanged.
+    """
+    policy = POLICIES[step] if policy is None else policy
+    baseline = json.dumps(input_data, indent=2)
+    data, state = _compact_data(input_data, policy)
+    state["policy"] = policy
+    if expand(copy.deepcopy(data), state, policy) != input_data:
+        user_message = baseline
+        state = {"stripped": {}, "echo": {}, "order": list(input_data), "foods": [], "index": {}, "policy": {}, "fallback": True}
+    else:
+        user_message = render(data, policy)
+    state["tokens_before"] = estimate_tokens(baseline, model_id, calibration)
+    state["tokens_after"] = estimate_tokens(user_message, model_id, calibration)
+    state["tokens_saved"] = state["tokens_before"] - state["tokens_after"]
+    return user_message, state
+
+
+def restore_response(response_json, state):
+    """Put stripped metadata back onto the model's response"""
+    if not isinstance(response_json, dict):
+        return response_json
+    response_json.update(state["echo"])
+    response_json.update(state["stripped"])
+
+    # Restore food metadata to ingredients. The n-th ingredient with a food_id
+    # takes the metadata of the n-th query that offered it.
+    seen = {}
+    for ingredient in response_json.get('ingredients', []) or []:
+        food_id = str(ingredient.get('food_id', ''))
+        entries = state["index"].get(food_id)
+        if not entries:
+            continue
+        occurrence = seen.get(food_id, 0)
+        seen[food_id] = occurrence + 1
+        ingredient.update(entries[min(occurrence, len(entries) - 1)])
+    return response_json
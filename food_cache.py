@@ -0,0 +1,65 @@
+import re
+
+from json_extract import try_extract_json
+
+# Clause boundaries in a free-text meal description. A "." followed by a digit
+# is a decimal point, not a boundary.
+_CLAUSE_SPLIT = re.compile(r'[,;!?\n]+|\.(?!\d)|\s+(?:and|with|plus|и|с|со|а также)\s+', re.IGNORECASE)
+
+
+def _stems(text):
+    return {word[:4] for word in re.findall(r'\w+', text.lower()) if len(word) > 2 and not word.isdigit()}
+
+
+def normalize_phrase(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip(' .,;:!?')
+
+
+def quantity_phrase(input_text, food_name):
+    """The clause of input_text that describes food_name, normalized.
+
+    Clauses are matched on shared 4-letter word prefixes, which survives plurals
+    and Russian case endings. When nothing matches, the whole input is used so a
+    food is never shared between inputs that might quantify it differently.
+    """
+    food_stems = _stems(food_name)
+    best, best_overlap = None, 0
+    for clause in _CLAUSE_SPLIT.split(input_text):
+        if not clause or not clause.strip():
+            continue
+        overlap = len(food_stems & _stems(clause))
+        if overlap > best_overlap:
+            best, best_overlap = clause, overlap
+    return normalize_phrase(best if best is not None else input_text)
+
+
+def serving_ids(result):
+    servings = result.get('servings', {}).get('serving', [])
+    if isinstance(servings, dict):
+        servings = [servings]
+    return sorted(str(serving.get('serving_id')) for serving in servings)
+
+
+def food_cache_input(input_data, food_item):
+    """Cache identity of one food: its candidates and serving sets, the phrase quantifying it and the locale"""
+    results = food_item.get('results', [])
+    food_name = " ".join(result.get('food_name', '') for result in results)
+    return {
+        "candidates": [[str(result.get('food_id')), serving_ids(result)] for result in results],
+        "phrase": quantity_phrase(input_data.get("input", ""), food_name),
+        "language": input_data.get("language"),
+        "region": input_data.get("region"),
+        "include_servings": input_data.get("include_servings"),
+    }
+
+
+def parse_ingredients(response_text, model=None):
+    """Ingredient objects from a step 3 reply, or [] when it holds no recoverable JSON"""
+    data = try_extract_json(response_text, model)
+    ingredients = data.get("ingredients", []) if data else []
+    return ingredients if isinstance(ingredients, list) else []
+
+
+def merge_ingredients(response_texts, model=None):
+    """Assemble one row's ingredient list from per-food replies, cached or fresh"""
+    return [ingredient for text in response_texts for ingredient in parse_ingredients(text, model)]
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from rate_limiter import limiter as shared_limiter
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of values (q in 0-100), None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Hedger:
+    """Sends a duplicate request when the first one is slower than a percentile of recent latencies.
+
+    Both requests go through the limiter. Latencies and the hedge delay are
+    measured from when the primary's call starts, not from when it was queued,
+    so they match limiter.timed_call(); no hedge is sent while the hedge target
+    has no free capacity. The first successful response wins. A losing request
+    that has not started is cancelled; one already in flight cannot be aborted,
+    so its cost, cost_of(result, target) for the target that served it, is
+    added to extra_cost when it finishes.
+    """
+
+    def __init__(self, percentile=95, window=200, min_samples=10, initial_delay=5.0, max_workers=20, limiter=None):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.limiter = limiter or shared_limiter
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+        self.extra_cost = 0.0
+
+    def delay(self, key):
+        with self._lock:
+            latencies = list(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return self.initial_delay
+        return percentile(latencies, self.percentile)
+
+    def _record(self, key, latency):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(latency)
+
+    def _add_extra_cost(self, future, target, cost_of):
+        if future.cancelled() or future.exception() is not None or cost_of is None:
+            return
+        cost = cost_of(future.result(), target) or 0
+        with self._lock:
+            self.extra_cost += cost
+
+    def _run(self, target, fn, timing, retries):
+        def attempt():
+            # Reset on every retry, like limiter.timed_call()
+            timing["start"] = time.time()
+            timing["started"].set()
+            return fn()
+        result = self.limiter.call(*target, attempt, retries)
+        timing["end"] = time.time()
+        return result
+
+    def call(self, target, primary, hedge=None, hedge_target=None, cost_of=None, retries=4):
+        """Run primary() for target (model_id, region) through the limiter, hedging
+        with hedge() (or primary again) on hedge_target after the delay for the model.
+
+        Returns (result, elapsed seconds, hedged, winner) where winner is
+        "primary" or "hedge".
+        """
+        hedge = hedge or primary
+        hedge_target = hedge_target or target
+        key = target[0]
+        with self._lock:
+            self.calls += 1
+
+        timing = {"started": threading.Event()}
+        first = self.executor.submit(self._run, target, primary, timing, retries)
+        # The hedge clock starts once the primary is past the limiter queue
+        while not timing["started"].wait(0.05) and not first.done():
+            pass
+        start_time = timing.get("start", time.time())
+        done, _ = wait([first], timeout=max(0.0, self.delay(key) - (time.time() - start_time)))
+        if not done and not self.limiter.has_capacity(*hedge_target):
+            # Hedging now would only add load to a saturated model/region
+            with self._lock:
+                self.hedges_skipped += 1
+            done, _ = wait([first])
+        if done:
+            result = first.result()
+            elapsed = timing["end"] - timing["start"]
+            self._record(key, elapsed)
+            return result, elapsed, False, "primary"
+
+        with self._lock:
+            self.hedges += 1
+        second = self.executor.submit(self._run, hedge_target, hedge, {"started": threading.Event()}, retries)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                elapsed = time.time() - timing["start"]
+                self._record(key, elapsed)
+                winner = "hedge" if future is second else "primary"
+                for loser in (pending | done) - {future}:
+                    if not loser.cancel():
+                        loser_target = target if loser is first else hedge_target
+                        loser.add_done_callback(lambda f, t=loser_target: self._add_extra_cost(f, t, cost_of))
+                if winner == "hedge":
+                    with self._lock:
+                        self.hedge_wins += 1
+                return future.result(), elapsed, True, winner
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.calls if self.calls else 0,
+                "hedges_skipped": self.hedges_skipped,
+                "hedge_wins": self.hedge_wins,
+                "extra_cost": self.extra_cost,
+                "delays": {key: percentile(list(values), self.percentile) for key, values in self._latencies.items()},
+            }
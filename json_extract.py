@@ -0,0 +1,212 @@
+import json
+import re
+import threading
+
+# One JSON extractor for every runner's model replies. The fast path decodes the
+# first object with raw_decode, which skips a leading code fence or the " Here is
+# the JSON response: ```json" prefill and ignores whatever follows the object
+# (closing fence, trailing prose). Only when that fails is the reply repaired in
+# a single scan:
+#
+#   trailing_comma       {"a": 1,} / [1, 2,]
+#   missing_comma        }{ or ][ between array elements
+#   python_literal       True / False / None
+#   control_character    raw newlines/tabs inside strings
+#   mismatched_bracket   a ] closing an object or } closing an array
+#   truncated            reply cut off at maxTokens: the unfinished element is
+#                        dropped and the open brackets are closed, so a step 3
+#                        reply keeps every ingredient that was written in full.
+#                        A reply cut off before any complete value (e.g. inside
+#                        the first ingredient) fails rather than passing as {}
+#                        or {"ingredients": []}
+#
+# Outcomes (parsed / repaired / failed) and repair kinds are counted per model in
+# parse_stats, so failure and repair rates show up next to the limiter stats.
+# Only calls that pass a model are counted; re-parsing a cached reply passes
+# none, so it is not counted twice.
+
+_decoder = json.JSONDecoder()
+_WORD = re.compile(r'[A-Za-z_]+')
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {'{': '}', '[': ']'}
+MAX_STARTS = 3
+MAX_CUTS = 200
+
+
+class ParseStats:
+    """Per-model counts of clean parses, repairs (by kind) and failures. Safe to share between threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, status, repairs=()):
+        if model is None:
+            return
+        with self._lock:
+            entry = self._models.setdefault(model, {"parsed": 0, "repaired": 0, "failed": 0, "repairs": {}})
+            entry[status] += 1
+            for repair in repairs:
+                entry["repairs"][repair] = entry["repairs"].get(repair, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for model, entry in self._models.items():
+                replies = entry["parsed"] + entry["repaired"] + entry["failed"]
+                out[model] = dict(entry, repairs=dict(entry["repairs"]), replies=replies,
+                                  repair_rate=entry["repaired"] / replies if replies else 0,
+                                  failure_rate=entry["failed"] / replies if replies else 0)
+            return out
+
+
+parse_stats = ParseStats()
+
+
+def _has_value(value):
+    """Whether value holds at least one scalar, i.e. is more than empty containers"""
+    if isinstance(value, dict):
+        return any(_has_value(child) for child in value.values())
+    if isinstance(value, list):
+        return any(_has_value(child) for child in value)
+    return True
+
+
+def _starts(text):
+    starts, index = [], text.find('{')
+    while index != -1 and len(starts) < MAX_STARTS:
+        starts.append(index)
+        index = text.find('{', index + 1)
+    return starts
+
+
+def _drop_trailing_comma(out):
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ',':
+        del out[j]
+        return True
+    return False
+
+
+def _scan(text):
+    """(repaired text or None, repairs, cut points) for the object starting at text[0]"""
+    out, stack, repairs, cuts = [], [], set(), []
+    in_string = escape = False
+    last = ''
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+                last = '"'
+            elif ch in '\n\r\t':
+                ch = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}[ch]
+                repairs.add("control_character")
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch in '{["' and last and (last in '}]' or (last == '"' and ch == '"' and stack[-1:] == ['['])):
+            out.append(',')
+            repairs.add("missing_comma")
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            stack.append(ch)
+            out.append(ch)
+            last = ch
+            cuts.append((len(out), list(stack)))
+        elif ch in '}]':
+            if _drop_trailing_comma(out):
+                repairs.add("trailing_comma")
+            if ch != CLOSERS[stack[-1]]:
+                ch = CLOSERS[stack[-1]]
+                repairs.add("mismatched_bracket")
+            stack.pop()
+            out.append(ch)
+            last = ch
+            if not stack:
+                return ''.join(out), repairs, cuts
+            cuts.append((len(out), list(stack)))
+        elif ch == ',':
+            cuts.append((len(out), list(stack)))
+            out.append(ch)
+            last = ch
+        elif ch.isascii() and (ch.isalpha() or ch == '_'):
+            word = _WORD.match(text, i).group(0)
+            if word in LITERALS:
+                word = LITERALS[word]
+                repairs.add("python_literal")
+            out.append(word)
+            last = 'a'
+            i += len(word) - 1
+        else:
+            out.append(ch)
+            if not ch.isspace():
+                last = ch
+        i += 1
+
+    # Ran out of text with brackets open: cut back to the end of a complete
+    # element, preferring element boundaries in arrays and at the top level
+    repairs.add("truncated")
+    preferred = [cut for cut in cuts if cut[1][-1] == '[' or len(cut[1]) == 1]
+    candidates = (preferred[::-1] + [cut for cut in cuts[::-1] if cut not in preferred])[:MAX_CUTS]
+    for position, open_brackets in candidates:
+        head = out[:position]
+        _drop_trailing_comma(head)
+        candidate = ''.join(head).rstrip()
+        if candidate.endswith(':'):
+            continue
+        candidate += ''.join(CLOSERS[bracket] for bracket in reversed(open_brackets))
+        try:
+            json.loads(candidate)
+        except ValueError:
+            continue
+        return candidate, repairs, cuts
+    return None, repairs, cuts
+
+
+def extract_json(text, model=None):
+    """The first JSON object in a model reply, repairing common defects; raises ValueError if none can be recovered"""
+    # Later starts are only tried when the reply cannot be read from an earlier
+    # one, i.e. the earlier brace was prose rather than a truncated outer object
+    for start in _starts(text or ""):
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, dict):
+                parse_stats.record(model, "parsed")
+                return value
+            continue
+        repaired, repairs, _ = _scan(text[start:])
+        if repaired is None:
+            continue
+        try:
+            value = json.loads(repaired)
+        except ValueError:
+            continue
+        if "truncated" in repairs and not _has_value(value):
+            break
+        parse_stats.record(model, "repaired", sorted(repairs))
+        return value
+
+    parse_stats.record(model, "failed")
+    raise ValueError(f"No JSON object in reply: {(text or '')[:200]}")
+
+
+def try_extract_json(text, model=None):
+    """extract_json(), or None when the reply holds no recoverable object"""
+    try:
+        return extract_json(text, model)
+    except ValueError:
+        return None
@@ -0,0 +1,470 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import bedrock_client
+from bedrock_client import get_client
+from cascade import MIN_ACCURACY, Cascade, format_report
+from compaction import compact, restore_response
+from hedging import percentile
+from json_extract import extract_json, parse_stats
+from prompt_cache import cache_stats, cache_usage, prompt_content
+from rate_limiter import limiter
+from response_cache import ResponseCache, prompt_hash
+from results_store import ResultsStore
+from serving_rules import merge_into, row_response, split_foods
+from token_estimator import TokenEstimator, combine_results, load_calibration, pricing_from_csvs
+from unit_conversion import expand_response
+
+# Unified step 3 experiment runner. One engine builds requests, calls the model,
+# restores the response and records cost, tokens, cache use and pre-flight
+# estimates; strategies only decide how the calls are scheduled:
+#
+#   sequential   one request per row, one row at a time
+#   threads      one request per row, rows on a thread pool
+#   asyncio      one request per row, rows as coroutines over AsyncBedrockClient
+#   per_food     one request per food, foods on a thread pool, merged per row
+#   cycle        per_food, with foods assigned to the given models in turn
+#   cascade      per_food, each food sent to the models in the given order
+#                (cheapest first) until a reply passes the cascade checks
+#
+# Variants pick the prompt and how the input is compacted and the reply restored
+# (old, new, ultra, minimal). All paths are relative to --root.
+#
+#   python match_sizes.py --strategy threads --variant new
+#   python match_sizes.py --strategy per_food --variant old --models data/models/step3_2.csv
+#   python match_sizes.py --strategy cycle --models us.meta.llama4-maverick-17b-instruct-v1:0,us.amazon.nova-lite-v1:0
+#   python match_sizes.py --strategy threads --results-store outputs3/results.sqlite
+#   python match_sizes.py --strategy cascade --models openai.gpt-oss-20b-1:0,us.meta.llama4-maverick-17b-instruct-v1:0
+
+METADATA_KEYS = ['input', 'language', 'language_description', 'region', 'region_description', 'include_servings']
+
+VARIANTS = {
+    "old": {"prompt": "prompts/prompt3_old.txt"},
+    "new": {"prompt": "prompts/prompt3_new.txt"},
+    "ultra": {"prompt": "prompts/prompt3_ultra.txt"},
+    "minimal": {"prompt": "prompts/prompt3_minimal.txt", "max_tokens": 1024},
+}
+
+STRATEGIES = ["sequential", "threads", "asyncio", "per_food", "cycle", "cascade"]
+
+
+def load_rows(path, limit=None):
+    df = pd.read_csv(path, usecols=['Prompt 3 - match sizes Input'], nrows=limit)
+    return [json.loads(value) for value in df['Prompt 3 - match sizes Input']]
+
+
+def load_models(spec, region, pricing):
+    """[{model, region, input_price, output_price}] from a model CSV or a comma-separated list of ids"""
+    if spec.endswith('.csv'):
+        models_df = pd.read_csv(spec)
+        models_df = models_df[models_df['model'].notna()]
+        return [{
+            "model": row['model'].strip(),
+            "region": str(row['region']).strip(),
+            "input_price": float(str(row['input price']).replace('$', '')),
+            "output_price": float(str(row['output price']).replace('$', '')),
+        } for _, row in models_df.iterrows()]
+    models = []
+    for model in spec.split(','):
+        input_price, output_price = pricing.get(model.replace("(latency_optimized)", "").strip(), (0.0, 0.0))
+        models.append({"model": model.strip(), "region": region, "input_price": input_price, "output_price": output_price})
+    return models
+
+
+def single_food_input(input_data, food_item):
+    return dict({k: input_data[k] for k in METADATA_KEYS if k in input_data}, foods=[food_item])
+
+
+def reply_text(response):
+    """First text block of the reply (reasoning models put a reasoning block first)"""
+    content = response["output"]["message"]["content"]
+    return next((block["text"] for block in content if "text" in block), "")
+
+
+def parse_reply(text, model=None):
+    return extract_json(text, model)
+
+
+class Engine:
+    """Builds, sends and post-processes step 3 requests for one variant"""
+
+    def __init__(self, variant, root=".", use_response_cache=False, use_serving_rules=False,
+                 use_prompt_cache=False, max_input_tokens=None, max_workers=10, results_store=None):
+        with open(os.path.join(root, VARIANTS[variant]["prompt"]), 'r', encoding='utf-8') as f:
+            self.system_prompt = f.read().strip().strip('"')
+        self.variant = variant
+        self.max_tokens = VARIANTS[variant].get("max_tokens", 2048)
+        self.use_response_cache = use_response_cache
+        self.use_serving_rules = use_serving_rules
+        self.use_prompt_cache = use_prompt_cache
+        self.max_input_tokens = max_input_tokens
+        self.max_workers = max_workers
+        # Requests are recorded under run_id as each row finishes
+        self.results_store = results_store
+        self.run_id = None
+        self.response_cache = ResponseCache(os.path.join(root, 'cache/llm_responses.sqlite')) if use_response_cache else None
+        self.prompt_version = prompt_hash(self.system_prompt)
+        self.estimator = TokenEstimator(load_calibration(os.path.join(root, 'data/models/token_calibration.json')),
+                                        pricing_from_csvs(os.path.join(root, 'data/models/*.csv')))
+
+    def render(self, input_data, model_id=None):
+        """(user message, restore state) for the variant"""
+        if self.variant == "ultra":
+            return compact(input_data, step=3, model_id=model_id, calibration=self.estimator.calibration)
+        if self.variant == "old":
+            return json.dumps(input_data, indent=2), None
+        return json.dumps({'input': input_data['input'], 'foods': input_data['foods']}, indent=2), None
+
+    def restore(self, response_json, input_data, state):
+        if self.variant == "ultra":
+            return restore_response(response_json, state)
+        if self.variant == "minimal":
+            return expand_response(response_json, input_data)
+        if self.variant == "new":
+            response_json.update({k: input_data[k] for k in METADATA_KEYS if k in input_data})
+        return response_json
+
+    def chunks(self, input_data, model):
+        """input_data split so every chunk's prompt and expected output fit"""
+        if not self.max_input_tokens:
+            return [input_data]
+        return self.estimator.split_foods(
+            input_data, model["model"],
+            render=lambda chunk: self.system_prompt.replace("{{foods}}", self.render(chunk, model["model"])[0]),
+            max_input_tokens=self.max_input_tokens, max_output_tokens=self.max_tokens
+        )
+
+    def prepare(self, input_data, model):
+        """A finished result (cache hit, all foods rule-matched) or the call context for input_data"""
+        model_id = model["model"].replace("(latency_optimized)", "").strip()
+        context = {"model": model, "model_id": model_id, "full_input": input_data, "rule_ingredients": [], "cache_key": None}
+        if self.use_response_cache:
+            start_time = time.time()
+            # Full model name, so latency-optimized runs never read the standard runs' replies
+            context["cache_key"] = self.response_cache.key(model["model"].strip(), self.prompt_version, input_data, namespace=self.variant)
+            cached = self.response_cache.get(context["cache_key"])
+            if cached is not None:
+                return dict(cached, invocation_time=time.time() - start_time, cost=0.0, response_cache_hit=True), None
+        if self.use_serving_rules:
+            context["rule_ingredients"], remaining = split_foods(input_data)
+            if not remaining:
+                return self.result(model, row_response(input_data, context["rule_ingredients"]), 0.0,
+                                   rule_matched=len(context["rule_ingredients"])), None
+            input_data = dict(input_data, foods=remaining)
+
+        user_message, context["state"] = self.render(input_data, model_id)
+        request = dict(
+            modelId=model_id,
+            messages=[{"role": "user", "content": prompt_content(self.system_prompt, user_message, self.use_prompt_cache)}],
+            inferenceConfig={"maxTokens": self.max_tokens, "temperature": 0.1, "topP": 0.9}
+        )
+        if "(latency_optimized)" in model["model"]:
+            request["performanceConfig"] = {"latency": "optimized"}
+        context["estimate"] = self.estimator.estimate(model_id, request, foods=len(input_data['foods']))
+        if not context["estimate"]["fits"]:
+            return self.result(model, f"ERROR: Request of ~{context['estimate']['input_tokens']} input tokens exceeds the model's input limit",
+                               None, estimate=context["estimate"]), None
+        context["request"] = request
+        context["input_data"] = input_data
+        return None, context
+
+    def complete(self, context, response, invocation_time):
+        model = context["model"]
+        usage = response["usage"]
+        cached = cache_usage(response)
+        prompt_tokens = usage["inputTokens"] + cached["cache_read_tokens"] + cached["cache_write_tokens"]
+        response_json = self.restore(parse_reply(reply_text(response), context["model_id"]), context["input_data"], context["state"])
+        merge_into(response_json, context["full_input"], context["rule_ingredients"])
+        result = self.result(
+            model, response_json, invocation_time,
+            cost=(prompt_tokens * model["input_price"] + usage["outputTokens"] * model["output_price"]) / 1000,
+            input_tokens=usage["inputTokens"], output_tokens=usage["outputTokens"], estimate=context["estimate"],
+            rule_matched=len(context["rule_ingredients"]), **cached
+        )
+        if context["cache_key"]:
+            self.response_cache.put(context["cache_key"], result)
+        return result
+
+    def result(self, model, actual, invocation_time, cost=None, input_tokens=None, output_tokens=None,
+               cache_read_tokens=None, cache_write_tokens=None, estimate=None, rule_matched=0):
+        if invocation_time == 0.0:
+            cost, input_tokens, output_tokens = 0.0, 0, 0
+        return {
+            "model": model["model"],
+            "region": model["region"],
+            "actual": actual,
+            "invocation_time": invocation_time,
+            "cost": cost,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cache_read_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "estimate": estimate,
+            "response_cache_hit": False,
+            "rule_matched": rule_matched,
+        }
+
+    def invoke(self, input_data, model):
+        finished, context = self.prepare(input_data, model)
+        if finished is not None:
+            return finished
+        try:
+            client = get_client(model["region"], max_pool_connections=self.max_workers, max_attempts=1)
+            response, invocation_time = limiter.timed_call(
+                context["model_id"], model["region"], lambda: client.converse(**context["request"]))
+            return self.complete(context, response, invocation_time)
+        except Exception as e:
+            return self.result(model, f"ERROR: {str(e)}", None, estimate=context["estimate"])
+
+    async def ainvoke(self, input_data, model, clients):
+        finished, context = self.prepare(input_data, model)
+        if finished is not None:
+            return finished
+        try:
+            client = clients[model["region"]]
+            response, invocation_time = await limiter.atimed_call(
+                context["model_id"], model["region"], lambda: client.converse(**context["request"]))
+            return self.complete(context, response, invocation_time)
+        except Exception as e:
+            return self.result(model, f"ERROR: {str(e)}", None, estimate=context["estimate"])
+
+    def finish_row(self, row_idx, input_data, results, total_time, inputs=None):
+        """row_summary() of a finished row, recording each request in the results store with
+        its own input (inputs[i] was sent for results[i]; defaults to the whole row)"""
+        if self.results_store:
+            inputs = inputs or [input_data]
+            if len(inputs) != len(results):
+                raise ValueError(f"{len(results)} results for {len(inputs)} request inputs")
+            for request_input, result in zip(inputs, results):
+                self.results_store.record(self.run_id, 3, result, row_index=row_idx, food=result.get("food_query"),
+                                          input_data=request_input)
+        return row_summary(row_idx, input_data, results, total_time)
+
+    def invoke_row(self, input_data, model):
+        """One row as one request, or as concurrent chunks when it is over max_input_tokens"""
+        chunks = self.chunks(input_data, model)
+        if len(chunks) == 1:
+            return self.invoke(input_data, model)
+        with ThreadPoolExecutor(max_workers=len(chunks)) as chunk_executor:
+            return combine_results(list(chunk_executor.map(lambda chunk: self.invoke(chunk, model), chunks)))
+
+
+def row_summary(row_idx, input_data, results, total_time):
+    """Row output shared by every strategy; results holds one entry per request of the row"""
+    errors = [r["actual"] for r in results if not isinstance(r["actual"], dict)]
+    if len(results) == 1:
+        ingredients = results[0]["actual"]
+    else:
+        ingredients = row_response(input_data, [i for r in results if isinstance(r["actual"], dict)
+                                                for i in r["actual"].get("ingredients", []) or []])
+
+    def total(key):
+        values = [r.get(key) for r in results if r.get(key) is not None]
+        return sum(values) if values else None
+
+    return {
+        "row_index": row_idx,
+        "food_count": len(input_data['foods']),
+        "model_calls": sum(r.get("chunks", 1) for r in results if r.get("input_tokens")),
+        "total_time": total_time,
+        "ingredients": ingredients,
+        "errors": errors,
+        "cost": total("cost"),
+        "input_tokens": total("input_tokens"),
+        "output_tokens": total("output_tokens"),
+        "cache_read_tokens": total("cache_read_tokens"),
+        "cache_write_tokens": total("cache_write_tokens"),
+        "estimated_cost": sum(r["estimate"]["cost"] for r in results if r.get("estimate")),
+        "response_cache_hits": sum(1 for r in results if r.get("response_cache_hit")),
+        "rule_matched": sum(r.get("rule_matched", 0) for r in results),
+        "individual_results": results if len(results) > 1 else None,
+    }
+
+
+def timed(fn):
+    start_time = time.time()
+    result = fn()
+    return result, time.time() - start_time
+
+
+def run_sequential(engine, rows, models):
+    summaries = []
+    for row_idx, row in enumerate(rows):
+        result, row_time = timed(lambda: engine.invoke_row(row, models[0]))
+        summaries.append(engine.finish_row(row_idx, row, [result], row_time))
+    return summaries
+
+
+def run_threads(engine, rows, models):
+    def run_row(row_idx, row):
+        result, row_time = timed(lambda: engine.invoke_row(row, models[0]))
+        return engine.finish_row(row_idx, row, [result], row_time)
+
+    with ThreadPoolExecutor(max_workers=engine.max_workers) as executor:
+        return list(executor.map(run_row, range(len(rows)), rows))
+
+
+def run_asyncio(engine, rows, models):
+    from async_bedrock import AsyncBedrockClient
+
+    async def main():
+        clients = {model["region"]: AsyncBedrockClient(model["region"], endpoint_url=bedrock_client.ENDPOINT_URL,
+                                                        max_connections=engine.max_workers) for model in models}
+        try:
+            async def row_task(row_idx, row):
+                start_time = time.time()
+                chunks = engine.chunks(row, models[0])
+                results = await asyncio.gather(*[engine.ainvoke(chunk, models[0], clients) for chunk in chunks])
+                return engine.finish_row(row_idx, row, results, time.time() - start_time, inputs=chunks)
+            return await asyncio.gather(*[row_task(row_idx, row) for row_idx, row in enumerate(rows)])
+        finally:
+            for client in clients.values():
+                await client.close()
+
+    return asyncio.run(main())
+
+
+def run_per_food(engine, rows, models, cycle=False):
+    assign = itertools.cycle(models) if cycle else itertools.repeat(models[0])
+    summaries = []
+    with ThreadPoolExecutor(max_workers=engine.max_workers) as executor:
+        for row_idx, row in enumerate(rows):
+            start_time = time.time()
+            inputs = [single_food_input(row, food_item) for food_item in row['foods']]
+            futures = [executor.submit(engine.invoke, food_input, next(assign)) for food_input in inputs]
+            results = [dict(future.result(), food_query=food_item['query']) for food_item, future in zip(row['foods'], futures)]
+            summaries.append(engine.finish_row(row_idx, row, results, time.time() - start_time, inputs=inputs))
+    return summaries
+
+
+def run_cycle(engine, rows, models):
+    return run_per_food(engine, rows, models, cycle=True)
+
+
+def run_cascade(engine, rows, models, cascade=None):
+    cascade = cascade or Cascade(engine, models)
+    summaries = []
+    with ThreadPoolExecutor(max_workers=engine.max_workers) as executor:
+        for row_idx, row in enumerate(rows):
+            start_time = time.time()
+            inputs = [single_food_input(row, food_item) for food_item in row['foods']]
+            futures = [executor.submit(cascade.invoke, food_input) for food_input in inputs]
+            results = [dict(future.result(), food_query=food_item['query']) for food_item, future in zip(row['foods'], futures)]
+            summaries.append(engine.finish_row(row_idx, row, results, time.time() - start_time, inputs=inputs))
+    return summaries
+
+
+RUNNERS = {
+    "sequential": run_sequential,
+    "threads": run_threads,
+    "asyncio": run_asyncio,
+    "per_food": run_per_food,
+    "cycle": run_cycle,
+    "cascade": run_cascade,
+}
+
+
+def summarize(rows):
+    latencies = [row["total_time"] for row in rows if not row["errors"]]
+    return {
+        "rows": len(rows),
+        "errors": sum(1 for row in rows if row["errors"]),
+        "model_calls": sum(row["model_calls"] for row in rows),
+        "latency_p50": percentile(latencies, 50) if latencies else None,
+        "latency_p99": percentile(latencies, 99) if latencies else None,
+        "cost": sum(row["cost"] or 0 for row in rows),
+        "estimated_cost": sum(row["estimated_cost"] for row in rows),
+        "input_tokens": sum(row["input_tokens"] or 0 for row in rows),
+        "output_tokens": sum(row["output_tokens"] or 0 for row in rows),
+        "cache_read_tokens": sum(row["cache_read_tokens"] or 0 for row in rows),
+        "response_cache_hits": sum(row["response_cache_hits"] for row in rows),
+        "rule_matched": sum(row["rule_matched"] for row in rows),
+    }
+
+
+def prompt_cache_stats(rows):
+    """cache_stats() over the model calls of rows; a single-request row is one call timed by its total_time"""
+    results = [r for row in rows for r in row["individual_results"] or
+               [dict(row, invocation_time=row["total_time"], response_cache_hit=bool(row["response_cache_hits"]))]]
+    return cache_stats([r for r in results if not r.get("response_cache_hit")])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a step 3 size matching experiment")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="threads")
+    parser.add_argument("--variant", choices=sorted(VARIANTS), default="new")
+    parser.add_argument("--models", default="us.meta.llama4-maverick-17b-instruct-v1:0",
+                        help="model CSV (data/models/step3*.csv) or comma-separated model ids")
+    parser.add_argument("--region", default="us-west-2", help="region for model ids given on the command line")
+    parser.add_argument("--root", default=".", help="directory holding prompts/, data/ and outputs3/")
+    parser.add_argument("--data", default="data/test_data_clean.csv")
+    parser.add_argument("--rows", type=int, default=None, help="only run the first N rows")
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--max-input-tokens", type=int, default=None, help="split rows whose prompt is estimated above this")
+    parser.add_argument("--response-cache", action="store_true")
+    parser.add_argument("--serving-rules", action="store_true")
+    parser.add_argument("--prompt-cache", action="store_true")
+    parser.add_argument("--min-accuracy", type=int, default=MIN_ACCURACY,
+                        help="cascade: lowest match_accuracy accepted before escalating to the next model")
+    parser.add_argument("--results-store", default=None,
+                        help="record every request in this results store; no JSON is written unless --output is given")
+    parser.add_argument("--output", default=None, help="defaults to outputs3/match_sizes/<strategy>_<variant>.json")
+    args = parser.parse_args(argv)
+
+    results_store = ResultsStore(os.path.join(args.root, args.results_store)) if args.results_store else None
+
+    engine = Engine(args.variant, root=args.root, use_response_cache=args.response_cache,
+                    use_serving_rules=args.serving_rules, use_prompt_cache=args.prompt_cache,
+                    max_input_tokens=args.max_input_tokens, max_workers=args.workers, results_store=results_store)
+    models_spec = os.path.join(args.root, args.models) if args.models.endswith('.csv') else args.models
+    models = load_models(models_spec, args.region, engine.estimator.pricing)
+    rows = load_rows(os.path.join(args.root, args.data), args.rows)
+
+    # cycle and cascade spread one run over all models; the other strategies run once per model
+    cascade = Cascade(engine, models, min_accuracy=args.min_accuracy) if args.strategy == "cascade" else None
+    runner = functools.partial(run_cascade, cascade=cascade) if cascade else RUNNERS[args.strategy]
+    runs = []
+    for run_models in ([models] if args.strategy in ("cycle", "cascade") else [[model] for model in models]):
+        print(f"Running {args.strategy}/{args.variant} on {', '.join(m['model'] for m in run_models)}")
+        if results_store:
+            engine.run_id = results_store.start_run(f"match_sizes/{args.strategy}/{args.variant}/{','.join(m['model'] for m in run_models)}",
+                                                    config=vars(args))
+        start_time = time.time()
+        row_results = runner(engine, rows, run_models)
+        summary = dict(summarize(row_results), total_time=time.time() - start_time)
+        if cascade:
+            summary["cascade"] = cascade.stats(rows=len(rows))
+        if args.prompt_cache:
+            summary["prompt_cache"] = prompt_cache_stats(row_results)
+        runs.append({"models": [m["model"] for m in run_models], "summary": summary, "rows": row_results})
+        print(f"  {summary['rows']} rows in {summary['total_time']:.2f}s, p50 {summary['latency_p50'] or 0:.2f}s, "
+              f"p99 {summary['latency_p99'] or 0:.2f}s, cost ${summary['cost']:.6f}, {summary['errors']} errors")
+        if cascade:
+            print(format_report(summary["cascade"]))
+        if args.prompt_cache:
+            print(f"  Prompt cache: {summary['prompt_cache']}")
+
+    if results_store:
+        print(f"Requests recorded in {results_store.path}")
+    if args.output or not results_store:
+        output = args.output or os.path.join(args.root, 'outputs3/match_sizes', f"{args.strategy}_{args.variant}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump({"config": vars(args), "runs": runs}, f, indent=2, ensure_ascii=False)
+        print(f"Results saved to {output}")
+    print(f"Limiter: {limiter.stats()}")
+    print(f"JSON parsing: {parse_stats.stats()}")
+    if engine.response_cache:
+        print(f"Response cache: {engine.response_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
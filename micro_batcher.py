@@ -0,0 +1,83 @@
+import json
+
+# Token-budget micro-batching for step 3. The foods of all rows are packed, in
+# order, into requests whose estimated prompt stays under token_budget, whose
+# expected output fits in maxTokens and whose estimated latency stays under
+# latency_target. A request holding foods of several rows sends them grouped
+# per row under "rows", so every food is still matched against its own input,
+# and the ingredients are split back to their rows by food_id.
+#
+# token_budget ~ one food per request  -> per-food fan-out
+# token_budget ~ whole row             -> row batching
+# anything in between trades system prompt repeats against request latency.
+
+BATCH_NOTE = ('Several meals are batched below under "rows". Match every food against the "input" of its own row '
+              'and return the ingredients of all rows in one "ingredients" list.\n')
+
+
+def food_items(rows):
+    """(row_idx, food_idx) for every food of every row, in order"""
+    return [(row_idx, food_idx) for row_idx, row in enumerate(rows) for food_idx in range(len(row.get('foods', [])))]
+
+
+def candidate_ids(food):
+    return {str(result.get('food_id')) for result in food.get('results', [])}
+
+
+def batch_payload(rows, batch):
+    """Model input for a batch: the usual {input, foods} for one row, {"rows": [...]} for several"""
+    grouped = {}
+    for row_idx, food_idx in batch:
+        grouped.setdefault(row_idx, []).append(rows[row_idx]['foods'][food_idx])
+    payload = [{'input': rows[row_idx]['input'], 'foods': foods} for row_idx, foods in grouped.items()]
+    return payload[0] if len(payload) == 1 else {'rows': payload}
+
+
+def render_payload(payload):
+    user_message = json.dumps(payload, indent=2)
+    return BATCH_NOTE + user_message if 'rows' in payload else user_message
+
+
+def plan_batches(rows, estimator, model_id, render, token_budget, latency_target=None, max_output_tokens=2048):
+    """Pack the foods of all rows into batches of (row_idx, food_idx).
+
+    render(user_message) must return the full prompt text. A batch is closed when
+    the next food would push it over token_budget, the expected output over
+    max_output_tokens or the estimated latency over latency_target, or when the
+    food shares a candidate food_id with another row already in the batch (its
+    ingredient could not be told apart when splitting the response).
+    """
+    per_request = estimator.foods_per_request(model_id, max_output_tokens)
+    batches, current, owners = [], [], {}
+    for row_idx, food_idx in food_items(rows):
+        ids = candidate_ids(rows[row_idx]['foods'][food_idx])
+        candidate = current + [(row_idx, food_idx)]
+        estimate = estimator.estimate(model_id, text=render(render_payload(batch_payload(rows, candidate))), foods=len(candidate))
+        ambiguous = any(owners.get(food_id, row_idx) != row_idx for food_id in ids)
+        too_big = estimate["input_tokens"] > token_budget or len(candidate) > per_request
+        too_slow = latency_target is not None and estimate["latency"] > latency_target
+        if current and (ambiguous or too_big or too_slow):
+            batches.append(current)
+            current, owners = [(row_idx, food_idx)], {}
+        else:
+            current = candidate
+        owners.update({food_id: row_idx for food_id in ids})
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_response(response_json, rows, batch):
+    """({row_idx: [ingredients]}, [ingredients whose food_id no food of the batch offered])"""
+    owners = {}
+    for row_idx, food_idx in batch:
+        for food_id in candidate_ids(rows[row_idx]['foods'][food_idx]):
+            owners.setdefault(food_id, row_idx)
+    by_row, unassigned = {row_idx: [] for row_idx, _ in batch}, []
+    for ingredient in (response_json or {}).get('ingredients', []) or []:
+        row_idx = owners.get(str(ingredient.get('food_id')))
+        if row_idx is None:
+            unassigned.append(ingredient)
+        else:
+            by_row[row_idx].append(ingredient)
+    return by_row, unassigned
@@ -1,8 +1,8 @@
-import boto3
+from bedrock_client import get_client
 
 def call_nova_pro(prompt, region='us-east-2'):
     """Call Amazon Nova Pro using converse API with latency optimization"""
-    client = boto3.client('bedrock-runtime', region_name=region)
+    client = get_client(region)
     
     response = client.converse(
         modelId='us.amazon.nova-pro-v1:0:latency-optimized',
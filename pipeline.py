@@ -0,0 +1,197 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from bedrock_client import get_client
+from food_cache import normalize_phrase, parse_ingredients
+from hedging import percentile
+from json_extract import parse_stats, try_extract_json
+from prompt_cache import prompt_content
+from rate_limiter import limiter
+from streaming import converse_streaming
+
+# Streaming end-to-end pipeline. Step 1 is streamed and every food name is handed
+# on as soon as its string closes in the "foods" array. Each food is then
+# searched, matched on its own by step 2, looked up and sized on its own by step
+# 3, all on a shared worker pool, so step 3 of the first food can finish before
+# step 1 has written the last one.
+#
+# search(query, request) -> step 2 candidates [{food_id, food_name, brand_name, food_type}]
+# get_food(food_id, request) -> step 3 candidate {food_id, food_name, ..., servings}
+#
+# Both default to lookups in the recorded step 2/3 inputs of the test data; plug
+# in the real food database calls in production.
+#
+#   python pipeline.py   # runs every test row, writes outputs3/pipeline.json
+
+STEP1_PREFILL = {"role": "assistant", "content": [{"text": " Here is the JSON response: ```json"}]}
+
+
+def recorded_search(test_data_path='data/test_data_clean.csv'):
+    """search() serving the step 2 candidates recorded in the test data"""
+    df = pd.read_csv(test_data_path)
+    candidates = {}
+    for value in df['Prompt 2 - match foods Input']:
+        for food in json.loads(value).get('foods', []):
+            candidates.setdefault(normalize_phrase(str(food['query'])), food.get('results', []))
+    return lambda query, request: candidates.get(normalize_phrase(query), [])
+
+
+def recorded_get_food(test_data_path='data/test_data_clean.csv'):
+    """get_food() serving the step 3 candidates (with servings) recorded in the test data"""
+    df = pd.read_csv(test_data_path)
+    foods = {}
+    for value in df['Prompt 3 - match sizes Input']:
+        for food in json.loads(value).get('foods', []):
+            for result in food.get('results', []):
+                foods.setdefault(str(result['food_id']), result)
+    return lambda food_id, request: foods.get(str(food_id))
+
+
+def response_json(text, model=None):
+    return try_extract_json(text, model)
+
+
+class Pipeline:
+    """Runs steps 1 -> 2 -> 3 for one request, overlapping the steps per food"""
+
+    def __init__(self, prompts, models, search=None, get_food=None, max_workers=10,
+                 include_servings="defaultAndGrams", use_prompt_cache=False):
+        # prompts / models: {1: ..., 2: ..., 3: ...}; models are (model_id, region)
+        self.prompts = prompts
+        self.models = models
+        self.search = search or recorded_search()
+        self.get_food = get_food or recorded_get_food()
+        self.include_servings = include_servings
+        self.use_prompt_cache = use_prompt_cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def converse(self, step, messages, stream=False, on_item=None, stream_key="foods"):
+        model_id, region = self.models[step]
+        client = get_client(region, max_attempts=1)
+        request = dict(modelId=model_id, messages=messages,
+                       inferenceConfig={"maxTokens": 2048, "temperature": 0.1, "topP": 0.9})
+        return limiter.call(
+            model_id, region,
+            lambda: converse_streaming(client, on_ingredient=on_item, stream_key=stream_key, **request) if stream
+            else client.converse(**request)
+        )
+
+    def step2(self, request, query):
+        """(food_id step 2 picked for query, or None) from a single-food step 2 call"""
+        results = self.search(query, request)
+        if not results:
+            return None
+        input_data = {k: request[k] for k in ['language', 'region', 'language_description', 'region_description'] if k in request}
+        input_data = dict(input=request['chat_input'], **input_data, foods=[{"query": query, "results": results}])
+        response = self.converse(2, [
+            {"role": "user", "content": [{"text": self.prompts[2]}]},
+            {"role": "user", "content": [{"text": json.dumps(input_data, indent=2)}]},
+            STEP1_PREFILL,
+        ])
+        reply = response_json(response["output"]["message"]["content"][0]["text"], self.models[2][0]) or {}
+        # food_ids comes back as a list or a comma-separated string; only accept an id
+        # that was actually offered for this query
+        food_ids = reply.get('food_ids') or []
+        if isinstance(food_ids, str):
+            food_ids = food_ids.split(',')
+        offered = {str(result['food_id']) for result in results}
+        return next((str(food_id).strip() for food_id in food_ids if str(food_id).strip() in offered), None)
+
+    def step3(self, request, food_id):
+        """Ingredients step 3 returned for one food"""
+        result = self.get_food(food_id, request)
+        if result is None:
+            return []
+        input_data = {k: request[k] for k in ['language', 'region', 'language_description', 'region_description'] if k in request}
+        input_data = dict(input=request['chat_input'], **input_data, include_servings=self.include_servings,
+                          foods=[{"query": int(food_id) if str(food_id).isdigit() else food_id, "results": [result]}])
+        user_message = json.dumps({'input': input_data['input'], 'foods': input_data['foods']}, indent=2)
+        response = self.converse(3, [{"role": "user", "content": prompt_content(self.prompts[3], user_message, self.use_prompt_cache)}])
+        return parse_ingredients(response["output"]["message"]["content"][0]["text"], self.models[3][0])
+
+    def food(self, request, query, start_time, extracted_at):
+        """Steps 2 and 3 for one extracted food, with timings relative to the request start"""
+        timing = {"query": query, "extracted": extracted_at, "food_id": None, "ingredients": [], "error": None}
+        try:
+            timing["step2_start"] = time.time() - start_time
+            timing["food_id"] = self.step2(request, query)
+            timing["step2_end"] = time.time() - start_time
+            if timing["food_id"] is not None:
+                timing["step3_start"] = time.time() - start_time
+                timing["ingredients"] = self.step3(request, timing["food_id"])
+                timing["step3_end"] = time.time() - start_time
+        except Exception as e:
+            timing["error"] = str(e)
+        timing["done"] = time.time() - start_time
+        return timing
+
+    def run(self, request):
+        """Row result: ingredients, per-food timings and per-stage timings for one step 1 input"""
+        start_time = time.time()
+        futures = []
+
+        def on_food(query):
+            if isinstance(query, str) and query.strip():
+                futures.append(self.executor.submit(self.food, request, query, start_time, time.time() - start_time))
+
+        response = self.converse(1, [
+            {"role": "user", "content": [{"text": self.prompts[1]}]},
+            {"role": "user", "content": [{"text": json.dumps(request, indent=2)}]},
+            STEP1_PREFILL,
+        ], stream=True, on_item=on_food)
+        step1_end = time.time() - start_time
+        extracted = response_json(response["output"]["message"]["content"][0]["text"], self.models[1][0]) or {}
+
+        foods = [future.result() for future in futures]
+        end = time.time() - start_time
+
+        def span(stage):
+            timed = [(f[f"{stage}_start"], f[f"{stage}_end"]) for f in foods if f"{stage}_end" in f]
+            return {"first_start": min(start for start, _ in timed), "last_end": max(end for _, end in timed),
+                    "mean_duration": sum(end - start for start, end in timed) / len(timed)} if timed else None
+
+        return {
+            "input": request.get('chat_input'),
+            "extracted_foods": extracted.get('foods', []),
+            "ingredients": [ingredient for f in foods for ingredient in f["ingredients"]],
+            "foods": foods,
+            "stages": {
+                "step1": {"ttft": response["streaming"]["ttft"],
+                          "first_food": min((f["extracted"] for f in foods), default=None),
+                          "end": step1_end},
+                "step2": span("step2"),
+                "step3": span("step3"),
+            },
+            "end_to_end": end,
+        }
+
+
+if __name__ == "__main__":
+    def read_prompt(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip().strip('"')
+
+    pipeline = Pipeline(
+        prompts={1: read_prompt('prompts/prompt1.txt'), 2: read_prompt('prompts/prompt2.txt'), 3: read_prompt('prompts/prompt3_new.txt')},
+        models={1: ("us.amazon.nova-micro-v1:0", "us-west-2"), 2: ("us.amazon.nova-micro-v1:0", "us-west-2"),
+                3: ("us.meta.llama4-maverick-17b-instruct-v1:0", "us-west-2")},
+    )
+    df = pd.read_csv('data/test_data_clean.csv')
+    all_results = []
+    for row_idx, value in enumerate(df['Prompt 1 - Extract foods Input']):
+        result = dict(row_index=row_idx, **pipeline.run(json.loads(value)))
+        all_results.append(result)
+        stages = result["stages"]
+        print(f"Row {row_idx + 1}: {len(result['ingredients'])} ingredients in {result['end_to_end']:.2f}s "
+              f"(step 1 done at {stages['step1']['end']:.2f}s, first food at {stages['step1']['first_food'] or 0:.2f}s)")
+
+    with open('outputs3/pipeline.json', 'w') as f:
+        json.dump(all_results, f, indent=2, ensure_ascii=False)
+
+    latencies = [r["end_to_end"] for r in all_results]
+    print(f"End-to-end p50 {percentile(latencies, 50):.2f}s, p99 {percentile(latencies, 99):.2f}s")
+    print(f"Limiter: {limiter.stats()}")
+    print(f"JSON parsing: {parse_stats.stats()}")
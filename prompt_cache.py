@@ -0,0 +1,64 @@
+# Prompt-prefix caching. The step 3 prompts put the data in the middle of the
+# template ({{foods}}), so the whole text used to change with every request.
+# Splitting the template there gives a static prefix (all instructions up to
+# <FoodsInput>) that is marked with a cachePoint, followed by the data and the
+# closing part of the template. Both blocks go in the same user turn, so the
+# model sees exactly the same text as before. Templates that open with the data
+# and put the instructions after it (prompt3_old.txt) are reordered so the
+# instructions come first and the data block last.
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+
+def split_template(template, placeholder="{{foods}}"):
+    """(static prefix, suffix) around the data placeholder"""
+    prefix, found, suffix = template.partition(placeholder)
+    if not found:
+        raise ValueError(f"Template has no {placeholder} placeholder")
+    return prefix, suffix
+
+
+def cacheable_template(template, placeholder="{{foods}}"):
+    """Template with the data block (lead-in, data, closing tag) moved after the instructions
+    when most of the static text follows the data"""
+    prefix, suffix = split_template(template, placeholder)
+    if len(prefix) >= len(suffix):
+        return template
+    closing, _, instructions = suffix.partition("\n\n")
+    return instructions.strip() + "\n\n" + prefix + placeholder + closing
+
+
+def prompt_content(template, user_message, use_prompt_cache=False, placeholder="{{foods}}"):
+    """Content blocks of the user turn: one text block, or prefix + cachePoint + data"""
+    if not use_prompt_cache:
+        return [{"text": template.replace(placeholder, user_message)}]
+    prefix, suffix = split_template(cacheable_template(template, placeholder), placeholder)
+    return [{"text": prefix}, CACHE_POINT, {"text": user_message + suffix}]
+
+
+def cache_usage(response):
+    """{"cache_read_tokens", "cache_write_tokens"} from a converse response's usage"""
+    usage = response.get("usage", {})
+    return {
+        "cache_read_tokens": usage.get("cacheReadInputTokens", 0) or 0,
+        "cache_write_tokens": usage.get("cacheWriteInputTokens", 0) or 0,
+    }
+
+
+def cache_stats(results):
+    """Hit rate and mean latency of cache hits vs misses over results carrying cache_usage() fields"""
+    called = [r for r in results if r.get("input_tokens") is not None and r.get("invocation_time")]
+    hits = [r for r in called if r.get("cache_read_tokens")]
+    misses = [r for r in called if not r.get("cache_read_tokens")]
+    read = sum(r["cache_read_tokens"] for r in hits)
+    prompt_tokens = sum(r["input_tokens"] + (r.get("cache_read_tokens") or 0) + (r.get("cache_write_tokens") or 0) for r in called)
+    return {
+        "requests": len(called),
+        "hits": len(hits),
+        "hit_rate": len(hits) / len(called) if called else None,
+        "cache_read_tokens": read,
+        "cache_write_tokens": sum(r.get("cache_write_tokens") or 0 for r in called),
+        "cached_token_share": read / prompt_tokens if prompt_tokens else None,
+        "hit_latency": sum(r["invocation_time"] for r in hits) / len(hits) if hits else None,
+        "miss_latency": sum(r["invocation_time"] for r in misses) / len(misses) if misses else None,
+    }
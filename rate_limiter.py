@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+from botocore.exceptions import ClientError
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+
+
+def is_throttle(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLE_CODES
+    return any(code in str(error) for code in THROTTLE_CODES)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self):
+        """Take one token, returning 0 on success or the seconds to wait for the next one"""
+        if self.refill() >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdaptiveLimiter:
+    """Token bucket per (model, region) with AIMD control of requests per second and in-flight requests.
+
+    Until the first ThrottlingException both limits grow geometrically; after that
+    every success grows concurrency by roughly one request per round trip and the
+    rate by rate_step, and a throttle multiplies both by decrease. A burst of
+    throttles counts as one congestion event: throttles of requests that started
+    before the last decrease are counted but do not shrink the limits again. Other
+    errors are counted but leave the limits unchanged. The same
+    instance can be shared by thread-pool workers (slot/call) and asyncio tasks
+    (aslot/acall).
+    """
+
+    def __init__(self, rate=2.0, burst=2, concurrency=2, min_rate=0.2, max_rate=50.0,
+                 min_concurrency=1, max_concurrency=64, rate_step=0.1, decrease=0.5):
+        self.initial_rate = rate
+        self.burst = burst
+        self.initial_concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease = decrease
+        self._states = {}
+        self._condition = threading.Condition()
+
+    def _state(self, model_id, region):
+        key = (model_id, region)
+        state = self._states.get(key)
+        if state is None:
+            state = {
+                "bucket": TokenBucket(self.initial_rate, self.burst),
+                "concurrency": float(self.initial_concurrency),
+                "in_flight": 0,
+                "successes": 0,
+                "throttles": 0,
+                "errors": 0,
+                "slow_start": True,
+                "last_decrease": float("-inf"),
+            }
+            self._states[key] = state
+        return state
+
+    def try_acquire(self, model_id, region):
+        """Reserve a slot without blocking, returning 0 on success or a suggested wait in seconds"""
+        with self._condition:
+            state = self._state(model_id, region)
+            if state["in_flight"] >= int(state["concurrency"]):
+                return 0.05
+            wait = state["bucket"].take()
+            if wait == 0:
+                state["in_flight"] += 1
+            return wait
+
+    def has_capacity(self, model_id, region):
+        """Whether a request could start now without waiting for a slot or a token"""
+        with self._condition:
+            state = self._state(model_id, region)
+            return state["in_flight"] < int(state["concurrency"]) and state["bucket"].refill() >= 1
+
+    def acquire(self, model_id, region):
+        while True:
+            wait = self.try_acquire(model_id, region)
+            if wait == 0:
+                return
+            with self._condition:
+                # Woken early by release() when a slot frees up
+                self._condition.wait(wait)
+
+    async def aacquire(self, model_id, region):
+        while True:
+            wait = self.try_acquire(model_id, region)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, model_id, region, throttled=False, started=None, failed=False):
+        """Free a slot; started is the time.monotonic() the request began, used to
+        apply one decrease per burst of throttles. Only requests that neither
+        failed nor were throttled grow the limits."""
+        with self._condition:
+            state = self._state(model_id, region)
+            state["in_flight"] -= 1
+            bucket = state["bucket"]
+            if throttled:
+                state["throttles"] += 1
+                state["slow_start"] = False
+                if started is None or started > state["last_decrease"]:
+                    state["last_decrease"] = time.monotonic()
+                    state["concurrency"] = max(self.min_concurrency, state["concurrency"] * self.decrease)
+                    bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+                    bucket.tokens = 0
+            elif failed:
+                state["errors"] += 1
+            elif state["slow_start"]:
+                # Grow geometrically until the first throttle, like TCP slow start
+                state["successes"] += 1
+                state["concurrency"] = min(self.max_concurrency, state["concurrency"] + 1)
+                bucket.rate = min(self.max_rate, bucket.rate * (1 + self.rate_step))
+            else:
+                state["successes"] += 1
+                state["concurrency"] = min(self.max_concurrency, state["concurrency"] + 1 / state["concurrency"])
+                bucket.rate = min(self.max_rate, bucket.rate + self.rate_step)
+            bucket.capacity = max(self.burst, int(state["concurrency"]))
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, model_id, region):
+        self.acquire(model_id, region)
+        started = time.monotonic()
+        throttled = failed = False
+        try:
+            yield
+        except Exception as e:
+            throttled, failed = is_throttle(e), True
+            raise
+        finally:
+            self.release(model_id, region, throttled, started, failed)
+
+    @asynccontextmanager
+    async def aslot(self, model_id, region):
+        await self.aacquire(model_id, region)
+        started = time.monotonic()
+        throttled = failed = False
+        try:
+            yield
+        except Exception as e:
+            throttled, failed = is_throttle(e), True
+            raise
+        finally:
+            self.release(model_id, region, throttled, started, failed)
+
+    def call(self, model_id, region, fn, retries=4):
+        """Run fn() inside a slot, retrying throttled calls through the limiter"""
+        for attempt in range(retries + 1):
+            try:
+                with self.slot(model_id, region):
+                    return fn()
+            except Exception as e:
+                if attempt == retries or not is_throttle(e):
+                    raise
+
+    async def acall(self, model_id, region, fn, retries=4):
+        """Await fn() inside a slot, retrying throttled calls through the limiter"""
+        for attempt in range(retries + 1):
+            try:
+                async with self.aslot(model_id, region):
+                    return await fn()
+            except Exception as e:
+                if attempt == retries or not is_throttle(e):
+                    raise
+
+    def timed_call(self, model_id, region, fn, retries=4):
+        """Like call() but returns (result, seconds) for the successful attempt, excluding time spent queued"""
+        def attempt():
+            start_time = time.time()
+            result = fn()
+            return result, time.time() - start_time
+        return self.call(model_id, region, attempt, retries)
+
+    async def atimed_call(self, model_id, region, fn, retries=4):
+        async def attempt():
+            start_time = time.time()
+            result = await fn()
+            return result, time.time() - start_time
+        return await self.acall(model_id, region, attempt, retries)
+
+    def stats(self):
+        with self._condition:
+            return {
+                f"{model_id}|{region}": {
+                    "rate": round(state["bucket"].rate, 3),
+                    "concurrency": int(state["concurrency"]),
+                    "in_flight": state["in_flight"],
+                    "successes": state["successes"],
+                    "throttles": state["throttles"],
+                    "errors": state["errors"],
+                }
+                for (model_id, region), state in self._states.items()
+            }
+
+
+# Shared by every runner in the process so all callers see the same quota
+limiter = AdaptiveLimiter()
@@ -0,0 +1,129 @@
+import glob
+import random
+import threading
+import time
+
+import pandas as pd
+
+from rate_limiter import is_throttle
+
+# Regions that serve the cross-region "us." inference profiles
+US_REGIONS = ["us-west-2", "us-east-2"]
+
+
+def regions_from_csvs(pattern='data/models/*.csv'):
+    """Map each model id in the model CSVs to every region it is listed with"""
+    regions = {}
+    for path in sorted(glob.glob(pattern)):
+        models_df = pd.read_csv(path)
+        models_df = models_df[models_df['model'].notna()]
+        for _, row in models_df.iterrows():
+            model_id = row['model'].replace("(latency_optimized)", "").strip()
+            region = str(row['region']).strip()
+            if region in US_REGIONS:
+                regions.setdefault(model_id, []).append(region)
+    for model_id in regions:
+        if model_id.startswith("us."):
+            regions[model_id].extend(US_REGIONS)
+        regions[model_id] = list(dict.fromkeys(regions[model_id]))
+    return regions
+
+
+class RegionRouter:
+    """Sends each request to the region with the best moving latency/error profile for its model.
+
+    Latency and error rate are exponentially weighted per (model, region). A
+    throttled region is put on cooldown and the call fails over to the next best
+    region. Regions without samples are tried first, and a small share of
+    traffic keeps exploring so profiles do not go stale.
+    """
+
+    def __init__(self, regions=None, alpha=0.2, error_weight=4.0, cooldown=30.0, explore=0.05):
+        self.regions = regions or {}
+        self.alpha = alpha
+        self.error_weight = error_weight
+        self.cooldown = cooldown
+        self.explore = explore
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def _profile(self, model_id, region):
+        key = (model_id, region)
+        profile = self._profiles.get(key)
+        if profile is None:
+            profile = {"latency": None, "error_rate": 0.0, "requests": 0, "errors": 0,
+                       "throttles": 0, "total_latency": 0.0, "cooldown_until": 0.0}
+            self._profiles[key] = profile
+        return profile
+
+    def _score(self, profile):
+        if profile["latency"] is None:
+            return 0.0
+        return profile["latency"] * (1 + self.error_weight * profile["error_rate"])
+
+    def ranked(self, model_id, default_region="us-west-2"):
+        """Candidate regions for model_id, best first, with cooling-down regions last"""
+        candidates = self.regions.get(model_id) or [default_region]
+        now = time.time()
+        with self._lock:
+            profiles = {region: self._profile(model_id, region) for region in candidates}
+            ordered = sorted(candidates, key=lambda region: (
+                profiles[region]["cooldown_until"] > now, self._score(profiles[region])))
+        if len(ordered) > 1 and random.random() < self.explore:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    def record(self, model_id, region, latency=None, error=None):
+        with self._lock:
+            profile = self._profile(model_id, region)
+            profile["requests"] += 1
+            failed = 1.0 if error is not None else 0.0
+            profile["error_rate"] += self.alpha * (failed - profile["error_rate"])
+            if error is not None:
+                profile["errors"] += 1
+                if is_throttle(error):
+                    profile["throttles"] += 1
+                    profile["cooldown_until"] = time.time() + self.cooldown
+            if latency is not None:
+                profile["total_latency"] += latency
+                if profile["latency"] is None:
+                    profile["latency"] = latency
+                else:
+                    profile["latency"] += self.alpha * (latency - profile["latency"])
+
+    def call(self, model_id, fn, default_region="us-west-2"):
+        """Run fn(region) in the best region, failing over on throttling.
+
+        fn must return (result, seconds). Returns (result, seconds, region).
+        """
+        error = None
+        for region in self.ranked(model_id, default_region):
+            try:
+                result, latency = fn(region)
+            except Exception as e:
+                self.record(model_id, region, error=e)
+                if not is_throttle(e):
+                    raise
+                error = e
+                continue
+            self.record(model_id, region, latency=latency)
+            return result, latency, region
+        raise error
+
+    def stats(self):
+        with self._lock:
+            totals = {}
+            for (model_id, region), profile in self._profiles.items():
+                totals[model_id] = totals.get(model_id, 0) + profile["requests"]
+            stats = {}
+            for (model_id, region), profile in self._profiles.items():
+                successes = profile["requests"] - profile["errors"]
+                stats[f"{model_id}|{region}"] = {
+                    "share": profile["requests"] / totals[model_id] if totals[model_id] else 0,
+                    "requests": profile["requests"],
+                    "errors": profile["errors"],
+                    "throttles": profile["throttles"],
+                    "mean_latency": profile["total_latency"] / successes if successes else None,
+                    "ewma_latency": profile["latency"],
+                }
+            return stats
@@ -0,0 +1,153 @@
+from json_extract import extract_json
+
+# Step 3 response schema (FoodMatchResponse / Ingredient / EatenInfo /
+# SuggestedServing, as declared with pydantic in 3_matched_size_batch_new.py),
+# checked directly on the parsed converse reply. Each schema is compiled once at
+# import into nested closures, so validating a reply is a walk over the data with
+# no model classes, no tool-use round trip and no LangChain wrapping.
+#
+# Coercion follows pydantic's default (lax) mode: float fields take ints and
+# numeric strings, int fields take integral floats and integer strings, str
+# fields take only strings. Unknown keys are dropped, as model_dump() does.
+#
+#   response, errors = validate_food_match(extract_json(text))
+#   response = parse_food_match(text, model_id, defaults={"query": [...]})   # raises SchemaError
+
+
+class SchemaError(ValueError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors[:5]) + (f" (+{len(errors) - 5} more)" if len(errors) > 5 else ""))
+        self.errors = errors
+
+
+class Nullable:
+    """Required field that may be null (Optional[...] without a default)"""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+EATEN_INFO = {
+    "singular_description": str,
+    "plural_description": str,
+    "units": float,
+    "metric_description": str,
+    "per_unit_metric_amount": float,
+    "total_metric_amount": float,
+    "imperial_description": str,
+    "per_unit_imperial_amount": float,
+    "total_imperial_amount": float,
+}
+
+SUGGESTED_SERVING = {
+    "serving_id": str,
+    "serving": str,
+    "is_default": int,
+    "serving_description": str,
+    "number_of_units": float,
+}
+
+INGREDIENT = {
+    "food_id": int,
+    "food_name": str,
+    "food_type": str,
+    "brand_name": Nullable(str),
+    "match_accuracy": int,
+    "eaten": EATEN_INFO,
+    "suggested_serving": SUGGESTED_SERVING,
+}
+
+FOOD_MATCH_RESPONSE = {
+    "query": [str],
+    "ingredients": [INGREDIENT],
+}
+
+
+def _to_str(value, path, errors):
+    if isinstance(value, str):
+        return value
+    errors.append(f"{path}: expected a string, got {type(value).__name__}")
+
+
+def _to_int(value, path, errors):
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    errors.append(f"{path}: expected an integer, got {value!r:.40}")
+
+
+def _to_float(value, path, errors):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            pass
+    errors.append(f"{path}: expected a number, got {value!r:.40}")
+
+
+SCALARS = {str: _to_str, int: _to_int, float: _to_float}
+
+
+def compile_schema(spec):
+    """validate(value, path, errors) -> coerced value for a spec of types, dicts, [item spec] and Nullable"""
+    if isinstance(spec, Nullable):
+        inner = compile_schema(spec.spec)
+        return lambda value, path, errors: None if value is None else inner(value, path, errors)
+
+    if isinstance(spec, list):
+        item = compile_schema(spec[0])
+
+        def validate_list(value, path, errors):
+            if not isinstance(value, (list, tuple)):
+                errors.append(f"{path}: expected a list, got {type(value).__name__}")
+                return None
+            return [item(element, f"{path}[{i}]", errors) for i, element in enumerate(value)]
+        return validate_list
+
+    if isinstance(spec, dict):
+        fields = [(name, compile_schema(field_spec)) for name, field_spec in spec.items()]
+
+        def validate_object(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append(f"{path}: expected an object, got {type(value).__name__}")
+                return None
+            out = {}
+            for name, validate in fields:
+                if name not in value:
+                    errors.append(f"{path}.{name}: missing")
+                    continue
+                out[name] = validate(value[name], f"{path}.{name}", errors)
+            return out
+        return validate_object
+
+    return SCALARS[spec]
+
+
+_food_match = compile_schema(FOOD_MATCH_RESPONSE)
+
+
+def validate_food_match(data):
+    """(coerced FoodMatchResponse dict, [error messages]) for a parsed step 3 reply"""
+    errors = []
+    return _food_match(data, "$", errors), errors
+
+
+def parse_food_match(text, model=None, defaults=None):
+    """Validated FoodMatchResponse dict from a raw reply; raises ValueError/SchemaError.
+
+    defaults fills fields the reply leaves out from the request (the step 3
+    prompts do not ask the model to echo "query")
+    """
+    reply = extract_json(text, model)
+    response, errors = validate_food_match(dict(defaults, **reply) if defaults else reply)
+    if errors:
+        raise SchemaError(errors)
+    return response
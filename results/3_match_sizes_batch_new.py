@@ -1,5 +1,6 @@
 import pandas as pd
 import json
+import os
 import boto3
 import time
 from langchain_aws import ChatBedrock
@@ -51,6 +52,7 @@ test_data = df[['Prompt 3 - match sizes Input', 'Prompt 3 - match sizes Output']
 llm = ChatBedrock(
     model_id="us.meta.llama4-maverick-17b-instruct-v1:0",
     region_name="us-west-2",
+    endpoint_url=os.environ.get("BEDROCK_ENDPOINT_URL"),
     model_kwargs={
         "max_tokens": 2048,
         "temperature": 0.1,
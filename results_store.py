@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from response_cache import canonical_json
+
+# Append-only results store. Runners record one row per model request as it
+# completes instead of holding every result and dumping indented JSON at the
+# end. Request inputs and responses are stored once in `blobs`, keyed by the
+# sha256 of their canonical JSON, so the same step 1/2 input repeated across
+# models and cache settings costs one copy. Analysis reads the narrow
+# `requests` table with SQL and only loads blobs it asks for. Benchmark harness
+# runs are ordinary runs whose requests carry a repetition number, plus one
+# `benchmarks` row with the warmup count, wall times and summary.
+#
+#   store = ResultsStore()
+#   run_id = store.start_run("1_extract_foods/nova-micro", config={...})
+#   store.record(run_id, 1, result, row_index=0, input_data=input_data)
+#   store.summary()                                  # aggregates per run/model, computed in SQLite
+#   store.requests("model = ? AND status = 'ok'", [model_id])
+#
+#   python results_store.py                          # per-run summary of the store
+#   python results_store.py --import outputs/1_extract_foods_nova-micro-v1_no_cache_3.json --step 1
+
+STORE_PATH = 'outputs3/results.sqlite'
+
+REQUEST_COLUMNS = [
+    "run_id", "step", "row_index", "food", "model", "region", "latency", "input_tokens", "output_tokens",
+    "cache_read_tokens", "cache_write_tokens", "cost", "estimated_cost", "status", "error",
+    "input_hash", "response_hash", "recorded", "repetition",
+]
+
+
+def content_hash(content):
+    return hashlib.sha256(canonical_json(content).encode('utf-8')).hexdigest()
+
+
+def request_status(result):
+    """"ok", "cache_hit" or "error" for a runner result"""
+    if isinstance(result.get("actual"), str) and result["actual"].startswith("ERROR"):
+        return "error"
+    return "cache_hit" if result.get("response_cache_hit") else "ok"
+
+
+class ResultsStore:
+    """SQLite store of runs, per-request metrics and content-addressed inputs/responses.
+
+    Every record is committed on its own, so a crashed run keeps what it
+    finished. Safe to share between threads.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, name TEXT, config TEXT, started REAL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS requests (run_id TEXT, step INTEGER, row_index INTEGER, food TEXT, model TEXT, "
+            "region TEXT, latency REAL, input_tokens INTEGER, output_tokens INTEGER, cache_read_tokens INTEGER, "
+            "cache_write_tokens INTEGER, cost REAL, estimated_cost REAL, status TEXT, error TEXT, "
+            "input_hash TEXT, response_hash TEXT, recorded REAL, repetition INTEGER)")
+        # Stores created before benchmarks moved here lack the repetition column
+        if "repetition" not in [row[1] for row in self._db.execute("PRAGMA table_info(requests)")]:
+            self._db.execute("ALTER TABLE requests ADD COLUMN repetition INTEGER")
+        self._db.execute("CREATE INDEX IF NOT EXISTS requests_run ON requests (run_id, row_index)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS requests_model ON requests (step, model)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, content TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS benchmarks (run_id TEXT PRIMARY KEY, warmup INTEGER, wall_times TEXT, summary TEXT)")
+        self._db.commit()
+
+    def start_run(self, name, config=None):
+        run_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("INSERT INTO runs VALUES (?, ?, ?, ?)",
+                             (run_id, name, json.dumps(config or {}, ensure_ascii=False, default=str), time.time()))
+            self._db.commit()
+        return run_id
+
+    def _put_blob(self, content):
+        if content is None:
+            return None
+        key = content_hash(content)
+        self._db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (key, json.dumps(content, ensure_ascii=False)))
+        return key
+
+    def record(self, run_id, step, result, row_index=None, food=None, input_data=None, model=None, region=None,
+               repetition=None):
+        """Append one request; result is a runner result dict (actual, invocation_time, cost, *_tokens, ...)"""
+        status = request_status(result)
+        estimate = result.get("estimate") or {}
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO requests VALUES ({', '.join('?' * len(REQUEST_COLUMNS))})",
+                (run_id, step, row_index, food, model or result.get("model"), region or result.get("region"),
+                 result.get("invocation_time"), result.get("input_tokens"), result.get("output_tokens"),
+                 result.get("cache_read_tokens"), result.get("cache_write_tokens"), result.get("cost"),
+                 estimate.get("cost"), status, result["actual"] if status == "error" else None,
+                 self._put_blob(input_data), None if status == "error" else self._put_blob(result.get("actual")),
+                 time.time(), repetition))
+            self._db.commit()
+
+    def record_benchmark(self, run_id, warmup, wall_times, summary):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO benchmarks VALUES (?, ?, ?, ?)",
+                             (run_id, warmup, json.dumps(wall_times), json.dumps(summary, default=str)))
+            self._db.commit()
+
+    def benchmarks(self, name=None):
+        """Stored benchmark runs (optionally only those called name), oldest first, with their request records"""
+        runs = self.query(
+            "SELECT runs.id, runs.name, runs.config, runs.started, benchmarks.warmup, benchmarks.wall_times, benchmarks.summary "
+            "FROM benchmarks JOIN runs ON runs.id = benchmarks.run_id"
+            + (" WHERE runs.name = ?" if name is not None else "") + " ORDER BY runs.started", [name] if name is not None else [])
+        benchmarks = []
+        for _, run in runs.iterrows():
+            requests = self.query(
+                "SELECT row_index, food, model, latency, cost, input_tokens, output_tokens, error, repetition "
+                "FROM requests WHERE run_id = ? ORDER BY rowid", [run["id"]])
+            benchmarks.append({
+                "id": run["id"],
+                "name": run["name"],
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run["started"])),
+                "config": json.loads(run["config"]),
+                "warmup": int(run["warmup"]),
+                "wall_times": json.loads(run["wall_times"]),
+                "summary": json.loads(run["summary"]),
+                "requests": [{k: (None if pd.isna(v) else v) for k, v in r.items()} for r in requests.to_dict("records")],
+            })
+        return benchmarks
+
+    def blob(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT content FROM blobs WHERE hash = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self._db, params=list(params))
+
+    def runs(self, name=None):
+        if name is None:
+            return self.query("SELECT * FROM runs ORDER BY started")
+        return self.query("SELECT * FROM runs WHERE name = ? ORDER BY started", [name])
+
+    def requests(self, where=None, params=(), columns=None):
+        """Request rows joined with their run name; where is an SQL condition on the requests columns"""
+        sql = f"SELECT runs.name, {', '.join('requests.' + c for c in columns or REQUEST_COLUMNS)} " \
+              "FROM requests JOIN runs ON runs.id = requests.run_id"
+        return self.query(sql + (f" WHERE {where}" if where else ""), params)
+
+    def summary(self, where=None, params=()):
+        """Per run and model: requests, errors, cache hits, mean/max latency, tokens and cost"""
+        return self.query(
+            "SELECT runs.name, requests.run_id, requests.step, requests.model, COUNT(*) AS requests, "
+            "SUM(status = 'error') AS errors, SUM(status = 'cache_hit') AS cache_hits, "
+            "AVG(CASE WHEN status = 'ok' THEN latency END) AS mean_latency, "
+            "MAX(CASE WHEN status = 'ok' THEN latency END) AS max_latency, "
+            "SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens, "
+            "SUM(cache_read_tokens) AS cache_read_tokens, SUM(cost) AS cost, MIN(runs.started) AS started "
+            "FROM requests JOIN runs ON runs.id = requests.run_id"
+            + (f" WHERE {where}" if where else "") +
+            " GROUP BY requests.run_id, requests.model ORDER BY started", params)
+
+    def import_json(self, path, step, name=None):
+        """Load a legacy runner output (a list of row summaries) as a run; returns its id"""
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        run_id = self.start_run(name or os.path.splitext(os.path.basename(path))[0], config={"imported_from": path})
+        for row in rows:
+            results = row.get("individual_results") or [row]
+            for result in results:
+                actual = result.get("actual", result.get("extracted_foods", result.get("ingredients")))
+                self.record(run_id, step, dict(result, actual=actual, invocation_time=result.get("invocation_time", row.get("total_time"))),
+                            row_index=row.get("row_index"), food=result.get("food_query"), input_data=row.get("input_data"))
+        return run_id
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize or import into the results store")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--import", dest="import_paths", nargs="*", default=[], help="legacy runner JSON outputs to load")
+    parser.add_argument("--step", type=int, default=3, help="step of the imported outputs")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    for path in args.import_paths:
+        print(f"Imported {path} as run {store.import_json(path, args.step)}")
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(store.summary())
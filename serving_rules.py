@@ -0,0 +1,116 @@
+import re
+
+from food_cache import quantity_phrase
+from unit_conversion import build_ingredient, eaten_info, serving_metric, servings_of
+
+# Rule-based fast path for step 3. A food is resolved locally when it has a single
+# candidate and either
+#   - its phrase in the input carries no quantity, so the prompt's rule applies and
+#     the is_default = "1" serving is used, or
+#   - the quantity is an explicit gram/ml amount and a pure metric serving such as
+#     "100 g" exists to express it in.
+# Everything else is left for the model.
+
+METRIC_UNITS = {
+    "g": "g", "gr": "g", "gram": "g", "grams": "g", "gramm": "g", "г": "g", "гр": "g", "грамм": "g", "граммов": "g", "грамма": "g",
+    "ml": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml", "мл": "ml", "миллилитров": "ml",
+}
+
+_METRIC_AMOUNT = re.compile(r'(\d+(?:[.,]\d+)?)\s*(' + '|'.join(sorted(METRIC_UNITS, key=len, reverse=True)) + r')(?!\w)', re.IGNORECASE)
+_PURE_METRIC = re.compile(r'^\s*([\d.]+)\s*(g|ml|г|мл)\s*$', re.IGNORECASE)
+
+# Words that mean the user said how much they ate, so the default serving may be wrong
+QUANTITY_WORDS = {
+    "a", "an", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "dozen",
+    "half", "quarter", "third", "couple", "few", "some", "several", "small", "medium", "large", "big",
+    "cup", "cups", "glass", "glasses", "slice", "slices", "piece", "pieces", "bowl", "bowls", "plate",
+    "tbsp", "tablespoon", "tablespoons", "tsp", "teaspoon", "teaspoons", "oz", "ounce", "ounces",
+    "lb", "lbs", "pound", "pounds", "can", "cans", "bottle", "bottles", "scoop", "scoops", "serving",
+    "servings", "handful", "pinch", "spoon", "spoons", "shot", "shots", "mug", "mugs", "bar", "bars",
+    "один", "одна", "одно", "одну", "два", "две", "двух", "три", "трех", "трёх", "четыре", "пять",
+    "половина", "половину", "пол", "немного", "несколько", "ломтик", "ломтика", "ломтиков", "кусок",
+    "куска", "кусочек", "стакан", "стакана", "стаканов", "чашка", "чашку", "чашки", "ложка", "ложку",
+    "ложки", "ложек", "тарелка", "тарелку", "порция", "порцию", "маленький", "маленькую", "большой", "большую",
+}
+
+
+def explicit_metric_amount(phrase):
+    """(amount, unit as written, "g"/"ml") for an explicit "140 g" style quantity, or None"""
+    matches = _METRIC_AMOUNT.findall(phrase)
+    if len(matches) != 1:
+        return None
+    amount, unit = matches[0]
+    return float(amount.replace(',', '.')), unit, METRIC_UNITS[unit.lower()]
+
+
+def has_quantity(phrase):
+    return bool(re.search(r'\d', phrase)) or any(word in QUANTITY_WORDS for word in re.findall(r'\w+', phrase.lower()))
+
+
+def default_ingredient(result):
+    servings = servings_of(result)
+    serving = next((s for s in servings if str(s.get('is_default')) == "1"), None)
+    metric = serving_metric(serving) if serving else None
+    if metric is None:
+        return None
+    amount, metric_description = metric
+    pure = _PURE_METRIC.match(serving.get('serving_description', ''))
+    if pure:
+        # "100 g" default: report the grams eaten, like an explicit metric amount
+        return build_ingredient(result, serving, eaten_info(metric_description, metric_description, amount, metric_description, 1.0), 90, 1.0)
+    description = re.sub(r'^[\d./\s]+', '', serving.get('serving_description', '')).strip() or "serving"
+    return build_ingredient(result, serving, eaten_info(description, description, 1.0, metric_description, amount), 90, 1.0)
+
+
+def metric_ingredient(result, amount, unit, metric_description):
+    for serving in servings_of(result):
+        pure = _PURE_METRIC.match(serving.get('serving_description', ''))
+        metric = serving_metric(serving)
+        if pure and metric and metric[1] == metric_description and float(pure.group(1)) > 0:
+            return build_ingredient(result, serving, eaten_info(unit, unit, amount, metric_description, 1.0), 100,
+                                    amount / float(pure.group(1)))
+    return None
+
+
+def match_food(input_data, food_item):
+    """Ingredient for food_item resolved by the rules, or None when the model is needed"""
+    results = food_item.get('results', [])
+    if len(results) != 1:
+        return None
+    result = results[0]
+    phrase = quantity_phrase(input_data.get("input", ""), result.get('food_name', ''))
+    explicit = explicit_metric_amount(phrase)
+    if explicit:
+        return metric_ingredient(result, *explicit)
+    if has_quantity(phrase):
+        return None
+    return default_ingredient(result)
+
+
+def split_foods(input_data):
+    """(ingredients resolved by the rules, foods that still need the model)"""
+    ingredients, remaining = [], []
+    for food_item in input_data.get('foods', []):
+        ingredient = match_food(input_data, food_item)
+        if ingredient is None:
+            remaining.append(food_item)
+        else:
+            ingredients.append(ingredient)
+    return ingredients, remaining
+
+
+def row_response(input_data, ingredients):
+    """Step 3 response for a row, in the same shape the model returns"""
+    response = {k: input_data[k] for k in ['input', 'language', 'region', 'language_description', 'region_description'] if k in input_data}
+    response["query"] = [str(food.get('query')) for food in input_data.get('foods', [])]
+    response["ingredients"] = ingredients
+    return response
+
+
+def merge_into(response_json, input_data, ingredients):
+    """Add rule-resolved ingredients to the model's response for the rest of the row"""
+    if not ingredients or not isinstance(response_json, dict):
+        return response_json
+    response_json["query"] = [str(food.get('query')) for food in input_data.get('foods', [])]
+    response_json["ingredients"] = list(response_json.get("ingredients") or []) + ingredients
+    return response_json
@@ -0,0 +1,149 @@
+import json
+import time
+
+
+class IngredientStreamParser:
+    """Incrementally pulls completed items out of the "ingredients" (or key) array of a streamed JSON response.
+
+    feed() takes raw text deltas (fences and prefill text are ignored) and returns
+    every item that was completed by that delta. Objects are returned as soon as
+    they close, strings and numbers once the comma or bracket after them arrives.
+    """
+
+    def __init__(self, key="ingredients"):
+        self.marker = f'"{key}"'
+        self.buffer = ""
+        self.pos = 0
+        self.in_array = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.depth = 0
+        self.object_start = None
+        self.scalar_start = None
+
+    def _scalar(self, buffer, end, completed):
+        if self.scalar_start is None:
+            return
+        try:
+            completed.append(json.loads(buffer[self.scalar_start:end]))
+        except ValueError:
+            pass
+        self.scalar_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        if self.done:
+            return completed
+
+        if not self.in_array:
+            key_at = self.buffer.find(self.marker)
+            if key_at == -1:
+                return completed
+            array_at = self.buffer.find('[', key_at + len(self.marker))
+            if array_at == -1:
+                return completed
+            self.in_array = True
+            self.pos = array_at + 1
+
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 0 and self.scalar_start is None:
+                    self.scalar_start = i
+            elif char in '{[':
+                if self.depth == 0 and char == '{':
+                    self.object_start = i
+                self.depth += 1
+            elif char in '}]':
+                if self.depth == 0:
+                    # closing bracket of the ingredients array itself
+                    self._scalar(buffer, i, completed)
+                    self.done = True
+                    self.pos = i + 1
+                    return completed
+                self.depth -= 1
+                if self.depth == 0 and self.object_start is not None:
+                    try:
+                        completed.append(json.loads(buffer[self.object_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self.object_start = None
+            elif self.depth == 0:
+                if char == ',':
+                    self._scalar(buffer, i, completed)
+                elif not char.isspace() and self.scalar_start is None:
+                    self.scalar_start = i
+        self.pos = len(buffer)
+        return completed
+
+
+def converse_streaming(client, on_ingredient=None, stream_key="ingredients", **request):
+    """Call converse_stream and return a converse-shaped response with streaming timings.
+
+    The extra "streaming" block records time to first token, generation time,
+    output tokens/sec and when the first ingredient was available. on_ingredient
+    is called with each ingredient as soon as its JSON object is complete, or
+    with each item of the stream_key array (e.g. step 1 "foods").
+    """
+    start_time = time.time()
+    response = client.converse_stream(**request)
+
+    parser = IngredientStreamParser(stream_key)
+    chunks = []
+    ingredients = []
+    first_token_time = None
+    first_ingredient_time = None
+    usage = {}
+    metrics = {}
+    stop_reason = None
+
+    for event in response["stream"]:
+        if "contentBlockDelta" in event:
+            text = event["contentBlockDelta"]["delta"].get("text", "")
+            if not text:
+                continue
+            if first_token_time is None:
+                first_token_time = time.time()
+            chunks.append(text)
+            for ingredient in parser.feed(text):
+                if first_ingredient_time is None:
+                    first_ingredient_time = time.time()
+                ingredients.append(ingredient)
+                if on_ingredient is not None:
+                    on_ingredient(ingredient)
+        elif "messageStop" in event:
+            stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            usage = event["metadata"].get("usage", {})
+            metrics = event["metadata"].get("metrics", {})
+
+    end_time = time.time()
+    ttft = first_token_time - start_time if first_token_time is not None else None
+    generation_time = end_time - first_token_time if first_token_time is not None else None
+    output_tokens = usage.get("outputTokens")
+    tokens_per_second = output_tokens / generation_time if output_tokens and generation_time else None
+
+    return {
+        "output": {"message": {"role": "assistant", "content": [{"text": "".join(chunks)}]}},
+        "usage": usage,
+        "metrics": metrics,
+        "stopReason": stop_reason,
+        "streaming": {
+            "ttft": ttft,
+            "generation_time": generation_time,
+            "output_tokens_per_second": tokens_per_second,
+            "first_ingredient_time": first_ingredient_time - start_time if first_ingredient_time is not None else None,
+            "streamed_ingredients": len(ingredients),
+        }
+    }
@@ -0,0 +1,29 @@
+import pytest
+
+import json_extract
+from json_extract import ParseStats, extract_json, try_extract_json
+
+INGREDIENT = '{"food_id": 1, "food_name": "Bread", "eaten": {"units": 1, "metric_description": "g"}}'
+
+
+def test_clean_reply_after_prefill():
+    assert extract_json(' Here is the JSON response: ```json\n{"ingredients": []}\n```') == {"ingredients": []}
+
+
+def test_truncated_reply_keeps_complete_ingredients():
+    reply = '{"ingredients": [' + INGREDIENT + ', {"food_id": 2, "food_name": "Mi'
+    assert extract_json(reply) == {"ingredients": [extract_json(INGREDIENT)]}
+
+
+def test_reply_cut_off_inside_first_ingredient_fails(monkeypatch):
+    monkeypatch.setattr(json_extract, "parse_stats", ParseStats())
+    reply = '{"ingredients": [{"food_id": 1, "food_name": "Bre'
+    with pytest.raises(ValueError):
+        extract_json(reply, "model")
+    assert try_extract_json(reply) is None
+    stats = json_extract.parse_stats.stats()["model"]
+    assert (stats["failed"], stats["repaired"]) == (1, 0)
+
+
+def test_trailing_comma_and_python_literals():
+    assert extract_json('{"a": [1, 2,], "b": True, "c": None,}') == {"a": [1, 2], "b": True, "c": None}
@@ -0,0 +1,337 @@
+import glob
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Offline token estimator. Token counts are modelled per model family as
+#   tokens = ascii_rate * ASCII characters + escape_rate * \uXXXX escapes
+#            + non_ascii_rate * other characters (+ overhead for inputs)
+# with the rates fitted against the input_tokens/output_tokens recorded in outputs*/.
+# json.dumps escapes Cyrillic by default, and those escapes tokenize far more
+# densely than plain text, so they get their own rate.
+# Output length is modelled as output_base + output_per_food * foods, and latency as
+#   seconds = latency_base + latency_per_input * input_tokens + latency_per_output * output_tokens.
+# Rates and the input overhead are fitted within RATE_BOUNDS, and a family whose
+# fit is still off by more than MAX_FIT_ERROR percent keeps the default rates.
+#
+#   python token_estimator.py   # refit from outputs*/ and rewrite data/models/token_calibration.json
+
+CALIBRATION_PATH = 'data/models/token_calibration.json'
+
+# Used for families without recorded calls
+DEFAULT_CALIBRATION = {
+    "ascii_rate": 0.28,
+    "escape_rate": 2.5,
+    "non_ascii_rate": 0.55,
+    "input_overhead": 10,
+    "output_base": 40,
+    "output_per_food": 150,
+    "latency_base": 0.6,
+    "latency_per_input": 0.00005,
+    "latency_per_output": 0.004,
+    "max_input_tokens": 128000,
+}
+
+# Plausible tokens per character (per escape for escape_rate) and per prompt
+RATE_BOUNDS = {
+    "ascii_rate": (0.15, 0.5),
+    "escape_rate": (0.5, 3.0),
+    "non_ascii_rate": (0.2, 1.2),
+    "input_overhead": (0.0, 200.0),
+}
+MAX_FIT_ERROR = 15.0
+
+STEP_PROMPTS = {1: 'prompts/prompt1.txt', 2: 'prompts/prompt2.txt'}
+ROUND4_PROMPTS = {'new': 'prompts/prompt3_new.txt', 'old': 'prompts/prompt3_old.txt'}
+
+
+def family_of(model_id):
+    model_id = model_id.lower()
+    for family in ["nova", "llama4", "llama3", "gpt-oss"]:
+        if family in model_id:
+            return family
+    return "default"
+
+
+_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{4}')
+RATE_NAMES = ["ascii_rate", "escape_rate", "non_ascii_rate"]
+
+
+def text_features(text):
+    """(plain ASCII characters, \\uXXXX escapes, non-ASCII characters)"""
+    escapes = len(_ESCAPE.findall(text))
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return len(text) - non_ascii - 6 * escapes, escapes, non_ascii
+
+
+def read_prompt(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip().strip('"')
+
+
+def pricing_from_csvs(pattern='data/models/*.csv'):
+    """model id -> (input price, output price) per 1000 tokens from the model CSVs"""
+    pricing = {}
+    for path in sorted(glob.glob(pattern)):
+        models_df = pd.read_csv(path)
+        models_df = models_df[models_df['model'].notna()]
+        for _, row in models_df.iterrows():
+            try:
+                input_price = float(str(row['input price']).replace('$', ''))
+                output_price = float(str(row['output price']).replace('$', ''))
+            except (KeyError, ValueError):
+                continue
+            pricing.setdefault(row['model'].replace("(latency_optimized)", "").strip(), (input_price, output_price))
+    return pricing
+
+
+def _row_number(value):
+    return int(float(value)) if value not in (None, "") else None
+
+
+def calibration_samples(test_data_path='data/test_data_clean.csv'):
+    """(family, kind, text, tokens, foods, invocation_time, input_tokens) for every recorded call whose text is known.
+
+    Outputs are the recorded replies. Inputs are only used where the full prompt
+    can be rebuilt: steps 1/2 without prompt caching, and round 4 batch_new/old.
+    """
+    samples = []
+    df = pd.read_csv(test_data_path)
+    step3_inputs = [json.loads(value) for value in df['Prompt 3 - match sizes Input']]
+
+    for step, pattern in [(1, 'outputs1/*.json'), (2, 'outputs2/*.json')]:
+        system_prompt = read_prompt(STEP_PROMPTS[step])
+        for path in sorted(glob.glob(pattern)):
+            family = "nova"
+            with open(path, 'r') as f:
+                rows = json.load(f)
+            for row in rows:
+                output = row.get('extracted_foods')
+                if not isinstance(output, dict) or not row.get('output_tokens'):
+                    continue
+                foods = len(output.get('foods', output.get('queries', [])) or [])
+                samples.append((family, "output", json.dumps(output, indent=2, ensure_ascii=False),
+                                int(row['output_tokens']), foods, row.get('invocation_time'), int(row['input_tokens'])))
+                if '_no_cache' in path:
+                    prompt = system_prompt + json.dumps(row['input_data'], indent=2) + " Here is the JSON response: ```json"
+                    samples.append((family, "input", prompt, int(row['input_tokens']), foods, None, None))
+
+    for path in sorted(glob.glob('outputs3/round1/*.json') + glob.glob('outputs3/round2/3_match_sizes_results.json')):
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        for row in rows:
+            if not row.get('success') or not row.get('output_tokens'):
+                continue
+            samples.append((family_of(row['model']), "output", str(row['actual']), int(row['output_tokens']),
+                            None, row.get('invocation_time'), int(row['input_tokens'])))
+
+    for path in sorted(glob.glob('outputs3/round4/*.json')):
+        variant = next((v for v in ROUND4_PROMPTS if f'batch_{v}_' in os.path.basename(path)), None)
+        with open(path, 'r') as f:
+            rows = json.load(f)
+        for row in rows:
+            if not isinstance(row.get('ingredients'), dict) or not row.get('output_tokens'):
+                continue
+            foods = _row_number(row.get('food_count'))
+            samples.append(("llama4", "output", json.dumps(row['ingredients'], indent=4, ensure_ascii=False),
+                            int(row['output_tokens']), foods, row.get('invocation_time'), int(row['input_tokens'])))
+            if variant:
+                input_data = step3_inputs[_row_number(row['row_index'])]
+                model_input = {'input': input_data['input'], 'foods': input_data['foods']} if variant == 'new' else input_data
+                prompt = read_prompt(ROUND4_PROMPTS[variant]).replace("{{foods}}", json.dumps(model_input, indent=2))
+                samples.append(("llama4", "input", prompt, int(row['input_tokens']), foods, None, None))
+    return samples
+
+
+def bounded_lstsq(a, b, bounds):
+    """Least squares x for a @ x ~ b with bounds[i][0] <= x[i] <= bounds[i][1].
+
+    Exact for the few coefficients fitted here: every choice of coefficients
+    pinned at a bound is tried, the rest solved freely, and the best feasible
+    solution kept.
+    """
+    best, best_residual = None, None
+    for pins in itertools.product((None, 0, 1), repeat=a.shape[1]):
+        x = np.array([bounds[i][pin] if pin is not None else 0.0 for i, pin in enumerate(pins)])
+        free = [i for i, pin in enumerate(pins) if pin is None]
+        if free:
+            x[free], *_ = np.linalg.lstsq(a[:, free], b - a @ x, rcond=None)
+        if any(not bounds[i][0] - 1e-9 <= x[i] <= bounds[i][1] + 1e-9 for i in free):
+            continue
+        residual = float(np.sum((a @ x - b) ** 2))
+        if best_residual is None or residual < best_residual:
+            best, best_residual = x, residual
+    return best
+
+
+def _fit_error(samples, params):
+    return float(np.mean([abs(estimate_text(s[2], params, s[1]) - s[3]) / s[3] for s in samples]) * 100)
+
+
+def calibrate(samples):
+    calibration = {}
+    for family in sorted({sample[0] for sample in samples}):
+        family_samples = [s for s in samples if s[0] == family]
+        params = dict(DEFAULT_CALIBRATION)
+
+        text_samples = [s for s in family_samples if s[1] == "output"] + [s for s in family_samples if s[1] == "input"]
+        features = np.array([text_features(s[2]) for s in text_samples], dtype=float)
+        tokens = np.array([s[3] for s in text_samples], dtype=float)
+        # Only fit rates for character classes that actually occur; keep defaults for the rest
+        fitted = [i for i in range(len(RATE_NAMES)) if features[:, i].sum() > 0]
+        fixed = features[:, [i for i in range(len(RATE_NAMES)) if i not in fitted]] @ np.array(
+            [DEFAULT_CALIBRATION[RATE_NAMES[i]] for i in range(len(RATE_NAMES)) if i not in fitted])
+        rates = bounded_lstsq(features[:, fitted], tokens - fixed, [RATE_BOUNDS[RATE_NAMES[i]] for i in fitted])
+        for i, rate in zip(fitted, rates):
+            params[RATE_NAMES[i]] = float(rate)
+
+        inputs = [s for s in family_samples if s[1] == "input"]
+        if inputs:
+            residuals = [s[3] - estimate_text(s[2], params, "output") for s in inputs]
+            low, high = RATE_BOUNDS["input_overhead"]
+            params["input_overhead"] = float(min(max(np.median(residuals), low), high))
+
+        params["fallback"] = _fit_error(text_samples, params) > MAX_FIT_ERROR
+        if params["fallback"]:
+            params.update({name: DEFAULT_CALIBRATION[name] for name in RATE_NAMES + ["input_overhead"]})
+
+        sized = [s for s in family_samples if s[1] == "output" and s[4]]
+        if len({s[4] for s in sized}) > 1:
+            slope, intercept = np.polyfit([s[4] for s in sized], [s[3] for s in sized], 1)
+            params["output_per_food"], params["output_base"] = float(max(slope, 1)), float(max(intercept, 0))
+
+        timed = [s for s in family_samples if s[1] == "output" and s[5] and s[6]]
+        if len(timed) >= 5:
+            design = np.array([[1.0, float(s[6]), float(s[3])] for s in timed])
+            coefficients, *_ = np.linalg.lstsq(design, np.array([float(s[5]) for s in timed]), rcond=None)
+            params["latency_base"], params["latency_per_input"], params["latency_per_output"] = (float(max(c, 0)) for c in coefficients)
+
+        params["mean_abs_pct_error"] = _fit_error(text_samples, params)
+        params["samples"] = len(text_samples)
+        calibration[family] = params
+    return calibration
+
+
+def estimate_text(text, params, kind="input"):
+    tokens = sum(params[name] * count for name, count in zip(RATE_NAMES, text_features(text)))
+    if kind == "input":
+        tokens += params["input_overhead"]
+    return max(1, int(round(tokens)))
+
+
+def load_calibration(path=CALIBRATION_PATH):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def request_text(request):
+    """All prompt text of a converse request (system blocks and message text blocks)"""
+    texts = [block.get("text", "") for block in request.get("system", []) or []]
+    for message in request.get("messages", []):
+        texts.extend(block.get("text", "") for block in message.get("content", []) if "text" in block)
+    return "".join(texts)
+
+
+class TokenEstimator:
+    """Predicts tokens, cost and latency of a request before it is sent"""
+
+    def __init__(self, calibration=None, pricing=None):
+        self.calibration = load_calibration() if calibration is None else calibration
+        self.pricing = pricing_from_csvs() if pricing is None else pricing
+
+    def params(self, model_id):
+        return self.calibration.get(family_of(model_id), DEFAULT_CALIBRATION)
+
+    def count(self, text, model_id, kind="input"):
+        return estimate_text(text, self.params(model_id), kind)
+
+    def output_tokens(self, model_id, foods=1, max_tokens=None):
+        params = self.params(model_id)
+        tokens = int(round(params["output_base"] + params["output_per_food"] * max(foods, 1)))
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+    def estimate(self, model_id, request=None, text=None, foods=1):
+        """{"input_tokens", "output_tokens", "cost", "latency", "fits"} for a converse request or prompt text"""
+        params = self.params(model_id)
+        if text is None:
+            text = request_text(request)
+        max_tokens = (request or {}).get("inferenceConfig", {}).get("maxTokens")
+        input_tokens = self.count(text, model_id)
+        output_tokens = self.output_tokens(model_id, foods, max_tokens)
+        input_price, output_price = self.pricing.get(model_id.replace("(latency_optimized)", "").strip(), (0.0, 0.0))
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": (input_tokens * input_price + output_tokens * output_price) / 1000,
+            "latency": params["latency_base"] + params["latency_per_input"] * input_tokens + params["latency_per_output"] * output_tokens,
+            "fits": input_tokens <= params["max_input_tokens"],
+        }
+
+    def foods_per_request(self, model_id, max_output_tokens=2048):
+        """Largest number of foods whose expected output still fits in max_output_tokens"""
+        params = self.params(model_id)
+        return max(1, int((max_output_tokens - params["output_base"]) // params["output_per_food"]))
+
+    def split_foods(self, input_data, model_id, render, max_input_tokens=None, max_output_tokens=2048):
+        """Split a step 3 row into chunks whose rendered prompt and expected output both fit.
+
+        render(chunk_input_data) must return the full prompt text for a chunk.
+        """
+        max_input_tokens = max_input_tokens or self.params(model_id)["max_input_tokens"]
+        per_chunk = self.foods_per_request(model_id, max_output_tokens)
+        chunks, current = [], []
+        for food in input_data.get('foods', []):
+            candidate = current + [food]
+            too_long = self.count(render(dict(input_data, foods=candidate)), model_id) > max_input_tokens
+            if current and (len(candidate) > per_chunk or too_long):
+                chunks.append(dict(input_data, foods=current))
+                current = [food]
+            else:
+                current = candidate
+        if current or not chunks:
+            chunks.append(dict(input_data, foods=current))
+        return chunks
+
+
+def combine_results(results):
+    """One row result from the results of its split chunks, which ran concurrently"""
+    combined = dict(results[0])
+    errors = [r["actual"] for r in results if not isinstance(r["actual"], dict)]
+    if errors:
+        combined["actual"] = errors[0]
+    else:
+        combined["actual"] = dict(results[0]["actual"])
+        combined["actual"]["query"] = [q for r in results for q in r["actual"].get("query", [])]
+        combined["actual"]["ingredients"] = [i for r in results for i in r["actual"].get("ingredients", [])]
+    times = [r["invocation_time"] for r in results if r.get("invocation_time") is not None]
+    combined["invocation_time"] = max(times) if times and not errors else None
+    for key in ["cost", "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens"]:
+        values = [r.get(key) for r in results if r.get(key) is not None]
+        combined[key] = sum(values) if values and not errors else None
+    estimates = [r["estimate"] for r in results if r.get("estimate")]
+    if estimates:
+        combined["estimate"] = {
+            "input_tokens": sum(e["input_tokens"] for e in estimates),
+            "output_tokens": sum(e["output_tokens"] for e in estimates),
+            "cost": sum(e["cost"] for e in estimates),
+            "latency": max(e["latency"] for e in estimates),
+            "fits": all(e["fits"] for e in estimates),
+        }
+    combined["chunks"] = len(results)
+    return combined
+
+
+if __name__ == "__main__":
+    calibration = calibrate(calibration_samples())
+    with open(CALIBRATION_PATH, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    for family, params in calibration.items():
+        print(f"{family}: {params['samples']} samples, mean abs error {params['mean_abs_pct_error']:.1f}%"
+              f"{' (fit rejected, default rates)' if params['fallback'] else ''}, "
+              f"{1 / params['ascii_rate']:.2f} ASCII chars/token, output {params['output_base']:.0f} + {params['output_per_food']:.0f}/food")
@@ -0,0 +1,109 @@
+import re
+
+# Expands the minimal step 3 decision fields into the full EatenInfo / SuggestedServing
+# shape of 3_matched_size_batch_new.py. The model only picks the serving, the units and
+# the per-unit metric amount; totals, imperial equivalents and serving details are
+# derived here instead of being generated token by token.
+#
+# Minimal ingredient, as requested by prompts/prompt3_minimal.txt:
+#   {"food_id": 35752, "match_accuracy": 90, "serving_id": "58483",
+#    "singular": "avocado", "plural": "avocados", "units": 1, "metric": "g", "per_unit": 136}
+
+GRAMS_PER_OZ = 28.3495
+ML_PER_FL_OZ = 29.5735
+
+_SERVING_METRIC = re.compile(r'\(\s*([\d.]+)\s*(g|ml|г|мл)\s*\)\s*$', re.IGNORECASE)
+
+
+def servings_of(result):
+    servings = result.get('servings', {}).get('serving', [])
+    return [servings] if isinstance(servings, dict) else list(servings)
+
+
+def serving_metric(serving):
+    """(amount, "g"/"ml") of one serving from its "1 slice (30.000 g)" text, or None"""
+    match = _SERVING_METRIC.search(serving.get('serving', ''))
+    if not match:
+        return None
+    return float(match.group(1)), "ml" if match.group(2).lower() in ("ml", "мл") else "g"
+
+
+def imperial_amount(amount, metric):
+    return round(amount / (ML_PER_FL_OZ if metric == "ml" else GRAMS_PER_OZ), 6 if amount < 10 else 3)
+
+
+def eaten_info(singular, plural, units, metric, per_unit_metric_amount):
+    metric = "ml" if str(metric).lower() in ("ml", "мл") else "g"
+    units = float(units)
+    per_unit_metric_amount = float(per_unit_metric_amount)
+    total_metric_amount = round(units * per_unit_metric_amount, 3)
+    return {
+        "singular_description": singular,
+        "plural_description": plural or singular,
+        "units": units,
+        "metric_description": metric,
+        "per_unit_metric_amount": per_unit_metric_amount,
+        "total_metric_amount": total_metric_amount,
+        "imperial_description": "fl oz" if metric == "ml" else "oz",
+        "per_unit_imperial_amount": imperial_amount(per_unit_metric_amount, metric),
+        "total_imperial_amount": imperial_amount(total_metric_amount, metric),
+    }
+
+
+def suggested_serving(serving, total_metric_amount, number_of_units=None):
+    """SuggestedServing for serving; number_of_units is derived from its metric amount when not given"""
+    if number_of_units is None:
+        metric = serving_metric(serving)
+        number_of_units = total_metric_amount / metric[0] if metric and metric[0] else 1.0
+    return {
+        "serving_id": str(serving['serving_id']),
+        "serving": serving.get('serving', ''),
+        "is_default": int(serving.get('is_default', 0)),
+        "serving_description": serving.get('serving_description', ''),
+        "number_of_units": round(float(number_of_units), 3),
+    }
+
+
+def build_ingredient(result, serving, eaten, match_accuracy, number_of_units=None):
+    return {
+        "food_id": int(result['food_id']),
+        "food_name": result.get('food_name', ''),
+        "food_type": result.get('food_type', ''),
+        "brand_name": result.get('brand_name', ''),
+        "match_accuracy": match_accuracy,
+        "eaten": eaten,
+        "suggested_serving": suggested_serving(serving, eaten["total_metric_amount"], number_of_units),
+    }
+
+
+def index_results(input_data):
+    """food_id -> search result for every candidate in a step 3 input"""
+    return {str(result['food_id']): result for food in input_data.get('foods', []) for result in food.get('results', [])}
+
+
+def expand_ingredient(minimal, results_by_id):
+    result = results_by_id[str(minimal['food_id'])]
+    servings = servings_of(result)
+    serving_id = str(minimal.get('serving_id', ''))
+    serving = next((s for s in servings if str(s.get('serving_id')) == serving_id), None)
+    if serving is None:
+        serving = next((s for s in servings if str(s.get('is_default')) == "1"), servings[0])
+    per_unit = minimal.get('per_unit')
+    if per_unit is None:
+        per_unit = (serving_metric(serving) or (100.0, "g"))[0]
+    metric = minimal.get('metric') or (serving_metric(serving) or (0, "g"))[1]
+    eaten = eaten_info(minimal.get('singular', ''), minimal.get('plural'), minimal.get('units', 1), metric, per_unit)
+    return build_ingredient(result, serving, eaten, int(minimal.get('match_accuracy', 0)), minimal.get('number_of_units'))
+
+
+def expand_response(response_json, input_data):
+    """Full step 3 response from a minimal one; ingredients with unknown food_ids are dropped"""
+    results_by_id = index_results(input_data)
+    expanded = {k: input_data[k] for k in ['input', 'language', 'region', 'language_description', 'region_description'] if k in input_data}
+    expanded["query"] = [str(food.get('query')) for food in input_data.get('foods', [])]
+    expanded["ingredients"] = [
+        expand_ingredient(minimal, results_by_id)
+        for minimal in response_json.get('ingredients', [])
+        if str(minimal.get('food_id')) in results_by_id
+    ]
+    return expanded